@@ -32,6 +32,7 @@ use xil_defaultlib.filter_input_fifo_1;
 use work.the_filter_package.all;
 
 
+-- @latency 2*IMG_WIDTH+12 to 2*IMG_WIDTH+15
 entity Convolve is
     Generic (
         FILTERMATRIX    : filtMASK      := (0,0,0,0,1,0,0,0,0);
@@ -43,24 +43,13 @@ end DReg;
 
 architecture Behavioral of DReg is
 
-    TYPE iBus is array(LENGTH-1 downto 0) of std_logic_vector(WIDTH-1 downto 0);
-    TYPE iBus_VALID is array(LENGTH-1 downto 0) of std_logic;
+    -- stage i holds the data and valid flag of i clock cycles ago
+    TYPE iBus is array(1 to LENGTH) of std_logic_vector(WIDTH-1 downto 0);
+    TYPE iBus_VALID is array(0 to LENGTH) of std_logic;
     --
     signal sRegBus : iBus;
     signal ValidsRegBus : iBus_VALID := (others => '0');
 
-    COMPONENT vector_dff_block
-        Generic (
-            WIDTH : positive
-        );
-        Port (
-            D   : in STD_LOGIC_VECTOR (WIDTH-1 downto 0);
-            CLK : in STD_LOGIC;
-            RST : in STD_LOGIC;
-            Q   : out STD_LOGIC_VECTOR (WIDTH-1 downto 0)
-        );
-    END COMPONENT;
-
     COMPONENT logic_dff_block
         Port (
             D   : in STD_LOGIC;
@@ -70,73 +59,33 @@ architecture Behavioral of DReg is
         );
     END COMPONENT;
 
-    constant depth_select_bits : positive := 2; -- specify depth
-
-    signal srl_select : std_logic_vector(LENGTH-1 downto 0); -- Dynamic select input to SRL
-    signal srl_out : std_logic_vector(WIDTH-1 downto 0); -- intermediate signal between srl and register
-
-    type array_slv is array (WIDTH-1 downto 0) of std_logic_vector(LENGTH-1 downto 0);
-    signal shift_reg : array_slv;
 begin
-    -- Add the below after begin keyword in architecture
+    -- data shift register without reset, inferred as SRL
     process (CLK)
     begin
        if CLK'event and CLK='1' then
-           for i in 0 to WIDTH-1 loop
-               shift_reg(i) <= shift_reg(i)(LENGTH-2 downto 0) & DREG_IN(i);
+           sRegBus(1) <= DREG_IN;
+           for i in 2 to LENGTH loop
+               sRegBus(i) <= sRegBus(i-1);
            end loop;
        end if;
     end process;
 
-    process(shift_reg,srl_select)
-    begin
-       for i in 0 to WIDTH-1 loop
-          srl_out(i) <= shift_reg(i)(LENGTH-3);
-       end loop;
-    end process;
+    DREG_OUT <= sRegBus(LENGTH);
+
+    ValidsRegBus(0) <= VALID_IN;
 
-    process(CLK)
+    validReg: for i in 1 to LENGTH generate
     begin
-      if CLK'event and CLK='1' then
-           DREG_OUT <= srl_out;
-      end if;
-    end process;
-    
-        validReg: for i in 1 to LENGTH-1 generate
-        begin
-            validdffLeft: if i = 1 generate
-            begin
-                valid_dff: component logic_dff_block
-                    port map (
-                        D => VALID_IN,
-                        CLK => CLK,
-                        RST => RST,
-                        Q => ValidsRegBus(i)
-                    );
-            end generate validdffLeft;
-            --
-            dffOthers: if (i > 1 AND i < LENGTH) generate
-            begin
-                valid_dff: component logic_dff_block
-                    port map (
-                        D => ValidsRegBus(i-1),
-                        CLK => CLK,
-                        RST => RST,
-                        Q => ValidsRegBus(i)
-                    );
-            end generate dffOthers;
-            --
-            dffRight: if i = LENGTH-1 generate
-            begin
-                valid_dff: component logic_dff_block
-                    port map (
-                        D => ValidsRegBus(i-1),
-                        CLK => CLK,
-                        RST => RST,
-                        Q => VALID_OUT
-                    );
-            end generate dffRight;
-        end generate validReg;
+        valid_dff: component logic_dff_block
+            port map (
+                D => ValidsRegBus(i-1),
+                CLK => CLK,
+                RST => RST,
+                Q => ValidsRegBus(i)
+            );
+    end generate validReg;
 
+    VALID_OUT <= ValidsRegBus(LENGTH);
     READY_OUT <= READY_IN;
 end architecture Behavioral;
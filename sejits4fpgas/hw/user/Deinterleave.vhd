@@ -0,0 +1,57 @@
+library IEEE;
+use IEEE.STD_LOGIC_1164.ALL;
+use IEEE.NUMERIC_STD.ALL;
+
+
+-- Demultiplex N_IO interleaved input streams transferred over one AXI stream.
+-- Word k of the input stream belongs to stream (k mod N_IO). After N_IO valid
+-- input words all streams hold one element; DATA_OUT then carries element i of
+-- stream i in bits ((i+1)*WIDTH)-1 downto i*WIDTH for one clock cycle.
+entity Deinterleave is
+    generic (
+        WIDTH    : positive := 32;
+        N_IO     : positive := 2
+    );
+    port (
+        CLK       : in std_logic;
+        RST       : in std_logic; -- high active
+        VALID_IN  : in std_logic; -- high active
+        READY_IN  : in std_logic;
+        DATA_IN   : in std_logic_vector(WIDTH-1 downto 0);
+        VALID_OUT : out std_logic; -- high active
+        READY_OUT : out std_logic;
+        DATA_OUT  : out std_logic_vector((N_IO*WIDTH)-1 downto 0)
+        );
+end Deinterleave;
+
+architecture arch of Deinterleave is
+    signal lanes   : std_logic_vector((N_IO*WIDTH)-1 downto 0) := (others => '0');
+    signal lane_id : natural range 0 to N_IO-1 := 0;
+    signal valid   : std_logic := '0';
+begin
+
+    process(CLK)
+    begin
+        if CLK'event and CLK = '1' then
+            if RST = '1' then
+                lane_id <= 0;
+                valid <= '0';
+            else
+                valid <= '0';
+                if VALID_IN = '1' then
+                    lanes(((lane_id+1)*WIDTH)-1 downto lane_id*WIDTH) <= DATA_IN;
+                    if lane_id = N_IO-1 then
+                        lane_id <= 0;
+                        valid <= '1';
+                    else
+                        lane_id <= lane_id + 1;
+                    end if;
+                end if;
+            end if;
+        end if;
+    end process;
+
+    DATA_OUT <= lanes;
+    VALID_OUT <= valid;
+    READY_OUT <= READY_IN;
+end architecture ; -- arch
@@ -6,6 +6,7 @@ library UNISIM;
 use UNISIM.VComponents.all;
 
 
+-- @latency 0
 entity LimitTo is
     Generic(
         VALID_BITS      : positive
@@ -6,6 +6,7 @@ library UNISIM;
 use UNISIM.VComponents.all;
 
 
+-- @latency 0
 entity Merge is
     Port (
         CLK             : in  std_logic;
@@ -29,6 +29,7 @@ Library UNISIM;
 use UNISIM.vcomponents.all;
 
 
+-- @latency 8
 entity MulBB is
     port (
         CLK       : in std_logic;
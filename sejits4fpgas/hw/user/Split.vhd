@@ -6,9 +6,11 @@ library UNISIM;
 use UNISIM.VComponents.all;
 
 
+-- @latency 0
 entity Split is
     Generic (
-        INDEX           : integer
+        INDEX           : integer;
+        LANE_WIDTH      : positive := 8
         );
     Port (
         CLK             : in  std_logic;
@@ -24,25 +26,8 @@ end Split;
 
 architecture split_behave of Split is
 begin
-    slice_0: if INDEX = 0 generate
-    begin
-        DATA_OUT <= (31 downto 8 => '0') & DATA_IN(7 downto 0);
-    end generate slice_0;
-
-    slice_1: if INDEX = 1 generate
-    begin
-        DATA_OUT <= (31 downto 8 => '0') & DATA_IN(15 downto 8);
-    end generate slice_1;
-
-    slice_2: if INDEX = 2 generate
-    begin
-        DATA_OUT <= (31 downto 8 => '0') & DATA_IN(23 downto 16);
-    end generate slice_2;
-
-    slice_3: if INDEX = 3 generate
-    begin
-        DATA_OUT <= (31 downto 8 => '0') & DATA_IN(31 downto 24);
-    end generate slice_3;
+    -- zero extended lane INDEX of LANE_WIDTH bits
+    DATA_OUT <= std_logic_vector(resize(unsigned(DATA_IN(((INDEX+1)*LANE_WIDTH)-1 downto INDEX*LANE_WIDTH)), 32));
 
     VALID_OUT <= VALID_IN;
     READY_OUT <= READY_IN;
@@ -9,6 +9,7 @@ Library UNISIM;
 use UNISIM.vcomponents.all;
 
 
+-- @latency 3
 entity SubBB is
     port (
         CLK       : in std_logic;
@@ -2,20 +2,20 @@ library IEEE;
 use IEEE.STD_LOGIC_1164.ALL;
 use IEEE.NUMERIC_STD.ALL;
 
-library UNIMACRO;
-use UNIMACRO.vcomponents.all;
-
-Library UNISIM;
-use UNISIM.vcomponents.all;
+use work.the_filter_package.all;
 
 
 -- All connected input streams must have the same width!
--- Input stream width = WIDTH/N_IO
+-- Input stream width = WIDTH, SYNC_IN holds N_IO streams, input i in bits
+-- ((i+1)*WIDTH)-1 downto i*WIDTH, SYNC_OUT and VALID_IN_PORT likewise.
+-- Input i is buffered by a FIFO of DEPTHS(i) words, built from block RAM
+-- (Bram_FIFO) if deeper than BRAM_DEPTH words, else by STD_FIFO.
 entity SyncNode is
     generic (
-        WIDTH    : positive := 32;
-        N_IO     : positive := 2;
-        DELAY    : positive := 1
+        WIDTH      : positive := 32;
+        N_IO       : positive := 2;
+        DEPTHS     : depth_array := (64, 64);
+        BRAM_DEPTH : positive := 64
     );
     port (
         CLK       : in std_logic;
@@ -36,24 +36,9 @@ architecture arch of SyncNode is
     signal EMPTY_log    : std_logic_vector(N_IO-1 downto 0);
     signal FULL_log     : std_logic_vector(N_IO-1 downto 0);
     --
-    TYPE READ_D is array(2 downto 0) of std_logic;
-    signal read_delay : READ_D;
     TYPE iBus_D is array(N_IO-1 downto 0) of std_logic_vector(WIDTH-1 downto 0);
     signal data_in : iBus_D;
     signal data_out : iBus_D;
-    --
-    component sync_fifo_32x64 is
-    port (
-        clk : IN STD_LOGIC;
-        rst : IN STD_LOGIC;
-        din : IN STD_LOGIC_VECTOR(31 DOWNTO 0);
-        wr_en : IN STD_LOGIC;
-        rd_en : IN STD_LOGIC;
-        dout : OUT STD_LOGIC_VECTOR(31 DOWNTO 0);
-        full : OUT STD_LOGIC;
-        empty : OUT STD_LOGIC
-        );
-    end component;
 
     function or_reduct(slv : in std_logic_vector) return std_logic is
         variable res_v : std_logic := '0';  -- Null slv vector will also return '1'
@@ -62,34 +47,79 @@ architecture arch of SyncNode is
             res_v := res_v or slv(i);
         end loop;
         return res_v;
-    end function;    
+    end function;
 begin
 
-    -- SyncRE <= VALID_IN AND READY_IN;
-
     fifos: for i in 0 to N_IO-1 generate
     begin
-        sync_fifo_inst : component sync_fifo_32x64
-        port map(
-            clk => CLK,
-            rst => RST,
-            din => data_in(i),
-            wr_en => VALID_IN_PORT(i),
-            rd_en => SyncRE,
-            dout => data_out(i),
-            full => FULL_log(i),
-            empty => EMPTY_log(i)
-        );
+        data_in(i) <= SYNC_IN(((i+1)*WIDTH)-1 downto i*WIDTH);
+        SYNC_OUT(((i+1)*WIDTH)-1 downto i*WIDTH) <= data_out(i);
+
+        -- first word fall through FIFO in block RAM
+        bram: if DEPTHS(i) > BRAM_DEPTH generate
+        begin
+            fifo_inst : entity work.Bram_FIFO
+            generic map(
+                width => WIDTH,
+                dept => DEPTHS(i)
+            )
+            port map(
+                clk => CLK,
+                din => data_in(i),
+                rd_en => SyncRE,
+                rst => RST,
+                wr_en => VALID_IN_PORT(i),
+                data_count => open,
+                dout => data_out(i),
+                empty => EMPTY_log(i),
+                full => FULL_log(i),
+                prog_full => open
+            );
+        end generate bram;
+
+        -- STD_FIFO with an output register prefetching the first word
+        distributed: if DEPTHS(i) <= BRAM_DEPTH generate
+            signal fifo_empty : std_logic;
+            signal fifo_read : std_logic;
+            signal out_valid : std_logic := '0';
+        begin
+            fifo_inst : entity work.STD_FIFO
+            generic map(
+                DATA_WIDTH => WIDTH,
+                FIFO_DEPTH => DEPTHS(i)
+            )
+            port map(
+                CLK => CLK,
+                RST => RST,
+                WriteEn => VALID_IN_PORT(i),
+                DataIn => data_in(i),
+                ReadEn => fifo_read,
+                DataOut => data_out(i),
+                Empty => fifo_empty,
+                Full => FULL_log(i)
+            );
+
+            fifo_read <= (NOT fifo_empty) AND ((NOT out_valid) OR SyncRE);
+
+            prefetch: process(CLK)
+            begin
+                if rising_edge(CLK) then
+                    if RST = '1' then
+                        out_valid <= '0';
+                    elsif fifo_read = '1' then
+                        out_valid <= '1';
+                    elsif SyncRE = '1' then
+                        out_valid <= '0';
+                    end if;
+                end if;
+            end process;
+
+            EMPTY_log(i) <= NOT out_valid;
+        end generate distributed;
     end generate fifos;
 
-    data_in(0) <= SYNC_IN(31 downto 0);
-    data_in(1) <= SYNC_IN(63 downto 32);
-   
     SyncRE <= (NOT or_reduct(EMPTY_log)) AND READY_IN;
-
-    SYNC_OUT(31 downto 0) <= data_out(0);
-    SYNC_OUT(63 downto 32) <= data_out(1);
-    --    
+    --
     READY_OUT <= READY_IN AND (NOT or_reduct(FULL_log));
-    VALID_OUT <= SyncRE; 
+    VALID_OUT <= SyncRE;
 end architecture ; -- arch
@@ -32,7 +32,7 @@ architecture Behavioral of Bram_FIFO is
   signal bram     				: bram_type; -- := (others => x"CDCDCDCD");	-- default value only for debug purpose
   signal read_ptr 				: integer range 0 to dept-1;
   signal write_ptr				: integer range 0 to dept-1;
-  signal counter  				: integer range 0 to dept-1;
+  signal counter  				: integer range 0 to dept; -- dept when full
   signal read_data     		: std_logic_vector(width-1 downto 0);
   signal cache_data     	: std_logic_vector(width-1 downto 0);
   signal read_cache_data 	: std_logic;
@@ -17,6 +17,8 @@ package the_filter_package is
 -- 			);
 --		generic ( size_of_filter : integer := 3 );
 		type filtMASK is array (8 downto 0) of integer range 20 downto -20;
+		-- FIFO depth of each input of a SyncNode
+		type depth_array is array (natural range <>) of positive;
 
 end package the_filter_package;
 
@@ -0,0 +1,411 @@
+"""Dependency and interface index of the prebuilt VHDL basic block library.
+
+Besides ports and generics the index holds the latency of every entity
+annotated with a comment directly above its declaration::
+
+    -- @latency 2*IMG_WIDTH+12 to 2*IMG_WIDTH+15
+    entity Convolve is
+
+The latency is given in clock cycles from VALID_IN to VALID_OUT, either as a
+single expression or as a range "MIN to MAX". Expressions are integer
+arithmetic of constants and generic names.
+"""
+import ast
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+from errors import TransformationError
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+COMMENT = re.compile(r"--.*$", re.MULTILINE)
+ENTITY_DECLARATION = re.compile(r"^\s*entity\s+(\w+)\s+is\b", re.IGNORECASE | re.MULTILINE)
+PACKAGE_DECLARATION = re.compile(r"^\s*package\s+(?!body\b)(\w+)\s+is\b", re.IGNORECASE | re.MULTILINE)
+USE_CLAUSE = re.compile(r"\buse\s+work\.(\w+)", re.IGNORECASE)
+COMPONENT_DECLARATION = re.compile(r"^\s*component\s+(\w+)", re.IGNORECASE | re.MULTILINE)
+INSTANTIATION = re.compile(r"^\s*\w+\s*:\s*(?:component\s+|entity\s+work\.)?(\w+)\s+(?:generic|port)\s+map\b",
+                           re.IGNORECASE | re.MULTILINE)
+ENTITY_HEADER = re.compile(r"\bentity\s+(\w+)\s+is\b(.*?)\bend\b", re.IGNORECASE | re.DOTALL)
+GENERIC_CLAUSE = re.compile(r"\bgeneric\s*\(", re.IGNORECASE)
+PORT_CLAUSE = re.compile(r"\bport\s*\(", re.IGNORECASE)
+LATENCY_ANNOTATION = re.compile(r"^[ \t]*--[ \t]*@latency[ \t]+(.+?)[ \t]*\r?\n\s*entity\s+(\w+)\s+is\b",
+                                re.IGNORECASE | re.MULTILINE)
+LATENCY_RANGE = re.compile(r"\s+to\s+", re.IGNORECASE)
+ARRAY_TYPE = re.compile(r"\btype\s+(\w+)\s+is\s+array\s*\(\s*(\d+)\s+(?:downto|to)\s+(\d+)\s*\)\s+of\s+(\w+)"
+                        r"(?:\s+range\s+(-?\d+)\s+(?:downto|to)\s+(-?\d+))?", re.IGNORECASE)
+
+# prebuilt VHDL basic blocks
+BASIC_BLOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hw", "user", "")
+
+
+def scan_vhdl(src):
+    """Return design units declared and referenced by the VHDL source src.
+
+    The scanner only looks at entity and package declarations, use clauses
+    of the work library, component declarations and instantiations. It does
+    not parse VHDL.
+
+    :param src: VHDL source code
+    :type src: str
+    :returns: tuple -- (list of declared unit names, set of lower case referenced unit names)
+    """
+    src = COMMENT.sub("", src)
+    declared = ENTITY_DECLARATION.findall(src) + PACKAGE_DECLARATION.findall(src)
+    referenced = set(name.lower() for pattern in (USE_CLAUSE, COMPONENT_DECLARATION, INSTANTIATION)
+                     for name in pattern.findall(src))
+    return declared, referenced - set(name.lower() for name in declared)
+
+
+def _interface_list(header, clause):
+    """Return declarations of the generic or port clause of an entity header.
+
+    :returns: list of list -- [name, mode and type, default value or None] per declared name
+    """
+    match = clause.search(header)
+    if match is None:
+        return []
+    # content of the balanced parentheses of the clause
+    depth = 0
+    for end in range(match.end() - 1, len(header)):
+        depth += {"(": 1, ")": -1}.get(header[end], 0)
+        if depth == 0:
+            break
+    body = header[match.end():end]
+    items = []
+    depth = 0
+    item = ""
+    for char in body + ";":
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if char == ";" and depth == 0:
+            items.append(item)
+            item = ""
+        else:
+            item += char
+    declarations = []
+    for item in items:
+        names, _, rest = item.partition(":")
+        if not _:
+            continue
+        subtype, _, default = rest.partition(":=")
+        for name in names.split(","):
+            declarations.append([name.strip(), " ".join(subtype.split()), " ".join(default.split()) or None])
+    return declarations
+
+
+def parse_entities(src):
+    """Return generics, ports and latency of the entities declared in the VHDL source src.
+
+    :returns: dict -- entity name -> {"generics": [[name, type, default]], "ports": [[name, direction, type]], "latency": [min expression, max expression] or None}
+    """
+    latencies = {}
+    for expressions, name in LATENCY_ANNOTATION.findall(src):
+        bounds = LATENCY_RANGE.split(expressions, 1)
+        latencies[name.lower()] = [bounds[0], bounds[-1]]
+    src = COMMENT.sub("", src)
+    entities = {}
+    for match in ENTITY_HEADER.finditer(src):
+        header = match.group(2)
+        ports = []
+        for name, subtype, _ in _interface_list(header, PORT_CLAUSE):
+            direction, _, vhdl_type = subtype.partition(" ")
+            ports.append([name, direction.lower(), vhdl_type])
+        entities[match.group(1)] = {"generics": _interface_list(header, GENERIC_CLAUSE),
+                                    "ports": ports,
+                                    "latency": latencies.get(match.group(1).lower())}
+    return entities
+
+
+def parse_types(src):
+    """Return the constrained array types declared in the VHDL source src.
+
+    :returns: dict -- type name -> {"size": int, "item": item type, "min": int or None, "max": int or None}
+    """
+    src = COMMENT.sub("", src)
+    types = {}
+    for name, left, right, item, low, high in ARRAY_TYPE.findall(src):
+        bounds = sorted(int(b) for b in (low, high) if b)
+        types[name] = {"size": abs(int(left) - int(right)) + 1,
+                       "item": item,
+                       "min": bounds[0] if bounds else None,
+                       "max": bounds[-1] if bounds else None}
+    return types
+
+
+def evaluate(expression, values):
+    """Return value of the integer expression with generic names bound to values.
+
+    Only integer constants, names and the operators + - * / are allowed.
+
+    :param expression: expression of a latency annotation
+    :type expression: str
+    :param values: generic name -> int, names are case insensitive
+    :type values: dict
+    :raises TransformationError: raised if the expression is malformed or a name is unbound
+    """
+    values = dict((name.lower(), value) for name, value in values.items())
+    operators = {ast.Add: lambda a, b: a + b,
+                 ast.Sub: lambda a, b: a - b,
+                 ast.Mult: lambda a, b: a * b,
+                 ast.Div: lambda a, b: a // b}
+
+    def _eval(node):
+        if isinstance(node, ast.Num) and isinstance(node.n, (int, long)):
+            return node.n
+        elif isinstance(node, ast.Name):
+            if node.id.lower() not in values:
+                raise TransformationError("Value of generic {} unknown in '{}'".format(node.id, expression))
+            return values[node.id.lower()]
+        elif isinstance(node, ast.BinOp) and type(node.op) in operators:
+            return operators[type(node.op)](_eval(node.left), _eval(node.right))
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -_eval(node.operand)
+        raise TransformationError("Unsupported latency expression '{}'".format(expression))
+
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError:
+        raise TransformationError("Unsupported latency expression '{}'".format(expression))
+    return _eval(tree.body)
+
+
+def scan_file(path):
+    """Return index entry of the VHDL file path.
+
+    :returns: dict -- content hash, declared and referenced units and entity interfaces of the file
+    """
+    with open(path, "rb") as vhdl_file:
+        src = vhdl_file.read()
+    stat = os.stat(path)
+    declared, referenced = scan_vhdl(src)
+    return {"mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": hashlib.sha256(src).hexdigest(),
+            "declared": declared,
+            "referenced": sorted(referenced),
+            "entities": parse_entities(src),
+            "types": parse_types(src)}
+
+
+def block_instances(modules):
+    """Return entity and generic map of all components instantiated in modules.
+
+    :param modules: port finalized VHDL IR modules
+    :type modules: list of VhdlModule
+    :returns: set of tuple -- (entity name, tuple of (generic name, value) pairs sorted by name)
+    """
+    instances = set()
+    visited = set()
+    stack = [node for module in modules for node in module.architecture]
+    while stack:
+        node = stack.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        stack.extend(getattr(node, "prev", []))
+        library = getattr(node, "library", "")
+        if library.lower().startswith("work."):
+            generics = tuple(sorted((g.name, str(g.value)) for g in node.generic))
+            instances.add((library[len("work."):], generics))
+    return instances
+
+
+def used_units(modules):
+    """Return names of the units of the work library made visible by the use clauses of modules.
+
+    :param modules: VHDL IR modules
+    :type modules: list of VhdlModule
+    :returns: set of str -- unit names, e.g. the_filter_package for use work.the_filter_package.all
+    """
+    units = set()
+    for module in modules:
+        for library in module.libraries or []:
+            for clause in library.sublib:
+                parts = clause.split(".")
+                if len(parts) > 1 and parts[0].lower() == "work":
+                    units.add(parts[1])
+    return units
+
+
+class BasicBlockLibrary(object):
+
+    """Index of the design units declared and referenced by a set of VHDL files.
+
+    Unit names are case insensitive like in VHDL. References to units not
+    declared in the files, e.g. vendor primitives or IP cores, are ignored.
+    """
+
+    def __init__(self, vhdl_files, entries=None):
+        """Index vhdl_files.
+
+        :param vhdl_files: paths of the VHDL files of the library
+        :type vhdl_files: list of str
+        :param entries: index entries of the files as returned by scan_file, files are scanned if missing
+        :type entries: dict
+        """
+        entries = entries or {}
+        self.files = list(vhdl_files)
+        self.units = {}  # lower case unit name -> path of declaring file
+        self.names = {}  # lower case unit name -> declared unit name
+        self.declared = {}  # path -> set of lower case declared unit names
+        self.references = {}  # path -> set of lower case referenced unit names
+        self.digests = {}  # path -> SHA-256 hex digest of the content
+        self.entities = {}  # lower case entity name -> {"name", "path", "generics", "ports", "latency"}
+        self.types = {}  # lower case type name -> {"name", "size", "item", "min", "max"}
+        for path in self.files:
+            entry = entries[path] if path in entries else scan_file(path)
+            self.add(path, entry["declared"], entry["referenced"])
+            self.digests[path] = entry["sha256"]
+            for name, interface in entry["entities"].items():
+                self.entities[name.lower()] = dict(interface, name=name, path=path)
+            for name, array_type in entry["types"].items():
+                self.types[name.lower()] = dict(array_type, name=name)
+
+    def add(self, path, declared, referenced):
+        """Add file path declaring and referencing the given units to the index."""
+        self.declared[path] = set(name.lower() for name in declared)
+        self.references[path] = set(referenced)
+        for name in declared:
+            self.units[name.lower()] = path
+            self.names[name.lower()] = name
+
+    def __contains__(self, name):
+        return name.lower() in self.units
+
+    def entity(self, name):
+        """Return interface of entity name.
+
+        :raises TransformationError: raised if no file of the library declares the entity
+        """
+        try:
+            return self.entities[name.lower()]
+        except KeyError:
+            raise TransformationError("Entity {} not in basic block library".format(name))
+
+    def closure(self, names):
+        """Return paths of the files declaring names and all units they reference, transitively.
+
+        :param names: names of the required units
+        :type names: iterable of str
+        :returns: list of str -- paths in library order
+        """
+        required = set()
+        stack = [name.lower() for name in names]
+        visited = set()
+        while stack:
+            name = stack.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+            path = self.units.get(name)
+            if path is None:
+                logger.debug("Unit %s not in basic block library" % name)
+                continue
+            required.add(path)
+            stack.extend(self.references[path])
+        return [path for path in self.files if path in required]
+
+
+class LibraryIndex(object):
+
+    """Index entries of VHDL files persisted across processes.
+
+    An entry is reused as long as modification time and size of its file are
+    unchanged, so every library file is read and parsed only once.
+    """
+
+    VERSION = 2
+
+    def __init__(self, index_path=None):
+        """Load index.
+
+        :param index_path: JSON file holding the index, default from app.config
+        :type index_path: str
+        """
+        if index_path is None:
+            index_path = config.get("BasicBlocks", "index_path")
+        self.index_path = os.path.expanduser(index_path)
+        self._entries = {}
+        self._dirty = False
+        try:
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+            if index.get("version") == self.VERSION:
+                self._entries = index["files"]
+        except (IOError, ValueError, KeyError):
+            # missing or corrupt, rebuilt on demand
+            pass
+
+    def entry(self, path):
+        """Return index entry of path, scanning the file only if it changed."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            logger.info("Scan basic block %s" % path)
+            entry = scan_file(path)
+            self._entries[path] = entry
+            self._dirty = True
+        return entry
+
+    def save(self):
+        """Write index if it changed, atomically so concurrent processes read complete indexes."""
+        if not self._dirty:
+            return
+        index_dir = os.path.dirname(self.index_path)
+        try:
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=index_dir)
+            with os.fdopen(fd, "w") as index_file:
+                json.dump({"version": self.VERSION, "files": self._entries}, index_file)
+            os.rename(tmp_path, self.index_path)
+            self._dirty = False
+        except (IOError, OSError) as e:
+            logger.warning("Could not save basic block index %s: %s" % (self.index_path, e))
+
+
+# index shared by all libraries of the process
+_library_index = None
+# library path -> (file signatures, BasicBlockLibrary)
+_libraries = {}
+
+
+def get_library(path=BASIC_BLOCK_PATH):
+    """Return index of all VHDL files in directory path.
+
+    The index is built from the persisted library index and kept for the
+    process until a file of the directory is added, removed or modified.
+    """
+    global _library_index
+    if _library_index is None:
+        _library_index = LibraryIndex()
+    vhdl_files = sorted(os.path.abspath(fn) for fn in glob.glob(path + "*.vhd"))
+    signatures = []
+    for fn in vhdl_files:
+        stat = os.stat(fn)
+        signatures.append((fn, stat.st_mtime, stat.st_size))
+    cached = _libraries.get(path)
+    if cached is not None and cached[0] == signatures:
+        return cached[1]
+    entries = dict((fn, _library_index.entry(fn)) for fn in vhdl_files)
+    _library_index.save()
+    library = BasicBlockLibrary(vhdl_files, entries)
+    _libraries[path] = (signatures, library)
+    return library
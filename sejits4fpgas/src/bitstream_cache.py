@@ -0,0 +1,216 @@
+"""Content addressed cache of synthesis results."""
+import hashlib
+import json
+import logging
+import fnmatch
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+# vivado template project shipped with the package
+TEMPLATE_PROJECT_PATH = os.path.dirname(__file__) + config.get("Paths", "vivado_proj_path")
+# results of earlier runs in the template project, not part of its sources
+TEMPLATE_IGNORE = ("template_project", "*.runs", "*.cache", "*.hw", "*.sim", "*.sav")
+UNKNOWN_VERSION = "unknown"
+
+
+def tool_version_of(command):
+    """Return first line printed by the version command of the synthesis tool or "unknown" if it can not be run.
+
+    :param command: command line printing the tool version, e.g. "vivado -version"
+    :type command: str
+    """
+    try:
+        output = subprocess.check_output(shlex.split(command), stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning("Could not determine synthesis tool version with %s: %s" % (command, e))
+        return UNKNOWN_VERSION
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    return lines[0] if lines else UNKNOWN_VERSION
+
+
+def template_digest(template_dir):
+    """Return SHA-256 hex digest of the names and contents of the source files of the template project.
+
+    :param template_dir: Vivado template project, its sources are the top-level wrapper, TCL scripts and constraints
+    :type template_dir: str
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(template_dir):
+        dirs[:] = sorted(d for d in dirs if not any(fnmatch.fnmatch(d, pattern) for pattern in TEMPLATE_IGNORE))
+        for file_name in sorted(files):
+            if any(fnmatch.fnmatch(file_name, pattern) for pattern in TEMPLATE_IGNORE):
+                continue
+            path = os.path.join(root, file_name)
+            with open(path, "rb") as template_file:
+                src = template_file.read()
+            digest.update(os.path.relpath(path, template_dir) + "\0" + str(len(src)) + "\0")
+            digest.update(src)
+    return digest.hexdigest()
+
+
+class BitstreamCache(object):
+
+    """Cache of bitstreams and synthesis artifacts keyed by the synthesized design.
+
+    The key is the SHA-256 digest of the names and contents of all VHDL files
+    linked into the Vivado project (generated files and copies of the prebuilt
+    hw/user blocks), the sources of the template project, the FPGA part and
+    the synthesis tool version. Entries are directories named by the key.
+    They are written to a temporary directory first and renamed into place,
+    so several processes or machines can share one cache directory.
+
+    A tool version of "auto" is asked from the tool. While the version is
+    unknown, no entry is served, as it may stem from another version.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, cache_dir=None, tool_version=None, template_dir=None, part=None):
+        """Initialize cache.
+
+        :param cache_dir: directory holding the cache entries, default from app.config
+        :type cache_dir: str
+        :param tool_version: version of the synthesis tool or "auto", default from app.config
+        :type tool_version: str
+        :param template_dir: Vivado template project, default is the packaged project, "" if not used
+        :type template_dir: str
+        :param part: FPGA part, default from app.config
+        :type part: str
+        """
+        if cache_dir is None:
+            cache_dir = config.get("BitstreamCache", "cache_dir")
+        if tool_version is None:
+            tool_version = config.get("BitstreamCache", "tool_version")
+        if template_dir is None:
+            template_dir = TEMPLATE_PROJECT_PATH
+        if part is None:
+            part = config.get("Synthesis", "part")
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self._tool_version = tool_version
+        self.template_dir = template_dir
+        self.part = part
+
+    @property
+    def tool_version(self):
+        """Return version of the synthesis tool, asked from the tool on first use if configured as "auto"."""
+        if self._tool_version == "auto":
+            self._tool_version = tool_version_of(config.get("BitstreamCache", "tool_version_command"))
+        return self._tool_version
+
+    def key(self, vhdl_files, parameters=None):
+        """Return cache key of a project consisting of vhdl_files.
+
+        :param vhdl_files: paths of all VHDL files of the project
+        :type vhdl_files: list of str
+        :param parameters: further synthesis settings distinguishing entries, must be JSON serializable
+        :type parameters: dict
+        :returns: str -- hex digest
+        """
+        digest = hashlib.sha256()
+        digest.update("tool:" + self.tool_version + "\0")
+        digest.update("part:" + self.part + "\0")
+        if self.template_dir:
+            digest.update("template:" + template_digest(self.template_dir) + "\0")
+        if parameters:
+            digest.update("parameters:" + json.dumps(parameters, sort_keys=True) + "\0")
+        # sort by file name, the link order does not change the netlist
+        for path in sorted(vhdl_files, key=os.path.basename):
+            with open(path, "rb") as vhdl_file:
+                src = vhdl_file.read()
+            digest.update(os.path.basename(path) + "\0" + str(len(src)) + "\0")
+            digest.update(src)
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """Return artifact paths of entry key or None on a cache miss.
+
+        :returns: dict -- artifact file name -> absolute path
+        """
+        if self.tool_version == UNKNOWN_VERSION:
+            logger.warning("Synthesis tool version unknown, bitstream cache not used")
+            return None
+        artifacts = self._artifacts(key)
+        logger.info("Bitstream cache %s: %s" % ("miss" if artifacts is None else "hit", key))
+        return artifacts
+
+    def _artifacts(self, key):
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, self.MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        return dict((name, os.path.join(entry_dir, name)) for name in manifest["artifacts"])
+
+    def store(self, key, artifacts, sources=None):
+        """Copy artifacts into cache entry key and return their cached paths.
+
+        :param key: cache key returned by key()
+        :type key: str
+        :param artifacts: paths of bitstream and further synthesis results
+        :type artifacts: list of str
+        :param sources: paths of the VHDL files the key was computed of, recorded for inspection
+        :type sources: list of str
+        :returns: dict -- artifact file name -> absolute path
+        """
+        if self.tool_version == UNKNOWN_VERSION:
+            # an existing entry may stem from another tool version
+            self.evict(key)
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # created concurrently
+                pass
+        tmp_dir = tempfile.mkdtemp(prefix=key + ".", dir=self.cache_dir)
+        names = []
+        for path in artifacts:
+            shutil.copy2(path, tmp_dir)
+            names.append(os.path.basename(path))
+        manifest = {"key": key,
+                    "tool_version": self.tool_version,
+                    "created": time.time(),
+                    "artifacts": names,
+                    "sources": [os.path.basename(path) for path in sources or []]}
+        with open(os.path.join(tmp_dir, self.MANIFEST), "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        try:
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # entry stored concurrently by another process, keep that one
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            logger.info("Stored bitstream cache entry: %s" % key)
+        return self._artifacts(key)
+
+    def evict(self, key):
+        """Remove entry key from the cache."""
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+
+# caches shared by all hardware modules of the process
+bitstream_cache = BitstreamCache()
+# out-of-context runs do not use the template project
+checkpoint_cache = BitstreamCache(cache_dir=config.get("Synthesis", "checkpoint_dir"), template_dir="")
@@ -121,6 +121,9 @@ class VhdlCodegen(ast.NodeVisitor):
             return []
 
     def visit_VhdlDReg(self, node):
+        # taps of a shared delay line feed several nodes
+        if id(node) in self.processed_nodes:
+            return []
         temp_prev_component = [p for p in map(self.visit, node.prev) if p is not None]
         prev_component = []
         for i in temp_prev_component:
@@ -143,6 +146,7 @@ class VhdlCodegen(ast.NodeVisitor):
                                                   port_map=port_src) + "\n"
         self.architecture_body += "\n" + component
         #
+        self.processed_nodes.add(id(node))
         prev_component.append(component)
         return prev_component
 
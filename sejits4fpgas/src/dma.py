@@ -0,0 +1,160 @@
+"""Pool of reusable DMA buffers for the hardware call path."""
+import logging
+import mmap
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+
+def _root_buffer(arr):
+    """Return the object finally owning the memory of arr."""
+    while isinstance(arr, np.ndarray):
+        arr = arr.base
+    return arr
+
+
+class DmaBufferPool(object):
+
+    """Pool of page-aligned, contiguous uint32 buffers backed by anonymous mmaps.
+
+    Buffers are handed out as NumPy arrays with the requested shape. Released
+    buffers are kept in a free list keyed by their page-rounded size and reused
+    by the next acquire of a matching size, so steady-state streaming of equally
+    sized frames does not allocate memory.
+    """
+
+    def __init__(self, max_free_buffers=None):
+        """Initialize pool.
+
+        :param max_free_buffers: number of released buffers kept per size, default from app.config
+        :type max_free_buffers: int
+        """
+        if max_free_buffers is None:
+            max_free_buffers = config.getint("DMA", "max_free_buffers")
+        self.max_free_buffers = max_free_buffers
+        self._free = defaultdict(list)  # slab size -> list of mmaps
+        self._slabs = {}  # id(mmap) -> mmap of all buffers handed out by this pool
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _slab_size(n_words):
+        n_bytes = max(n_words, 1) * np.dtype(np.uint32).itemsize
+        return -(-n_bytes // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    def owns(self, arr):
+        """Return True if arr is a view of a buffer of this pool."""
+        return id(_root_buffer(arr)) in self._slabs
+
+    def mapped_size(self, arr):
+        """Return size in bytes of the mapping backing the pool buffer arr."""
+        return len(_root_buffer(arr))
+
+    def acquire(self, shape):
+        """Return a uint32 buffer of the given shape.
+
+        :param shape: shape of the buffer
+        :type shape: tuple of int or int
+        :returns: np.ndarray -- page-aligned, C-contiguous uint32 array
+        """
+        n_words = int(np.prod(shape))
+        size = self._slab_size(n_words)
+        with self._lock:
+            if self._free[size]:
+                slab = self._free[size].pop()
+            else:
+                logger.info("Allocate DMA buffer of %d bytes" % size)
+                slab = mmap.mmap(-1, size)
+                self._slabs[id(slab)] = slab
+        return np.frombuffer(slab, dtype=np.uint32, count=n_words).reshape(shape)
+
+    def release(self, arr):
+        """Return buffer to the pool; arr and its views must not be used afterwards.
+
+        Releasing a buffer that is not handed out, e.g. a second time, has no effect.
+        """
+        slab = _root_buffer(arr)
+        with self._lock:
+            if id(slab) not in self._slabs or any(free is slab for free in self._free[len(slab)]):
+                return
+            if len(self._free[len(slab)]) < self.max_free_buffers:
+                self._free[len(slab)].append(slab)
+            else:
+                del self._slabs[id(slab)]
+
+    def fill(self, frame):
+        """Return pool buffer holding frame converted to uint32 with a single strided copy.
+
+        :param frame: input data of any shape, dtype and memory layout
+        :type frame: np.ndarray
+        """
+        buf = self.acquire(np.shape(frame))
+        np.copyto(buf, frame, casting="unsafe")
+        return buf
+
+    def interleave(self, frames, pixel_width=32):
+        """Return pool buffer holding the elements of all frames interleaved.
+
+        Element k of frame i is stored at flat position k * len(frames) + i, the
+        layout expected by the Deinterleave component of the hardware wrapper.
+        With a pixel_width below 32 bit, 32 / pixel_width consecutive elements
+        of a frame share one word, element k in the lowest bits. Each frame is
+        converted with one strided copy.
+
+        :param frames: input data of equal shape
+        :type frames: list of np.ndarray
+        :param pixel_width: bits per element in the stream words (8, 16 or 32)
+        :type pixel_width: int
+        :returns: np.ndarray -- buffer of shape frames[0].shape + (len(frames),) for 32 bit elements, else of shape (words per frame, len(frames))
+        """
+        if pixel_width == 32:
+            shape = np.shape(frames[0]) + (len(frames),)
+            buf = self.acquire(shape)
+            for i, frame in enumerate(frames):
+                np.copyto(buf[..., i], frame, casting="unsafe")
+            return buf
+        n_lanes = 32 // pixel_width
+        n_pixels = int(np.prod(np.shape(frames[0])))
+        n_words = -(-n_pixels // n_lanes)
+        buf = self.acquire((n_words, len(frames)))
+        # little endian: pixel 0 of a word lies in its lowest bits
+        pixels = buf.view(np.dtype("<u%d" % (pixel_width // 8))).reshape(n_words, len(frames), n_lanes)
+        for i, frame in enumerate(frames):
+            frame = np.ravel(frame)
+            if n_pixels != n_words * n_lanes:
+                frame = np.concatenate((frame, np.zeros(n_words * n_lanes - n_pixels, dtype=frame.dtype)))
+            np.copyto(pixels[:, i, :], frame.reshape(n_words, n_lanes), casting="unsafe")
+        return buf
+
+    def preallocate(self, shape, count):
+        """Put count buffers of the given shape into the free list."""
+        bufs = [self.acquire(shape) for _ in range(count)]
+        for buf in bufs:
+            self.release(buf)
+
+    def clear(self):
+        """Drop all free buffers."""
+        with self._lock:
+            for slabs in self._free.values():
+                for slab in slabs:
+                    del self._slabs[id(slab)]
+            self._free.clear()
+
+
+# pool shared by all hardware modules of the process
+dma_pool = DmaBufferPool()
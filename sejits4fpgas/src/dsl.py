@@ -1,6 +1,7 @@
 import ast
 import ctypes
 import logging
+import re
 from collections import namedtuple
 
 import numpy as np
@@ -9,15 +10,21 @@ from nodes import GenericInfo
 from nodes import PortInfo
 from nodes import VhdlAssignment
 from nodes import VhdlComponent
+from nodes import VhdlConcatenation
+from nodes import VhdlConstant
 from nodes import VhdlFile
 from nodes import VhdlLibrary
 from nodes import VhdlModule
 from nodes import VhdlReturn
 from nodes import VhdlSignal
+from nodes import VhdlSignalSplit
 from nodes import VhdlSink
 from nodes import VhdlSource
 from types import VhdlType
 from errors import TransformationError
+from emulator import VhdlEmulator
+from sejits4fpgas.src.bb_library import evaluate
+from sejits4fpgas.src.bb_library import get_library
 from sejits4fpgas.src.config import config
 from vhdl_ctree.c.nodes import BinaryOp
 from vhdl_ctree.c.nodes import Constant
@@ -43,13 +50,69 @@ logger.addHandler(ch)
 
 LF_Data = namedtuple("LF_Data", ["lineno", "func"])
 
+# ports every basic block has, wired by the VhdlPortTransformer
+CONTROL_PORTS = ("CLK", "RST", "VALID_IN", "READY_IN", "VALID_OUT", "READY_OUT")
+VECTOR_TYPE = re.compile(r"std_logic_vector\s*\(\s*(\d+)\s+downto\s+(\d+)\s*\)", re.IGNORECASE)
+SCALAR_TYPES = {"integer": VhdlType.VhdlInteger,
+                "natural": VhdlType.VhdlInteger,
+                "positive": VhdlType.VhdlPositive,
+                "string": VhdlType.VhdlString}
+
+
+class LiftingContext(object):
+    """Basic block functions lifted during one transformation of a kernel.
+
+    Every DSLTransformer run owns its context, so kernels can be specialized
+    concurrently and no state outlives the transformation.
+    """
+
+    def __init__(self):
+        self.functions = []
+        self.func_count = 0
+
+    def lift(self, lineno, func_def):
+        """Add function definition of the basic block called in line lineno."""
+        self.functions.append(LF_Data(lineno, func_def))
+
+    def gen_func_name(self, func_name):
+        """Return func_name with a suffix unique within this context."""
+        name = "%s_%s" % (func_name, str(self.func_count))
+        self.func_count += 1
+        return name
+
+    def lifted_functions(self):
+        """Return lifted functions in the order the VhdlIRTransformer pops them."""
+        # group and reverse
+        line_dict = {}
+        line_nbrs = []
+        #
+        for lf in self.functions:
+            if lf.lineno in line_dict:
+                line_dict[lf.lineno].append(lf.func)
+            else:
+                line_dict[lf.lineno] = [lf.func]
+                line_nbrs.append(lf.lineno)
+        #
+        line_nbrs.sort()
+        line_nbrs.reverse()
+        #
+        ret = []
+        for ln in line_nbrs:
+            data = line_dict[ln]
+            data.reverse()
+            ret.extend(data)
+        #
+        return ret
+
 
 class BasicBlockBaseTransformer(object):
-    lifted_functions = []
-    func_count = 0
 
-    def __init__(self, backend="C", **kwargs):
+    # entity of the basic block in the hw/user library, VHDL backend only
+    library = None
+
+    def __init__(self, backend="C", context=None, **kwargs):
         self.backend = backend.lower()
+        self.context = context if context is not None else LiftingContext()
         self.kwargs = kwargs
 
     def convert(self, node):
@@ -61,17 +124,15 @@ class BasicBlockBaseTransformer(object):
                         % self.backend
             raise TransformationError(error_msg)
 
-        func_def = func_def_getter(**self.kwargs)
-        # add function definition to class variable lifted_functions
-        BasicBlockBaseTransformer.lifted_functions.append(LF_Data(node.lineno, func_def))
+        func_def = func_def_getter(call_args=node.args, **self.kwargs)
+        # add function definition to lifting context of the transformation
+        self.context.lift(node.lineno, func_def)
         # return C node FunctionCall
         return FunctionCall(SymbolRef(func_def.name), node.args)
 
     @property
     def gen_func_name(self):
-        name = "%s_%s" % (self.func_name, str(type(self).func_count))
-        type(self).func_count += 1
-        return name
+        return self.context.gen_func_name(self.func_name)
 
     @property
     def func_name(self):
@@ -81,12 +142,87 @@ class BasicBlockBaseTransformer(object):
     def get_func_def_c(self, *args, **kwargs):
         raise NotImplementedError("Class %s should override get_func_def_c()" % type(self))
 
-    def get_func_def_vhdl(self, *args, **kwargs):
-        raise NotImplementedError("Class %s should override get_func_def_vhdl()" % type(self))
+    def get_func_def_vhdl(self, call_args=(), **kwargs):
+        """Return VHDL interpretation of the BasicBlock.
+
+        Ports, generics and latency are taken from the declaration of the
+        entity in the basic block library. The call passes the generics first,
+        in declaration order, followed by one argument per data input port.
+        Trailing generics with a default value may be omitted.
+
+        :param call_args: arguments of the basic block call
+        :type call_args: list of ast.AST
+        """
+        if self.library is None:
+            raise NotImplementedError("Class %s should define library" % type(self))
+        data_width = kwargs.get("DataWidth")
+        # stats every library file, fetched once per call
+        library = get_library()
+        entity = library.entity(self.library[len("work."):])
+        #
+        data_ports = [(name, direction, vhdl_type) for name, direction, vhdl_type in entity["ports"]
+                      if name.upper() not in CONTROL_PORTS]
+        # names of the JSON library index are unicode
+        inport_info = [PortInfo(str(name), "in", self._vhdl_type(vhdl_type, library, data_width))
+                       for name, direction, vhdl_type in data_ports if direction == "in"]
+        outport_info = [PortInfo(str(name), "out", self._vhdl_type(vhdl_type, library, data_width))
+                        for name, direction, vhdl_type in data_ports if direction == "out"]
+        #
+        n_generics = max(len(call_args) - len(inport_info), 0) if call_args else len(entity["generics"])
+        if n_generics > len(entity["generics"]):
+            raise TransformationError("{} takes at most {} arguments, got {}".format(
+                self.func_name, len(entity["generics"]) + len(inport_info), len(call_args)))
+        generics = entity["generics"][:n_generics]
+        generic_info = [GenericInfo(str(name), self._vhdl_type(vhdl_type, library, data_width))
+                        for name, vhdl_type, _ in generics]
+        #
+        defn = VhdlComponent(name=self.func_name,
+                             generic_slice=slice(0, n_generics) if n_generics else None,
+                             delay=self._latency(entity, call_args[:n_generics]),
+                             inport_info=generic_info + inport_info,
+                             outport_info=outport_info,
+                             library=self.library)
+        return defn
+
+    def _vhdl_type(self, vhdl_type, library, data_width=None):
+        """Return VhdlType of the type mark vhdl_type of a port or generic declaration.
+
+        :param library: basic block library declaring array types
+        :type library: BasicBlockLibrary
+        :param data_width: width of std_logic_vector ports, default the declared width
+        """
+        vector = VECTOR_TYPE.match(vhdl_type)
+        if vector:
+            return VhdlType.VhdlStdLogicVector(data_width or int(vector.group(1)) - int(vector.group(2)) + 1)
+        elif vhdl_type.lower() in SCALAR_TYPES:
+            return SCALAR_TYPES[vhdl_type.lower()]()
+        elif vhdl_type.lower() in library.types:
+            array_type = library.types[vhdl_type.lower()]
+            return VhdlType.VhdlArray(array_type["size"], SCALAR_TYPES[array_type["item"].lower()],
+                                      array_type["min"], array_type["max"], type_def=str(array_type["name"]))
+        raise TransformationError("Type {} of basic block {} not supported".format(vhdl_type, self.library))
+
+    def _latency(self, entity, generic_args):
+        """Return latency of entity instantiated with generic_args.
+
+        :returns: int or tuple -- latency, (min, max) if it depends on the data
+        """
+        if entity["latency"] is None:
+            raise TransformationError("Latency of basic block {} not annotated".format(entity["name"]))
+        values = {}
+        for i, (name, _, default) in enumerate(entity["generics"]):
+            if i < len(generic_args):
+                if isinstance(generic_args[i], ast.Num):
+                    values[name] = generic_args[i].n
+            elif default is not None and default.lstrip("-").isdigit():
+                values[name] = int(default)
+        min_latency, max_latency = [evaluate(expression, values) for expression in entity["latency"]]
+        return min_latency if min_latency == max_latency else (min_latency, max_latency)
 
 
 class ConvolveTransformer(BasicBlockBaseTransformer):
     func_name = "bb_convolve"
+    library = "work.Convolve"
 
     def get_func_def_c(self, **kwargs):
         """Return C interpretation of the BasicBlock."""
@@ -95,52 +231,10 @@ class ConvolveTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("inpt"), Op.Mul(), Constant(2)))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-
-        if "delay" in kwargs:
-            delay = (kwargs["delay"], kwargs["delay"] + 3)
-        else:
-            delay = -1
-        #
-        inport_info = [GenericInfo("FILTERMATRIX",
-                                   VhdlType.VhdlArray(9, VhdlType.VhdlInteger, -20, 20, type_def="filtMASK")),
-                       GenericInfo("FILTER_SCALE", VhdlType.VhdlInteger()),
-                       GenericInfo("IMG_WIDTH", VhdlType.VhdlPositive()),
-                       GenericInfo("IMG_HEIGHT", VhdlType.VhdlPositive()),
-                       PortInfo("DATA_IN", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        outport_info = [PortInfo("DATA_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        defn = VhdlComponent(name=self.func_name,
-                             generic_slice=slice(0, 4),
-                             delay=delay,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.Convolve")
-        return defn
-
-    def convert(self, node):
-        method = "get_func_def_" + self.backend
-        try:
-            func_def_getter = getattr(self, method)
-        except AttributeError:
-            error_msg = "No function definition provided for %s backend" \
-                        % self.backend
-            raise TransformationError(error_msg)
-
-        func_def = func_def_getter(delay=(2*node.args[2].n) + 12, **self.kwargs)
-        # add function definition to class variable lifted_functions
-        BasicBlockBaseTransformer.lifted_functions.append(LF_Data(node.lineno, func_def))
-        # return C node FunctionCall
-        return FunctionCall(SymbolRef(func_def.name), node.args)
-
 
 class AddTransformer(BasicBlockBaseTransformer):
     func_name = "bb_add"
+    library = "work.AddBB"
 
     def get_func_def_c(self, **kwargs):
         params = [SymbolRef("x", ctypes.c_long()), SymbolRef("y", ctypes.c_long())]
@@ -148,28 +242,10 @@ class AddTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("x"), Op.Add(), SymbolRef("y")))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-        #
-        inport_info = [PortInfo("LEFT", "in", VhdlType.VhdlStdLogicVector(data_width)),
-                       PortInfo("RIGHT", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        outport_info = [PortInfo("ADD_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        defn = VhdlComponent(name=self.func_name,
-                             delay=4,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.AddBB")
-        #
-        return defn
-
 
 class SubTransformer(BasicBlockBaseTransformer):
     func_name = "bb_sub"
+    library = "work.SubBB"
 
     def get_func_def_c(self, **kwargs):
         params = [SymbolRef("x", ctypes.c_long()), SymbolRef("y", ctypes.c_long())]
@@ -177,28 +253,10 @@ class SubTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("x"), Op.Sub(), SymbolRef("y")))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-        #
-        inport_info = [PortInfo("LEFT", "in", VhdlType.VhdlStdLogicVector(data_width)),
-                       PortInfo("RIGHT", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        outport_info = [PortInfo("SUB_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        defn = VhdlComponent(name=self.func_name,
-                             delay=4,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.SubBB")
-        #
-        return defn
-
 
 class MulTransformer(BasicBlockBaseTransformer):
     func_name = "bb_mul"
+    library = "work.MulBB"
 
     def get_func_def_c(self, **kwargs):
         params = [SymbolRef("x", ctypes.c_long()), SymbolRef("y", ctypes.c_long())]
@@ -206,28 +264,10 @@ class MulTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("x"), Op.Mul(), SymbolRef("y")))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-        #
-        inport_info = [PortInfo("LEFT", "in", VhdlType.VhdlStdLogicVector(data_width)),
-                       PortInfo("RIGHT", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        outport_info = [PortInfo("MUL_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        defn = VhdlComponent(name=self.func_name,
-                             delay=10,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.MulBB")
-        #
-        return defn
-
 
 class SplitTransformer(BasicBlockBaseTransformer):
     func_name = "bb_split"
+    library = "work.split"
 
     def get_func_def_c(self, **kwargs):
         """Return C interpretation of the BasicBlock."""
@@ -236,28 +276,10 @@ class SplitTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("inpt"), Op.Mul(), Constant(2)))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-        #
-        inport_info = [GenericInfo("INDEX", VhdlType.VhdlInteger()),
-                       PortInfo("DATA_IN", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        outport_info = [PortInfo("DATA_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        defn = VhdlComponent(name=self.func_name,
-                             generic_slice=slice(0, 1),
-                             delay=0,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.split")
-        return defn
-
 
 class MergeTransformer(BasicBlockBaseTransformer):
     func_name = "bb_merge"
+    library = "work.merge"
 
     def get_func_def_c(self, **kwargs):
         """Return C interpretation of the BasicBlock."""
@@ -266,30 +288,10 @@ class MergeTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("inpt"), Op.Mul(), Constant(2)))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-        #
-        inport_info = [PortInfo("IN_3", "in", VhdlType.VhdlStdLogicVector(data_width)),
-                       PortInfo("IN_2", "in", VhdlType.VhdlStdLogicVector(data_width)),
-                       PortInfo("IN_1", "in", VhdlType.VhdlStdLogicVector(data_width)),
-                       PortInfo("IN_0", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        outport_info = [PortInfo("DATA_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        defn = VhdlComponent(name=self.func_name,
-                             generic_slice=None,
-                             delay=0,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.merge")
-        return defn
-
 
 class LimitToTransformer(BasicBlockBaseTransformer):
     func_name = "bb_limitTo"
+    library = "work.LimitTo"
 
     def get_func_def_c(self, **kwargs):
         """Return C interpretation of the BasicBlock."""
@@ -298,25 +300,6 @@ class LimitToTransformer(BasicBlockBaseTransformer):
         defn = [Return(BinaryOp(SymbolRef("inpt"), Op.Mul(), Constant(2)))]
         return FunctionDecl(return_type, self.func_name, params, defn)
 
-    def get_func_def_vhdl(self, **kwargs):
-        """Return VHDL interpretation of the BasicBlock."""
-        if "DataWidth" in kwargs:
-            data_width = kwargs["DataWidth"]
-        else:
-            data_width = 32
-        #
-        inport_info = [GenericInfo("VALID_BITS", VhdlType.VhdlPositive()),
-                       PortInfo("DATA_IN", "in", VhdlType.VhdlStdLogicVector(data_width))]
-        #
-        outport_info = [PortInfo("DATA_OUT", "out", VhdlType.VhdlStdLogicVector(data_width))]
-        defn = VhdlComponent(name=self.func_name,
-                             generic_slice=slice(0, 1),
-                             delay=0,
-                             inport_info=inport_info,
-                             outport_info=outport_info,
-                             library="work.LimitTo")
-        return defn
-
 
 class DSLTransformer(ast.NodeTransformer):
     """Transformer for all basic block transformer."""
@@ -326,9 +309,16 @@ class DSLTransformer(ast.NodeTransformer):
                     SplitTransformer, MergeTransformer,
                     LimitToTransformer]
 
-    def __init__(self, backend="C", **kwargs):
-        """Initialize transformation target backend."""
+    def __init__(self, backend="C", context=None, **kwargs):
+        """Initialize transformation target backend.
+
+        :param backend: target backend of the basic blocks
+        :type backend: str
+        :param context: collects the lifted basic block functions, a new one by default
+        :type context: LiftingContext
+        """
         self.backend = backend
+        self.context = context if context is not None else LiftingContext()
         self.kwargs = kwargs
         #
         self.transformer_func = {t.func_name: t for t in self.transformers}
@@ -339,33 +329,11 @@ class DSLTransformer(ast.NodeTransformer):
             return node
         else:
             transformer = self.transformer_func[getattr(node.func, "id", None)]
-            return transformer(self.backend, **self.kwargs).convert(node)
+            return transformer(self.backend, self.context, **self.kwargs).convert(node)
 
-    @staticmethod
-    def lifted_functions():
-        """Return all basic block transformer functions."""
-        lifted_functions = BasicBlockBaseTransformer.lifted_functions
-        # group and reverse
-        line_dict = {}
-        line_nbrs = []
-        #
-        for lf in lifted_functions:
-            if lf.lineno in line_dict:
-                line_dict[lf.lineno].append(lf.func)
-            else:
-                line_dict[lf.lineno] = [lf.func]
-                line_nbrs.append(lf.lineno)
-        #
-        line_nbrs.sort()
-        line_nbrs.reverse()
-        #
-        ret = []
-        for ln in line_nbrs:
-            data = line_dict[ln]
-            data.reverse()
-            ret.extend(data)
-        #
-        return ret
+    def lifted_functions(self):
+        """Return all basic block transformer functions lifted by this transformer."""
+        return self.context.lifted_functions()
 
 
 def get_dsl_type(params, axi_stream_width=0):
@@ -385,14 +353,76 @@ def get_dsl_type(params, axi_stream_width=0):
         return gen_return(params, axi_stream_width)
 
 
-def gen_dsl_wrapper(ipt_params, axi_stream_width, file2wrap):
-    axi_stream_width = axi_stream_width
-    ipt_params = ipt_params
+def get_pixel_width(params, axi_stream_width=32):
+    """Return bits per pixel on the AXI stream for the kernel parameters.
+
+    Parameters of one unsigned 8 or 16 bit dtype are packed into the stream
+    words, all others are transferred one element per word.
+
+    :param params: kernel parameters
+    :type params: list of np.ndarray
+    :param axi_stream_width: width of the AXI stream data signals
+    :type axi_stream_width: int
+    :returns: int -- 8, 16 or axi_stream_width
+    """
+    dtypes = set(np.asarray(param).dtype for param in params)
+    if len(dtypes) == 1:
+        dtype = dtypes.pop()
+        if dtype.kind == "u" and dtype.itemsize * 8 in (8, 16) and dtype.itemsize * 8 < axi_stream_width:
+            return dtype.itemsize * 8
+    return axi_stream_width
+
+
+def fits_pixel_width(file2wrap, pixel_width):
+    """Return True if all results of the module of file2wrap fit into pixel_width bits for inputs of pixel_width bits.
+
+    :param file2wrap: file providing the apply component
+    :type file2wrap: VhdlFile
+    :param pixel_width: bits per pixel
+    :type pixel_width: int
+    """
+    body = getattr(file2wrap, "body", None)
+    if not body or not isinstance(body[0], VhdlModule):
+        # results can not be bounded
+        return False
+    _, max_value = VhdlEmulator(body[0]).value_range((0, (1 << pixel_width) - 1))
+    return max_value < 1 << pixel_width
+
+
+def gen_dsl_wrapper(ipt_params, axi_stream_width, file2wrap, pixel_width=None):
+    """Generate AXI stream wrapper around file2wrap.
+
+    Multiple input arrays are transferred element wise interleaved over the
+    input stream and demultiplexed by a Deinterleave component, so all
+    operands of a kernel arrive in a single DMA transfer.
+
+    If pixel_width is smaller than axi_stream_width, every stream word carries
+    axi_stream_width / pixel_width pixels. The apply component is instantiated
+    once per lane, each lane's input is zero extended by a Split component and
+    the lowest pixel_width bits of all lane results are packed into the output
+    word again. If the results of the kernel may not fit into pixel_width
+    bits, pixels are widened to axi_stream_width bits instead of truncating
+    the results. The pixel width used is stored in the pixel_width attribute
+    of the wrapper module.
+
+    :param ipt_params: VHDL types of the kernel parameters
+    :type ipt_params: list of VhdlType
+    :param axi_stream_width: width of the AXI stream data signals
+    :type axi_stream_width: int
+    :param file2wrap: file providing the apply component
+    :type file2wrap: VhdlFile
+    :param pixel_width: bits per pixel on the stream (8 or 16), default axi_stream_width
+    :type pixel_width: int
+    """
+    n_inputs = len(ipt_params)
+    pixel_width = pixel_width or axi_stream_width
+    if pixel_width not in (8, 16, axi_stream_width) or axi_stream_width % pixel_width:
+        raise TransformationError("Pixel width of {} bit not supported".format(pixel_width))
+    if pixel_width < axi_stream_width and not fits_pixel_width(file2wrap, pixel_width):
+        logger.info("Results may exceed {} bit, widen pixels to {} bit".format(pixel_width, axi_stream_width))
+        pixel_width = axi_stream_width
+    n_lanes = axi_stream_width // pixel_width
 
-    # TODO: Change to support multiple input params
-
-    if len(ipt_params) > 1:
-        raise TransformationError("Multiple inputs currently not supported by the hardware!")
     # input signals
     m_axis_mm2s_tdata = VhdlSource("m_axis_mm2s_tdata", VhdlType.VhdlStdLogicVector(axi_stream_width, "0"))
     m_axis_mm2s_tlast = VhdlSignal("m_axis_mm2s_tlast", VhdlType.VhdlStdLogic("0"))
@@ -405,31 +435,116 @@ def gen_dsl_wrapper(ipt_params, axi_stream_width, file2wrap):
     #
     out_sigs = [s_axis_s2mm_tdata, s_axis_s2mm_tlast]
 
-    try:
-        component = file2wrap.component()
-    except AttributeError:
+    if not hasattr(file2wrap, "component"):
         raise TransformationError("File to wrap must provide component() method")
+    logger.info("Generate project wrapper")
+
+    # one stream word per operand
+    if n_inputs > 1:
+        deinterleave = gen_deinterleave(in_sigs[0], n_inputs)
+        lanes = deinterleave.out_port[0]
+        operands = [(deinterleave, VhdlSignalSplit(lanes, slice(i * axi_stream_width, (i + 1) * axi_stream_width)))
+                    for i in range(n_inputs)]
     else:
-        logger.info("Generate project wrapper")
-        #
-        ret_sig = VhdlSignal("ret_tdata", VhdlType.VhdlStdLogicVector(axi_stream_width, "0"))
-        #
+        operands = [(in_sigs[0], in_sigs[0])]
+
+    components = []
+    ret_sigs = []
+    for lane in range(n_lanes):
+        component = file2wrap.component()
         component.library = "work.apply"
         component.delay = 5
-        component.prev = [in_sigs[0]]
-        component.in_port = [in_sigs[0]]
+        if n_lanes > 1:
+            splits = [gen_lane_split(prev, sig, lane, pixel_width, "lane_{0}_{1}".format(lane, i))
+                      for i, (prev, sig) in enumerate(operands)]
+            component.prev = splits
+            component.in_port = [split.out_port[0] for split in splits]
+            ret_sig = VhdlSignal("ret_tdata_" + str(lane), VhdlType.VhdlStdLogicVector(axi_stream_width, "0"))
+        else:
+            component.prev = [operands[0][0]]
+            component.in_port = [sig for _, sig in operands]
+            ret_sig = VhdlSignal("ret_tdata", VhdlType.VhdlStdLogicVector(axi_stream_width, "0"))
         component.out_port = [ret_sig]
-        #
-        ret_component = VhdlReturn([component], [ret_sig], [out_sigs[0]])
+        components.append(component)
+        ret_sigs.append(ret_sig)
+    #
+    if n_lanes > 1:
+        # lane 0 occupies the lowest bits of the output word
+        ret_data = VhdlConcatenation([VhdlSignalSplit(sig, slice(0, pixel_width)) for sig in reversed(ret_sigs)])
+    else:
+        ret_data = ret_sigs[0]
+    ret_component = VhdlReturn(components, [ret_data], [out_sigs[0]])
 
-        libraries = [VhdlLibrary("ieee", ["ieee.std_logic_1164.all",
-                                          "ieee.numeric_std.all"]),
-                     VhdlLibrary(None, ["work.the_filter_package.all"])]
-        #
-        architecture = [ret_component] + [VhdlAssignment(t, s) for t, s in zip(out_sigs[1:], in_sigs[1:])]
-        module = VhdlModule("accel_wrapper", libraries,
-                            slice(0, len(in_sigs)), in_sigs + out_sigs, architecture)
-        #
-        module = transformations.VhdlGraphTransformer().visit(module)
-        module = transformations.VhdlPortTransformer().visit(module)
-        return VhdlFile("accel_wrapper", [module])
+    libraries = [VhdlLibrary("ieee", ["ieee.std_logic_1164.all",
+                                      "ieee.numeric_std.all"]),
+                 VhdlLibrary(None, ["work.the_filter_package.all"])]
+    #
+    architecture = [ret_component] + [VhdlAssignment(t, s) for t, s in zip(out_sigs[1:], in_sigs[1:])]
+    module = VhdlModule("accel_wrapper", libraries,
+                        slice(0, len(in_sigs)), in_sigs + out_sigs, architecture)
+    # stream layout used by the host to pack and unpack data
+    module.pixel_width = pixel_width
+    #
+    module = transformations.VhdlGraphTransformer().visit(module)
+    module = transformations.VhdlPortTransformer().visit(module)
+    return VhdlFile("accel_wrapper", [module])
+
+
+def gen_lane_split(prev, word, lane, pixel_width, name):
+    """Return Split component zero extending pixel lane of a stream word.
+
+    :param prev: node producing word
+    :param word: stream word holding several pixels
+    :type word: VhdlSignal
+    :param lane: index of the pixel in word, lane 0 are the lowest bits
+    :type lane: int
+    :param pixel_width: bits per pixel
+    :type pixel_width: int
+    :param name: name of the zero extended pixel signal
+    :type name: str
+    """
+    width = len(word.vhdl_type)
+    inport_info = [GenericInfo("INDEX", VhdlType.VhdlInteger()),
+                   GenericInfo("LANE_WIDTH", VhdlType.VhdlPositive()),
+                   PortInfo("DATA_IN", "in", VhdlType.VhdlStdLogicVector(width))]
+    outport_info = [PortInfo("DATA_OUT", "out", VhdlType.VhdlStdLogicVector(width))]
+    generics = [VhdlConstant("", VhdlType.VhdlInteger(), lane),
+                VhdlConstant("", VhdlType.VhdlPositive(), pixel_width)]
+    pixel = VhdlSignal(name, VhdlType.VhdlStdLogicVector(width, "0"))
+    return VhdlComponent(name="split",
+                         prev=[prev],
+                         generic_slice=slice(0, 2),
+                         delay=0,
+                         in_port=generics + [word],
+                         inport_info=inport_info,
+                         out_port=[pixel],
+                         outport_info=outport_info,
+                         library="work.split")
+
+
+def gen_deinterleave(stream, n_io):
+    """Return Deinterleave component splitting stream into n_io parallel lanes.
+
+    :param stream: interleaved input stream
+    :type stream: VhdlSource
+    :param n_io: number of interleaved streams
+    :type n_io: int
+    """
+    width = len(stream.vhdl_type)
+    lanes = VhdlSignal("deinterleaved_tdata", VhdlType.VhdlStdLogicVector(n_io * width, "0"))
+    inport_info = [GenericInfo("WIDTH", VhdlType.VhdlPositive()),
+                   GenericInfo("N_IO", VhdlType.VhdlPositive()),
+                   PortInfo("DATA_IN", "in", stream.vhdl_type)]
+    outport_info = [PortInfo("DATA_OUT", "out", lanes.vhdl_type)]
+    generics = [VhdlConstant("", VhdlType.VhdlPositive(), width),
+                VhdlConstant("", VhdlType.VhdlPositive(), n_io)]
+    # a group of n_io words is complete n_io cycles after its first word
+    return VhdlComponent(name="deinterleave",
+                         prev=[stream],
+                         generic_slice=slice(0, 2),
+                         delay=n_io,
+                         in_port=generics + [stream],
+                         inport_info=inport_info,
+                         out_port=[lanes],
+                         outport_info=outport_info,
+                         library="work.Deinterleave")
@@ -0,0 +1,345 @@
+"""Cycle-accurate NumPy emulation of the VHDL IR.
+
+The emulator walks a retimed VhdlModule DAG and evaluates every basic block
+as a vectorized NumPy kernel over the whole input frame. Each signal is
+modelled as a stream of samples together with the clock cycle its first
+valid sample arrives, so node latencies (d/dprev) and inserted D-Registers
+determine both the sample alignment and the predicted cycle count.
+"""
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from nodes import Port
+from nodes import Generic
+from nodes import VhdlReturn
+from nodes import VhdlSource
+from nodes import VhdlConstant
+from nodes import VhdlDReg
+from nodes import VhdlSyncNode
+from nodes import VhdlSignalSplit
+from nodes import VhdlConcatenation
+from errors import TransformationError
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+# command ports added by the VhdlPortTransformer, not part of the data path
+COMMAND_PORTS = {"CLK", "RST", "VALID_IN", "READY_IN", "VALID_OUT", "READY_OUT", "VALID_IN_PORT"}
+
+Stream = namedtuple("Stream", ["data", "t0"])
+EmulationResult = namedtuple("EmulationResult", ["data", "cycles", "latency"])
+
+
+def _bb_add(generics, left, right):
+    return left + right
+
+
+def _bb_sub(generics, left, right):
+    return left - right
+
+
+def _bb_mul(generics, left, right):
+    return left * right
+
+
+def _bb_limit_to(generics, data):
+    valid_bits = generics["VALID_BITS"]
+    if valid_bits >= 32:
+        return data
+    return data & np.uint32((1 << valid_bits) - 1)
+
+
+def _bb_split(generics, data):
+    lane_width = generics.get("LANE_WIDTH", 8)
+    return (data >> np.uint32(lane_width * generics["INDEX"])) & np.uint32((1 << lane_width) - 1)
+
+
+def _bb_merge(generics, in_3, in_2, in_1, in_0):
+    byte = np.uint32(0xFF)
+    return ((in_3 & byte) << np.uint32(24)) | ((in_2 & byte) << np.uint32(16)) | \
+           ((in_1 & byte) << np.uint32(8)) | (in_0 & byte)
+
+
+def _bb_convolve(generics, data):
+    """3x3 filter of Convolve.vhd/filter.vhd on 12 bit pixels with black border."""
+    width, height = generics["IMG_WIDTH"], generics["IMG_HEIGHT"]
+    mask = np.array(generics["FILTERMATRIX"], dtype=np.int64).reshape(3, 3)
+    if data.size != width * height:
+        raise TransformationError("Convolve expects {0} samples, got {1}".format(width * height, data.size))
+    img = np.pad((data & np.uint32(0xFFF)).astype(np.int64).reshape(height, width), 1, mode="constant")
+    acc = np.zeros((height, width), dtype=np.int64)
+    for r in range(3):
+        for c in range(3):
+            acc += mask[r, c] * img[r:r + height, c:c + width]
+    # VHDL integer division truncates towards zero, result is a 16 bit signed value
+    acc = np.fix(acc / float(generics["FILTER_SCALE"])).astype(np.int64)
+    return (acc.ravel() & 0xFFFF).astype(np.uint32)
+
+
+# VHDL library of a basic block -> NumPy kernel
+BB_KERNELS = {"work.AddBB": _bb_add,
+              "work.SubBB": _bb_sub,
+              "work.MulBB": _bb_mul,
+              "work.LimitTo": _bb_limit_to,
+              "work.split": _bb_split,
+              "work.merge": _bb_merge,
+              "work.Convolve": _bb_convolve}
+
+
+def _u32(x):
+    return np.asarray(x).astype(np.uint32)
+
+
+def _py_convolve(mask, divisor, width, height, img):
+    generics = {"FILTERMATRIX": mask, "FILTER_SCALE": divisor, "IMG_WIDTH": width, "IMG_HEIGHT": height}
+    return _bb_convolve(generics, _u32(img).ravel()).reshape(np.shape(img))
+
+
+# DSL function name -> NumPy kernel with the call signature of the DSL and
+# the arithmetic of the hardware basic block
+PY_KERNELS = {"bb_add": lambda x, y: _bb_add({}, _u32(x), _u32(y)),
+              "bb_sub": lambda x, y: _bb_sub({}, _u32(x), _u32(y)),
+              "bb_mul": lambda x, y: _bb_mul({}, _u32(x), _u32(y)),
+              "bb_limitTo": lambda valid, x: _bb_limit_to({"VALID_BITS": valid}, _u32(x)),
+              "bb_split": lambda i, n: _bb_split({"INDEX": i}, _u32(n)),
+              "bb_merge": lambda n_3, n_2, n_1, n_0: _bb_merge({}, _u32(n_3), _u32(n_2), _u32(n_1), _u32(n_0)),
+              "bb_convolve": _py_convolve}
+
+
+WORD_RANGE = (0, 0xFFFFFFFF)
+
+
+def _range_of(library, generics, operands):
+    """Return (min, max) of the result of a basic block given (min, max) of its operands.
+
+    Results outside of the 32 bit words wrap around and may take any value.
+    """
+    if library == "work.AddBB":
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        lo, hi = a_lo + b_lo, a_hi + b_hi
+    elif library == "work.SubBB":
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        lo, hi = a_lo - b_hi, a_hi - b_lo
+    elif library == "work.MulBB":
+        (a_lo, a_hi), (b_lo, b_hi) = operands
+        lo, hi = a_lo * b_lo, a_hi * b_hi
+    elif library == "work.LimitTo":
+        lo, hi = operands[0]
+        if generics["VALID_BITS"] < 32 and hi >> generics["VALID_BITS"]:
+            lo, hi = 0, (1 << generics["VALID_BITS"]) - 1
+    elif library == "work.split":
+        lo, hi = 0, (1 << generics.get("LANE_WIDTH", 8)) - 1
+    elif library == "work.Convolve" and min(generics["FILTERMATRIX"]) >= 0:
+        pixel_hi = min(operands[0][1], 0xFFF)
+        lo, hi = 0, min(sum(generics["FILTERMATRIX"]) * pixel_hi // generics["FILTER_SCALE"], 0xFFFF)
+    elif library == "work.Convolve":
+        lo, hi = 0, 0xFFFF
+    else:
+        return WORD_RANGE
+    if lo < WORD_RANGE[0] or hi > WORD_RANGE[1]:
+        return WORD_RANGE
+    return lo, hi
+
+
+def _max_delay(d):
+    """Return worst case delay of fixed (int) or variable (tuple) delay."""
+    return max(d) if isinstance(d, tuple) else d
+
+
+def _shift(stream, t0):
+    """Return samples of stream as seen at cycle t0."""
+    offset = t0 - stream.t0
+    if offset == 0:
+        return stream.data
+    shifted = np.zeros_like(stream.data)
+    # streams misaligned by a whole frame or more see only zeros
+    offset = max(-len(shifted), min(offset, len(shifted)))
+    if offset > 0:
+        shifted[:len(shifted) - offset] = stream.data[offset:]
+    else:
+        shifted[-offset:] = stream.data[:len(shifted) + offset]
+    return shifted
+
+
+class VhdlEmulator(object):
+
+    """Emulate a VhdlModule on the host with NumPy.
+
+    Every basic block is evaluated once for the complete frame. Samples of
+    the inputs of a node are paired by the cycle they arrive at the node, so
+    an unbalanced DAG yields the same misaligned results as the hardware.
+    """
+
+    def __init__(self, module):
+        """Initialize emulator.
+
+        :param module: retimed VHDL IR module to emulate
+        :type module: VhdlModule
+
+        :raises TransformationError: raised if module has no VhdlReturn node
+        """
+        self.module = module
+        self.sources = [sym for sym in module.entity if isinstance(sym, VhdlSource)]
+        returns = [node for node in module.architecture if isinstance(node, VhdlReturn)]
+        if len(returns) != 1:
+            raise TransformationError("Emulated module must contain exactly one VhdlReturn node")
+        self.ret_node = returns[0]
+        self.producers = self._index_producers(self.ret_node)
+
+    @staticmethod
+    def _index_producers(ret_node):
+        """Map id of each output signal to the node driving it."""
+        producers = {}
+        visited = set()
+        stack = [ret_node]
+        while stack:
+            node = stack.pop()
+            if id(node) in visited or not hasattr(node, "out_port"):
+                continue
+            visited.add(id(node))
+            for port in node.out_port:
+                sig = port.value if isinstance(port, Port) else port
+                producers[id(sig)] = node
+            stack.extend(node.prev)
+        return producers
+
+    @staticmethod
+    def _split_ports(node):
+        """Return generics and input data signals of finalized or unfinalized node.
+
+        :returns: tuple -- (dict of generic name -> value, list of input signals)
+        """
+        if any(isinstance(p, Port) for p in node.in_port):
+            generics = {g.name: g.value.value for g in node.generic if isinstance(g, Generic)}
+            data = [p.value for p in node.in_port if p.name not in COMMAND_PORTS and p.direction == "in"]
+            return generics, data
+        generic_slice = getattr(node, "generic_slice", None)
+        if generic_slice is None or isinstance(node, VhdlSyncNode):
+            data = node.in_port if generic_slice is None else node.in_port[generic_slice.stop:]
+            return {}, data
+        names = [info.name for info in node.inport_info[generic_slice]]
+        values = [g.value for g in node.in_port[generic_slice]]
+        return dict(zip(names, values)), node.in_port[generic_slice.stop:]
+
+    def run(self, *args):
+        """Emulate module for the given input frames.
+
+        :param args: one array per kernel parameter, all of the same size
+        :returns: EmulationResult -- output frame, predicted cycles and pipeline latency
+        """
+        if len(args) != len(self.sources):
+            raise TransformationError("Emulated module expects {0} inputs, got {1}"
+                                      .format(len(self.sources), len(args)))
+        frames = [np.ascontiguousarray(arg).ravel().astype(np.uint32) for arg in args]
+        if len(set(f.size for f in frames)) > 1:
+            raise TransformationError("All input frames must have the same number of samples")
+        #
+        self._streams = {id(src): Stream(frame, 0) for src, frame in zip(self.sources, frames)}
+        self._node_outputs = {}
+        with np.errstate(over="ignore"):
+            out = self._eval_node(self.ret_node)
+        n_samples = frames[0].size if frames else 0
+        logger.info("Emulated %s: %d samples, latency %d cycles", self.module.name, n_samples, out.t0)
+        return EmulationResult(out.data.reshape(np.shape(args[0])), out.t0 + n_samples, out.t0)
+
+    def value_range(self, input_range):
+        """Return (min, max) of the output values of the module, bounded by interval arithmetic.
+
+        :param input_range: (min, max) of the values of all inputs
+        :type input_range: tuple of int
+        :returns: tuple of int -- bounds of the output values, (0, 2**32 - 1) if results may wrap around
+        """
+        ranges = {}
+
+        def signal_range(sig):
+            if isinstance(sig, VhdlConstant):
+                return sig.value & WORD_RANGE[1], sig.value & WORD_RANGE[1]
+            if isinstance(sig, VhdlSignalSplit):
+                bus = signal_range(sig.sig)
+                if isinstance(bus, list):
+                    return bus[sig.sig_slice.start // sig.vhdl_type.size]
+                return WORD_RANGE
+            if isinstance(sig, VhdlConcatenation):
+                return [signal_range(s) for s in sig]
+            if any(sig is src for src in self.sources):
+                return input_range
+            return node_range(self.producers[id(sig)])
+
+        def node_range(node):
+            if id(node) not in ranges:
+                generics, in_sigs = self._split_ports(node)
+                operands = [signal_range(sig) for sig in in_sigs]
+                if isinstance(node, (VhdlReturn, VhdlDReg)):
+                    ranges[id(node)] = operands[0]
+                elif isinstance(node, VhdlSyncNode):
+                    # bus indexed from the lowest bits like in _compute
+                    ranges[id(node)] = operands[0][::-1]
+                else:
+                    ranges[id(node)] = _range_of(node.library, generics, operands)
+            return ranges[id(node)]
+
+        return node_range(self.ret_node)
+
+    def _eval_signal(self, sig):
+        """Return Stream, bus (list of Streams) or constant value carried by sig."""
+        if isinstance(sig, VhdlConstant):
+            return sig.value
+        if isinstance(sig, VhdlSignalSplit):
+            bus = self._eval_signal(sig.sig)
+            lane_width = sig.vhdl_type.size
+            return bus[sig.sig_slice.start // lane_width]
+        if isinstance(sig, VhdlConcatenation):
+            return [self._eval_signal(s) for s in sig]
+        if id(sig) in self._streams:
+            return self._streams[id(sig)]
+        try:
+            producer = self.producers[id(sig)]
+        except KeyError:
+            raise TransformationError("Signal %s has no driver" % sig)
+        return self._eval_node(producer)
+
+    def _eval_node(self, node):
+        if id(node) not in self._node_outputs:
+            self._node_outputs[id(node)] = self._compute(node)
+        return self._node_outputs[id(node)]
+
+    def _compute(self, node):
+        generics, in_sigs = self._split_ports(node)
+        inputs = [self._eval_signal(sig) for sig in in_sigs]
+        #
+        if isinstance(node, VhdlReturn):
+            return inputs[0]
+        elif isinstance(node, VhdlDReg):
+            return Stream(inputs[0].data, inputs[0].t0 + node.d)
+        elif isinstance(node, VhdlSyncNode):
+            # FIFOs realign all inputs on their sample index, the concatenation
+            # lists the last input first, the bus is indexed from the lowest bits
+            streams = inputs[0][::-1]
+            t0 = max(s.t0 for s in streams)
+            return [Stream(s.data, t0) for s in streams]
+        #
+        try:
+            kernel = BB_KERNELS[node.library]
+        except KeyError:
+            raise TransformationError("No emulation kernel for %s" % node.library)
+        streams = [i for i in inputs if isinstance(i, Stream)]
+        if not streams:
+            raise TransformationError("Node %s has no streaming input" % node.name)
+        t0 = max(s.t0 for s in streams)
+        n = len(streams[0].data)
+        operands = [_shift(i, t0) if isinstance(i, Stream) else np.full(n, i & 0xFFFFFFFF, dtype=np.uint32)
+                    for i in inputs]
+        return Stream(kernel(generics, *operands).astype(np.uint32), t0 + _max_delay(node.d))
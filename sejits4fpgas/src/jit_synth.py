@@ -1,9 +1,16 @@
 """ """
 import os
 import glob
+import hashlib
 import ast
+import inspect
 import logging
-import subprocess
+import json
+import cPickle as pickle
+import shutil
+import tempfile
+import threading
+import multiprocessing
 import ctypes as c
 import numpy as np
 import numpy.ctypeslib as ctl
@@ -11,7 +18,22 @@ from .vhdl_ctree.frontend import get_ast
 from .vhdl_ctree.c.nodes import MultiNode
 from .vhdl_ctree.jit import LazySpecializedFunction
 from errors import TransformationError
+from nodes import VhdlModule
+from emulator import VhdlEmulator
+from emulator import PY_KERNELS
+from dma import dma_pool
+from bitstream_cache import bitstream_cache
+from bitstream_cache import checkpoint_cache
+from synthesis import synthesis_scheduler
+from synthesis import OutOfContextJob
+from synthesis import checkpoint_script
+from bb_library import BasicBlockLibrary
+from bb_library import block_instances
+from utils import BASIC_BLOCK_PATH
+from pipeline import AcceleratorPipeline
+from pipeline import completed_future
 from collections import namedtuple
+from collections import OrderedDict
 #
 from sejits4fpgas.src.config import config
 
@@ -36,6 +58,11 @@ class VhdlSynthModule(object):
 
     def __init__(self):
         self._linked_files = []
+        self._modules = {}
+        self._emulator = None
+        self.last_cycle_count = None
+        # bits per pixel on the AXI stream, set by the wrapper module
+        self.pixel_width = 32
         # vivado project folder
         self.v_proj_fol = os.path.dirname(__file__) + config.get("Paths", "vivado_proj_path")
         if os.path.isdir(self.v_proj_fol):
@@ -49,17 +76,129 @@ class VhdlSynthModule(object):
         logger.info("Initialized VhdlSynthModule")
         # ---------------------------------------------------------------------
         self.hw_interface = None
+        # serializes executions of the synchronous call and the pipeline worker
+        self._execute_lock = threading.Lock()
+        self.dma_pool = dma_pool
+        # address -> mapped size of the DMA buffers handed out to this module
+        self._held_buffers = {}
+        self._pipeline = None
+        self.bitstream_cache = bitstream_cache
+        self.synthesis_scheduler = synthesis_scheduler
+        self.checkpoint_cache = checkpoint_cache
+        self.out_of_context = config.getboolean("Synthesis", "out_of_context")
+        # synthesis artifacts of the linked files, file name -> path
+        self.artifacts = None
+        # bitstream cache key and job of a running synthesis
+        self._synthesis = None
+        self._synthesis_lock = threading.Lock()
 
     def __call__(self, *args, **kwargs):
         """Redirect call to python or vhdl kernel."""
-        if os.uname()[-1] == "armv7l":
-            if len(args) > 1:
-                raise TransformationError("Multiple input data currently not supported by the hardware")
-            mod_arg = args[0].astype(np.uint32)
-            self.hw_interface(mod_arg, len(mod_arg))
-            return mod_arg
-        else:
+        if os.uname()[-1] != "armv7l" and self._emulator is None:
             return "Concrete Specialized Function called on x86"
+        if os.uname()[-1] == "armv7l":
+            self.wait_synthesis()
+        packed = self._pack(args)
+        try:
+            return self._unpack(self._execute(packed), args)
+        finally:
+            self._recycle(packed, args)
+
+    def submit(self, *args):
+        """Queue an asynchronous invocation and return its AcceleratorFuture.
+
+        Packing of the next frame overlaps with the execution of the current
+        frame on the accelerator.
+        """
+        if os.uname()[-1] != "armv7l" and self._emulator is None:
+            return completed_future(self(*args))
+        if os.uname()[-1] == "armv7l":
+            self.wait_synthesis()
+        if self._pipeline is None:
+            self._pipeline = AcceleratorPipeline(self)
+        return self._pipeline.submit(*args)
+
+    def _pack(self, args):
+        """Prepare the input frames of one invocation for the accelerator."""
+        if os.uname()[-1] == "armv7l":
+            if len(args) > 1 or self.pixel_width != 32:
+                if any(np.shape(arg) != np.shape(args[0]) for arg in args[1:]):
+                    raise TransformationError("All input data must have the same shape")
+                return self._hold(self.dma_pool.interleave(args, self.pixel_width))
+            frame = args[0]
+            if self.dma_pool.owns(frame) and frame.dtype == np.uint32 and frame.flags.c_contiguous:
+                # caller filled a pool buffer in place
+                return frame
+            return self._hold(self.dma_pool.fill(frame))
+        return args
+
+    def _execute(self, packed):
+        """Run one packed invocation on the accelerator or the emulator, one invocation at a time."""
+        with self._execute_lock:
+            if os.uname()[-1] == "armv7l":
+                self.hw_interface(packed, len(packed))
+                return packed
+            result = self._emulator.run(*packed)
+            self.last_cycle_count = result.cycles
+            return result.data
+
+    def _unpack(self, data, args):
+        """Convert accelerator output of an invocation with the given arguments.
+
+        On the target the result is copied out of the DMA buffer, so the buffer can be recycled.
+        """
+        pixel_dtype = np.dtype("<u%d" % (self.pixel_width // 8))
+        if os.uname()[-1] == "armv7l":
+            if len(args) > 1 or self.pixel_width != 32:
+                # one result word per interleaved group, written to the buffer front
+                shape = np.shape(args[0])
+                return data.reshape(-1).view(pixel_dtype)[:int(np.prod(shape))].reshape(shape).copy()
+            return data.copy()
+        if self.pixel_width != 32:
+            # the wrapper keeps the lowest pixel_width bits of each lane result
+            return data.astype(pixel_dtype)
+        return data
+
+    def _recycle(self, packed, args):
+        """Return the DMA buffer _pack filled for args to the pool, buffers passed in by the caller stay in use."""
+        if self.dma_pool.owns(packed) and not any(packed is arg for arg in args):
+            self._drop(packed)
+            self.dma_pool.release(packed)
+
+    def _hold(self, buf):
+        """Account DMA buffer buf to this module until _drop and return it."""
+        self._held_buffers[buf.ctypes.data] = self.dma_pool.mapped_size(buf)
+        return buf
+
+    def _drop(self, buf):
+        self._held_buffers.pop(buf.ctypes.data, None)
+
+    def nbytes(self):
+        """Return size of the mapped DMA buffers and the bitstream held by this module in bytes."""
+        bitstreams = [path for path in (self.artifacts or {}).values() if path.endswith(".bit")]
+        return sum(self._held_buffers.values()) + \
+            sum(os.path.getsize(path) for path in bitstreams if os.path.exists(path))
+
+    def release(self):
+        """Stop the pipeline and drop emulator and hardware handles."""
+        if self._pipeline is not None:
+            self._pipeline.close()
+            self._pipeline = None
+        self._emulator = None
+        self.hw_interface = None
+
+    def get_buffer(self, shape):
+        """Return DMA buffer that can be filled in place and passed to the call.
+
+        The buffer stays with the caller across calls and is handed back with
+        release_buffer once it is no longer used.
+        """
+        return self._hold(self.dma_pool.acquire(shape))
+
+    def release_buffer(self, buf):
+        """Return DMA buffer to the pool for reuse by later calls."""
+        self._drop(buf)
+        self.dma_pool.release(buf)
 
     def _link_in(self, submodule):
         """Add submodule to list of linked files.
@@ -69,81 +208,141 @@ class VhdlSynthModule(object):
         """
         self._linked_files.append(submodule)
 
+    def _link_in_module(self, module):
+        """Add VHDL IR module to emulate on non-ARM hosts.
+
+        :param module: retimed and port finalized VHDL IR module
+        :type module: VhdlModule
+        """
+        self._modules[module.name] = module
+        if hasattr(module, "pixel_width"):
+            self.pixel_width = module.pixel_width
+
     def get_callable(self, entry_point_name, entry_point_typesig):
-        """Return a python callable that redirects to hardware."""
-        self._link_to_vivado_project()
-        self._activate()
+        """Return a python callable that redirects to hardware or to the emulator.
+
+        Synthesis of an uncached bitstream runs in the background, the first
+        call on the target waits for it. Kernels specialized one after another
+        are synthesized concurrently.
+        """
+        if os.path.isdir(self.v_proj_fol + "template_project.srcs/"):
+            key = self.bitstream_cache.key(self._linked_files)
+            self.artifacts = self.bitstream_cache.lookup(key)
+            if self.artifacts is None:
+                if self.out_of_context:
+                    vhdl_files, scripts = self._synthesize_blocks()
+                else:
+                    vhdl_files, scripts = self._linked_files, None
+                job = self._activate(entry_point_name, vhdl_files, scripts, self._project_name(entry_point_name))
+                self._synthesis = (key, job)
+        if os.uname()[-1] != "armv7l":
+            if entry_point_name in self._modules:
+                self._emulator = VhdlEmulator(self._modules[entry_point_name])
+            else:
+                logger.warning("No VHDL IR of %s available, emulation disabled" % entry_point_name)
         return self
 
-    def _link_to_vivado_project(self):
-        """Link all files to Vivado template project."""
-        # vivado src folder
-        v_src_fol = self.v_proj_fol + "template_project.srcs/sources_1/new/"
-
-        # Clean up source folder
-        for proj_file in glob.glob(v_src_fol + "*"):
-            if os.path.basename(proj_file) != "top.vhd":
-                os.remove(proj_file)
-
-        # Copy all files to top folder and save file names
-        file_names = []
-        for file_path in self._linked_files:
-            os.system("cp " + file_path + " " + v_src_fol)
-            file_names.append(os.path.basename(file_path))
-
-        # Add update source files in TCL script
-        saved_tcl_file_path = self.v_proj_fol + "template_project.sav"
-        mod_tcl_file_path = self.v_proj_fol + "template_project.tcl"
-        if not os.path.exists(saved_tcl_file_path):
-            os.system("cp " + mod_tcl_file_path + " " + saved_tcl_file_path)
-
-        with open(saved_tcl_file_path, "r") as old_tcl, open(mod_tcl_file_path, "w") as new_tcl:
-                line = old_tcl.readline()
-
-                # TODO: find better way than with while loops
-
-                # read till set origin_dir
-                while "set origin_dir" not in line:
-                    new_tcl.write(line)
-                    line = old_tcl.readline()
-
-                new_tcl.write("set origin_dir " + '"' + os.path.abspath(self.v_proj_fol) + '"')
-                line = ""
-
-                # read till create_project
-                while "create_project" not in line:
-                    new_tcl.write(line)
-                    line = old_tcl.readline()
-
-                new_tcl.write("create_project -force template_project ./template_project\n")
-                line = ""
-
-                # read till set files begins
-                while "set files" not in line:
-                    new_tcl.write(line)
-                    line = old_tcl.readline()
-                # read till end of set files
-                while "]\n" != line:
-                    new_tcl.write(line)
-                    line = old_tcl.readline()
-
-                # insert new files
-                tcl_set_file = ' "[file normalize "$origin_dir/template_project.srcs/sources_1/new/{file_name}"]"\\\n'
-
-                for vhdl_file_name in file_names:
-                    new_tcl.write(tcl_set_file.format(file_name=vhdl_file_name))
-                new_tcl.write("]\n")
-
-                # copy rest of file
-                for line in old_tcl.readlines():
-                    new_tcl.write(line)
-
-    def _activate(self):
-        """Initialize Vivado synthesis subprocess."""
-        if os.uname()[-1] == "armv7l":
-            print "Execute synthesis script"
+    def _synthesize_blocks(self):
+        """Synthesize each basic block instance out of context, reusing cached checkpoints.
+
+        Instances of the same entity with the same generic map share one
+        checkpoint. The checkpoint key covers the sources the entity depends
+        on, the entity and its generics.
+
+        :returns: tuple -- VHDL files and scripts of the top-level synthesis
+        :raises TransformationError: raised if a synthesis failed
+        """
+        block_files = [path for path in self._linked_files
+                       if os.path.exists(os.path.join(BASIC_BLOCK_PATH, os.path.basename(path)))]
+        library = BasicBlockLibrary(block_files)
+        checkpoints = {}
+        jobs = []
+        for entity, generics in sorted(block_instances(self._modules.values())):
+            if entity not in library:
+                # generated entity, part of the top-level synthesis
+                continue
+            entity = library.names[entity.lower()]
+            entity_files = library.closure([entity])
+            key = self.checkpoint_cache.key(entity_files, {"entity": entity, "generics": generics})
+            artifacts = self.checkpoint_cache.lookup(key)
+            if artifacts is None:
+                job = OutOfContextJob(entity, generics, entity_files,
+                                      tool_command=self.synthesis_scheduler.ooc_tool_command)
+                self.synthesis_scheduler.submit_job(job)
+                jobs.append((key, entity, generics, job))
+            else:
+                checkpoints[(entity, generics)] = artifacts
+        for key, entity, generics, job in jobs:
+            job.wait()
+            checkpoints[(entity, generics)] = self.checkpoint_cache.store(key, job.artifacts, job.vhdl_files)
+            shutil.rmtree(job.project_dir, ignore_errors=True)
+        #
+        # replace the sources of synthesized entities with their black box stubs
+        stubs = dict((entity, artifacts[entity + "_stub.vhd"]) for (entity, _), artifacts in checkpoints.items())
+        synthesized = set(entity.lower() for entity in stubs)
+        vhdl_files = []
+        for path in self._linked_files:
+            declared = library.declared.get(path)
+            if not declared or not declared <= synthesized:
+                vhdl_files.append(path)
+        vhdl_files.extend(stubs[entity] for entity in sorted(stubs))
+        dcp_paths = dict((instance, artifacts[instance[0] + ".dcp"]) for instance, artifacts in checkpoints.items())
+        return vhdl_files, {"checkpoints.tcl": checkpoint_script(dcp_paths)}
+
+    def _project_name(self, name):
+        """Return name of the synthesis project reused by all versions of this kernel.
+
+        The kernel is identified by the cache directory of its program
+        configuration, which does not change with the kernel source.
+        """
+        compile_dir = os.path.dirname(os.path.abspath(self._linked_files[0])) if self._linked_files else ""
+        return "%s-%s" % (name, hashlib.sha256(compile_dir).hexdigest()[:16])
+
+    def _activate(self, name, vhdl_files, scripts=None, project=None):
+        """Synthesize vhdl_files in a project of the synthesis scheduler.
+
+        :param name: name of the synthesized design
+        :type name: str
+        :param vhdl_files: paths of the VHDL files of the design
+        :type vhdl_files: list of str
+        :param scripts: further files of the project, file name -> content
+        :type scripts: dict
+        :param project: name of the reused project directory, None for a fresh directory
+        :type project: str
+        :returns: SynthesisJob -- queued job
+        """
+        return self.synthesis_scheduler.submit(name, vhdl_files, scripts, project)
+
+    def wait_synthesis(self, timeout=None):
+        """Wait for the synthesis started by get_callable and add its bitstream to the bitstream cache.
+
+        :param timeout: maximum seconds to wait
+        :type timeout: float
+        :raises TransformationError: raised if the synthesis failed or did not finish within timeout
+        """
+        with self._synthesis_lock:
+            if self._synthesis is None:
+                return
+            key, job = self._synthesis
+            try:
+                job.wait(timeout)
+            except TransformationError:
+                if job.done():
+                    self._synthesis = None
+                raise
+            self._synthesis = None
+            logger.info("Synthesized %s in %.1f s" % (job.name, job.duration))
+            self._store_artifacts(key, job)
+
+    def _store_artifacts(self, key, job):
+        """Add bitstream and synthesis results of a finished job to the bitstream cache."""
+        if job.artifacts:
+            self.artifacts = self.bitstream_cache.store(key, job.artifacts, self._linked_files)
+            if job.project is None:
+                # the cache holds copies of everything needed later
+                shutil.rmtree(job.project_dir, ignore_errors=True)
         else:
-            pass
+            logger.warning("No synthesis artifacts found in %s, bitstream not cached" % job.project_dir)
 
 
 class VhdlLazySpecializedFunction(LazySpecializedFunction):
@@ -162,26 +361,302 @@ class VhdlLazySpecializedFunction(LazySpecializedFunction):
 
         """
         self.py_func = py_func
+        self._py_fallback = None
+        # signatures of arguments the kernel can not be specialized for
+        self._unsupported = set()
+        # signature of arguments -> cache directory of their program configuration
+        self._dispatch = {}
         super(VhdlLazySpecializedFunction, self).__init__(py_ast, sub_dir, backend_name)
 
     def __call__(self, *args, **kwargs):
         """ Added error-handling with Python fall-back around super.__call__.
 
-        If calling the __call__ method of the super-class raises an TransformationError exeption, the passed Python
-        function will be called instead of an specialized version. In case of an TransformationError, the cache is
-        cleared.
+        If specializing raises a TransformationError, the Python function is called instead of a specialized
+        version. Only the cache directory of the failing configuration is removed and replaced by a negative cache
+        entry, so later calls with the same configuration skip the transformation until the kernel or the back-end
+        changes. Within the process, the argument signature is remembered as well and later calls with it dispatch
+        to the Python function right away.
+
+        Calls with the signature of an earlier successful call are dispatched to its cached concrete function without
+        deriving the program configuration again. A signature is registered only after its call succeeded; if a
+        dispatched call raises a TransformationError, the Python function is called and the signature is dropped.
+        """
+        signature = self._arg_signature(args, kwargs)
+        csf = self._dispatched_function(signature)
+        dir_name = None
+        if csf is None:
+            if signature in self._unsupported:
+                return self.python_function(*args, **kwargs)
+
+            try:
+                dir_name = self.config_to_dirname(self.get_program_config(args, kwargs))
+            except TransformationError as e:
+                logger.warning("Unsupported arguments, calling Python function: %s" % e)
+                return self._fall_back(signature, args, kwargs)
+
+            if self._known_failure(dir_name):
+                return self._fall_back(signature, args, kwargs)
+
+            try:
+                csf = self.get_concrete_function(*args, **kwargs)
+            except TransformationError as e:
+                logger.warning("Specialization failed, calling Python function: %s" % e)
+                self._invalidate(dir_name, e)
+                return self._fall_back(signature, args, kwargs)
 
-        .. todo:: refine cache cleaning in error case
+        try:
+            result = csf(*args, **kwargs)
+        except TransformationError as e:
+            logger.warning("Specialized call failed, calling Python function: %s" % e)
+            self._dispatch.pop(signature, None)
+            return self.python_function(*args, **kwargs)
+        if dir_name is not None:
+            self._dispatch[signature] = dir_name
+        return result
+
+    @staticmethod
+    def _arg_signature(args, kwargs):
+        """Return hashable signature of the arguments the program configuration is derived from.
+
+        Arrays are described by dtype, shape, number of dimensions and contiguity. Numbers, strings and None are
+        described by type and value, as they may select the program configuration, other objects by their type
+        only. args_to_subconfig must not depend on other properties of the arguments.
+        """
+        def signature(arg):
+            if isinstance(arg, np.ndarray):
+                return np.ndarray, arg.dtype.str, arg.shape, arg.ndim, arg.flags.c_contiguous
+            if arg is None or isinstance(arg, (bool, int, long, float, complex, basestring)):
+                return type(arg), arg
+            return type(arg)
+        return tuple(signature(arg) for arg in args) + \
+            tuple((key, signature(kwargs[key])) for key in sorted(kwargs))
+
+    def _dispatched_function(self, signature):
+        """Return cached concrete function of an earlier call with signature or None."""
+        dir_name = self._dispatch.get(signature)
+        if dir_name is None:
+            return None
+        csf = self.concrete_functions.get(dir_name)
+        if csf is None:
+            # evicted, derive configuration again
+            del self._dispatch[signature]
+        return csf
+
+    def _fall_back(self, signature, args, kwargs):
+        """Remember signature as unsupported and call the Python function."""
+        self._unsupported.add(signature)
+        return self.python_function(*args, **kwargs)
+
+    @property
+    def python_function(self):
+        """Return py_func with basic blocks it does not define bound to the NumPy kernels of the emulator."""
+        if self._py_fallback is None:
+            func = self.py_func
+            missing = [name for name in func.func_code.co_names
+                       if name in PY_KERNELS and name not in func.func_globals]
+            if missing:
+                func_globals = dict(func.func_globals)
+                func_globals.update((name, PY_KERNELS[name]) for name in missing)
+                # type(func) is the function type, an implicit "import types" would find the VHDL types module
+                func = type(func)(func.func_code, func_globals, func.func_name,
+                                  func.func_defaults, func.func_closure)
+            self._py_fallback = func
+        return self._py_fallback
+
+    @property
+    def negative_cache_filename(self):
+        return 'failed.json'
+
+    def _invalidate(self, dir_name, error):
+        """Replace cache directory of a failing configuration with a negative cache entry.
+
+        :param dir_name: cache directory of the configuration
+        :type dir_name: str
+        :param error: error raised while specializing
+        :type error: TransformationError
         """
-        ret = None
+        self.concrete_functions.pop(dir_name, None)
+        shutil.rmtree(dir_name, ignore_errors=True)
         try:
-            ret = super(VhdlLazySpecializedFunction, self).__call__(*args, **kwargs)
+            os.makedirs(dir_name)
+            with open(os.path.join(dir_name, self.negative_cache_filename), "w") as failed_file:
+                json.dump({"hash": self.fingerprint(), "error": str(error)}, failed_file)
+        except (IOError, OSError) as e:
+            logger.warning("Could not record failed specialization in %s: %s" % (dir_name, e))
+
+    def _known_failure(self, dir_name):
+        """Return True if a negative cache entry of the current kernel and back-end exists for dir_name."""
+        failed_filepath = os.path.join(dir_name, self.negative_cache_filename)
+        if not os.path.exists(failed_filepath):
+            return False
+        with open(failed_filepath) as failed_file:
+            failed = json.load(failed_file)
+        if failed.get("hash") == self.fingerprint():
+            return True
+        # kernel or back-end changed since the failure, retry
+        os.remove(failed_filepath)
+        return False
+
+    def get_transform_result(self, program_config, dir_name, cache=True):
+        """Keep the VHDL IR of generated files in the filesystem cache.
+
+        Files restored from the filesystem cache carry no VHDL IR, which the
+        emulator of hosts without hardware needs. There the IR saved next to
+        the files is restored, transform runs again only if it is missing.
+        """
+        transform_result = super(VhdlLazySpecializedFunction, self).get_transform_result(program_config, dir_name,
+                                                                                        cache)
+        if self._has_ir(transform_result):
+            self._save_ir(transform_result)
+        elif os.uname()[-1] != "armv7l" and not self._load_ir(transform_result):
+            logger.info("No VHDL IR in the filesystem cache, transform again for the emulator")
+            transform_result = super(VhdlLazySpecializedFunction, self).get_transform_result(program_config,
+                                                                                            dir_name, False)
+            self._save_ir(transform_result)
+        return transform_result
+
+    @staticmethod
+    def _has_ir(transform_result):
+        """Return True if a file of transform_result carries a VHDL IR module."""
+        return any(f.body and isinstance(f.body[0], VhdlModule) for f in transform_result)
+
+    # format of the pickled VHDL IR, increment on incompatible changes of the IR nodes
+    IR_FORMAT = 1
+
+    @staticmethod
+    def _ir_path(vhdl_file):
+        return os.path.join(vhdl_file.path, vhdl_file.name + ".ir")
+
+    def _save_ir(self, transform_result):
+        """Pickle the VHDL IR module of each file of transform_result next to the file.
+
+        Each pickle is written to a temporary file and renamed into place, so
+        processes of specialize_all never read a partially written IR. It
+        records the IR format and the fingerprint of kernel and back-end.
+        """
+        ir_files = [f for f in transform_result if f.body and isinstance(f.body[0], VhdlModule)]
+        try:
+            for f in ir_files:
+                fd, tmp_path = tempfile.mkstemp(prefix=f.name + ".ir.", dir=f.path)
+                try:
+                    with os.fdopen(fd, "wb") as ir_file:
+                        pickle.dump({"format": self.IR_FORMAT, "hash": self.fingerprint(), "module": f.body[0]},
+                                    ir_file, pickle.HIGHEST_PROTOCOL)
+                    os.rename(tmp_path, self._ir_path(f))
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        except (pickle.PicklingError, RuntimeError, TypeError, IOError, OSError) as e:
+            logger.warning("Could not save VHDL IR, cached files will be transformed again: %s" % e)
+            for f in ir_files:
+                if os.path.exists(self._ir_path(f)):
+                    os.remove(self._ir_path(f))
+
+    def _load_ir(self, transform_result):
+        """Restore the VHDL IR modules of files restored from the filesystem cache.
+
+        :returns: bool -- False if no VHDL IR was saved, it could not be read or stems from another format or back-end
+        """
+        loaded = False
+        for f in transform_result:
+            if not os.path.exists(self._ir_path(f)):
+                continue
+            try:
+                with open(self._ir_path(f), "rb") as ir_file:
+                    saved = pickle.load(ir_file)
+            except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, IOError) as e:
+                # truncated or referring to classes of another version of the back-end
+                logger.warning("Could not restore VHDL IR of %s: %s" % (f.name, e))
+                return False
+            if not isinstance(saved, dict) or saved.get("format") != self.IR_FORMAT or \
+                    saved.get("hash") != self.fingerprint():
+                logger.info("VHDL IR of %s was saved by another back-end, not restored" % f.name)
+                return False
+            f.body = [saved["module"]]
+            loaded = True
+        return loaded
+
+    def fingerprint_sources(self):
+        """Add the VHDL back-end and the basic block library to the sources identifying the code generator."""
+        import codegen
+        import dsl
+        import nodes
+        import transformations
+        import types as vhdl_types
+        from utils import get_basic_block_digest
+        sources = super(VhdlLazySpecializedFunction, self).fingerprint_sources()
+        sources.extend(inspect.getsource(module) for module in (dsl, transformations, nodes, vhdl_types, codegen))
+        sources.append(get_basic_block_digest())
+        return sources
+
+    def submit(self, *args, **kwargs):
+        """Queue an asynchronous invocation of the specialized function.
+
+        Consecutive submits with the same configuration share one cached
+        concrete function and therefore one pipeline.
+
+        :returns: AcceleratorFuture -- future of the result, already completed if the Python function is used
+        """
+        signature = self._arg_signature(args, kwargs)
+        csf = self._dispatched_function(signature)
+        if csf is not None:
+            return csf._module.submit(*args)
+        if signature in self._unsupported:
+            return completed_future(self.python_function(*args, **kwargs))
+        try:
+            dir_name = self.config_to_dirname(self.get_program_config(args, kwargs))
         except TransformationError:
-            print "Calling Python function ..."
-            subprocess.call(["ctree", "-cc"])
-            ret = self.py_func(*args, **kwargs)
-        finally:
-            return ret
+            return completed_future(self._fall_back(signature, args, kwargs))
+        if self._known_failure(dir_name):
+            return completed_future(self._fall_back(signature, args, kwargs))
+        try:
+            csf = self.get_concrete_function(*args, **kwargs)
+        except TransformationError as e:
+            self._invalidate(dir_name, e)
+            return completed_future(self._fall_back(signature, args, kwargs))
+        future = csf._module.submit(*args)
+        self._dispatch[signature] = dir_name
+        return future
+
+    def prepare(self, *args, **kwargs):
+        """Generate the VHDL files of the configuration selected by the arguments into the filesystem cache.
+
+        Nothing is synthesized or loaded. A failing transformation is recorded as negative cache entry.
+
+        :returns: list of str -- paths of the cached files, None if the Python function is used for the arguments
+        """
+        try:
+            program_config = self.get_program_config(args, kwargs)
+        except TransformationError as e:
+            logger.warning("Unsupported arguments, not specialized: %s" % e)
+            return None
+        dir_name = self.config_to_dirname(program_config)
+        if self._known_failure(dir_name):
+            return None
+        info = self.get_info(dir_name)
+        if info['hash'] == self.fingerprint():
+            return info['files']
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        try:
+            file_paths = []
+            transform_result = self.run_transform(program_config)
+            for source_file in transform_result:
+                source_file.path = dir_name
+                file_paths.append(source_file._compile(source_file.codegen()))
+            self._save_ir(transform_result)
+        except TransformationError as e:
+            logger.warning("Specialization failed: %s" % e)
+            self._invalidate(dir_name, e)
+            return None
+        self.set_info(dir_name, {'hash': self.fingerprint(), 'files': file_paths})
+        return file_paths
+
+    def __getstate__(self):
+        """Leave out the Python function, kernels defined in functions can not be pickled."""
+        state = super(VhdlLazySpecializedFunction, self).__getstate__()
+        state.update(py_func=None, _py_fallback=None, _unsupported=set(), _dispatch={})
+        return state
 
     @classmethod
     def from_function(cls, func, folder_name=''):
@@ -202,3 +677,52 @@ class VhdlLazySpecializedFunction(LazySpecializedFunction):
 
         func_ast = Replacer().visit(get_ast(func))
         return cls(py_ast=func_ast, sub_dir=folder_name or func.__name__, py_func=func)
+
+
+def _prepare(job):
+    """Worker of specialize_all."""
+    lsf, args, kwargs = job
+    return lsf.prepare(*args, **kwargs)
+
+
+def specialize_all(calls, processes=None):
+    """Generate the VHDL files of many specialized functions in parallel worker processes.
+
+    Transformation and code generation of every call run in a worker of a process pool, the generated files are
+    written to the filesystem cache. Later calls of the specialized functions with the same argument signatures skip
+    the transformation on the target, where files of the filesystem cache are used without their VHDL IR.
+
+    :param calls: specialized function, positional arguments and optionally keyword arguments of each call
+    :type calls: list of tuple
+    :param processes: number of worker processes, default from app.config, 0 for one per core
+    :type processes: int
+    :returns: list -- paths of the cached files of each call, None for calls using the Python function
+    """
+    jobs = OrderedDict()
+    keys = []
+    for call in calls:
+        lsf, args = call[0], tuple(call[1])
+        kwargs = dict(call[2]) if len(call) > 2 else {}
+        # calls with the same configuration must not write one cache directory concurrently
+        key = (id(lsf), lsf._arg_signature(args, kwargs))
+        jobs.setdefault(key, (lsf, args, kwargs))
+        keys.append(key)
+    #
+    if processes is None:
+        processes = config.getint("Specialization", "processes")
+    if processes == 0:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+    #
+    if processes > 1:
+        logger.info("Specialize %d configurations in %d processes" % (len(jobs), processes))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_prepare, jobs.values(), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_prepare(job) for job in jobs.values()]
+    results = dict(zip(jobs.keys(), results))
+    return [results[key] for key in keys]
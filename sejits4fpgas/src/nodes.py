@@ -1,7 +1,6 @@
 """This module contains all node and signal classes of the VHDL IR."""
 import collections
 import logging
-import new
 import os
 from collections import namedtuple
 
@@ -33,6 +32,15 @@ PortInfo = namedtuple("PortInfo", ("name", "direction", "vhdl_type"))
 GenericInfo = namedtuple("GenericInfo", ("name", "vhdl_type"))
 
 
+def _new_node(cls):
+    """Return uninitialized node of cls, counterpart of VhdlTreeNode.__reduce__."""
+    try:
+        return cls.__new__(cls)
+    except TypeError:
+        # signal nodes derive from VhdlSignal before the AST node
+        return object.__new__(cls)
+
+
 class VhdlTreeNode(CtreeNode):
     """Base class for all Vhdl AST nodes in sejits_ctree."""
 
@@ -43,6 +51,10 @@ class VhdlTreeNode(CtreeNode):
     def __str__(self):
         return self.__class__.__name__
 
+    def __reduce__(self):
+        # restore the attributes without calling __init__, which requires arguments
+        return _new_node, (type(self),), self.__dict__
+
     def to_dot(self):
         """Retrieve the AST in DOT format for visualization."""
         return "digraph mytree {\n%s}" % self._to_dot()
@@ -419,7 +431,7 @@ class VhdlDReg(VhdlNode):
         :param out_port: list of output signals
 
         :raises TransformationError: raised if len(in_port) and/or len(out_port) != 1
-        :raises TransformationError: raised if delay is not >= 0
+        :raises TransformationError: raised if delay is not >= 1
 
         """
         inport_info = [PortInfo("DREG_IN", "in", in_port[0].vhdl_type)]
@@ -432,10 +444,10 @@ class VhdlDReg(VhdlNode):
                                        outport_info)
         self.library = "work.DReg"
 
-        if delay > 1:
+        if delay >= 1:
             self.d = delay
         else:
-            error_msg = "Delay of Component must be >= 1"
+            error_msg = "Delay of D-Register must be >= 1"
             raise TransformationError(error_msg)
 
     def finalize_ports(self):
@@ -491,6 +503,10 @@ class VhdlFile(VhdlBaseNode, File):
         !!!Changed in prebuilt instances!!!.
         """
         vhdl_src_file = os.path.join(self.path, self.get_filename())
+        if not self.body and os.path.exists(vhdl_src_file):
+            # file restored from filesystem cache, keep generated description
+            logger.info("file for cached VHDL: %s", vhdl_src_file)
+            return vhdl_src_file
         with open(vhdl_src_file, 'w') as vhdl_file:
             vhdl_file.write(program_text)
         logger.info("file for generated VHDL: %s", vhdl_src_file)
@@ -504,25 +520,8 @@ class VhdlFile(VhdlBaseNode, File):
 
     @classmethod
     def from_prebuilt(cls, name="prebuilt", path=""):
-        """Generate Vhdl File from prebuilt source file.
-
-        Generate VhdlFile instance and change _compile method to write
-        VHDL description into new file in cache directory.
-        """
-        vhdlfile = VhdlFile(name, body=[], path="")
-        vhdlfile.file_path = path
-        #
-        def _compile(self, program_text):
-            vhdl_src_file = os.path.join(self.path, self.get_filename())
-            with open(vhdl_src_file, 'w') as cache_file, open(self.file_path, 'r') as vhdl_file:
-                cache_file.write(vhdl_file.read())
-            logger.info("file for generated VHDL: %s", vhdl_src_file)
-            logger.info("generated VHDL program: (((\n%s\n)))", program_text)
-            return vhdl_src_file
-
-        vhdlfile._compile = new.instancemethod(_compile, vhdlfile, None)
-        #
-        return vhdlfile
+        """Generate Vhdl File from prebuilt source file."""
+        return VhdlPrebuiltFile(name, file_path=path)
 
     def component(self):
         """Return VhdlComponent class for file."""
@@ -535,6 +534,45 @@ class VhdlFile(VhdlBaseNode, File):
         return comp
 
 
+class VhdlPrebuiltFile(VhdlFile):
+    """Vhdl File of a prebuilt source file, copied into the cache directory instead of generated."""
+
+    def __init__(self, name="prebuilt", file_path="", digest=None):
+        """Initialize prebuilt Vhdl File.
+
+        :param name: file name without extension
+        :param file_path: path of the prebuilt source file
+        :param digest: SHA-256 hex digest of the source file, saves reading it to detect unchanged copies
+        """
+        VhdlFile.__init__(self, name, body=[], path="")
+        self.file_path = file_path
+        self.digest = digest
+
+    def _compile(self, program_text):
+        """Copy prebuilt source into the cache directory, keep an unchanged copy.
+
+        The cache directory holds a copy rather than a link to the library
+        file, so edits in the cache or a synthesis project can not change the
+        library. A copy with the size and modification time of the source is
+        kept without reading it.
+        """
+        from utils import copy_file
+        from utils import file_digest
+        from utils import same_content
+        vhdl_src_file = os.path.join(self.path, self.get_filename())
+        if self.digest is not None and os.path.exists(vhdl_src_file):
+            src_stat, dst_stat = os.stat(self.file_path), os.stat(vhdl_src_file)
+            # copy_file keeps the modification time of the source, up to the float precision of os.utime
+            unchanged = src_stat.st_size == dst_stat.st_size and abs(src_stat.st_mtime - dst_stat.st_mtime) < 1e-3 or \
+                file_digest(vhdl_src_file) == self.digest
+        else:
+            unchanged = same_content(self.file_path, vhdl_src_file)
+        if not unchanged:
+            copy_file(self.file_path, vhdl_src_file)
+        logger.info("file for prebuilt VHDL: %s", vhdl_src_file)
+        return vhdl_src_file
+
+
 class VhdlProject(Project):
     """VhdlProject class representing one vhdl project."""
 
@@ -562,6 +600,8 @@ class VhdlProject(Project):
             submodule = f._compile(f_src)
             if submodule:
                 self._module._link_in(submodule)
+            if f.body and isinstance(f.body[0], VhdlModule):
+                self._module._link_in_module(f.body[0])
         return self._module
 
     @property
@@ -584,9 +624,12 @@ class VhdlSyncNode(VhdlNode):
         :param in_port: list of input signals
         :param out_port: list of output signals
         """
-        self.generic_slice = slice(0, 3)
+        self.generic_slice = slice(0, 4)
 
         super(VhdlSyncNode, self).__init__(prev, in_port, None, out_port, None)
+        # set by the VhdlGraphTransformer, one entry per synchronized input
+        self.fifo_depths = []
+        self.fifo_types = []
 
         self.d = 0
         self.name = "VhdlSyncNode"
@@ -599,7 +642,8 @@ class VhdlSyncNode(VhdlNode):
 
         self.generic_info = [GenericInfo("WIDTH", VhdlType.VhdlPositive()),
                              GenericInfo("N_IO", VhdlType.VhdlPositive()),
-                             GenericInfo("DELAY", VhdlType.VhdlPositive())]
+                             GenericInfo("DEPTHS", self.generic[2].vhdl_type),
+                             GenericInfo("BRAM_DEPTH", VhdlType.VhdlPositive())]
         self.inport_info = [PortInfo("SYNC_IN", "in", self.in_port[0].vhdl_type)]
         self.outport_info = [PortInfo("SYNC_OUT", "out", self.out_port[0].vhdl_type)]
         #
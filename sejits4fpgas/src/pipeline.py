@@ -0,0 +1,176 @@
+"""Asynchronous, double-buffered invocation of hardware accelerators."""
+import logging
+import threading
+import Queue
+
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+
+class AcceleratorFuture(object):
+
+    """Result of an accelerator invocation that may not have finished yet."""
+
+    def __init__(self, unpack=None):
+        """Initialize future.
+
+        :param unpack: function applied to the raw accelerator output on first access of result()
+        :type unpack: callable
+        """
+        self._unpack = unpack
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """Return True if the accelerator finished this invocation."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for and return the unpacked result.
+
+        :raises RuntimeError: raised if timeout expires before the invocation finished
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Accelerator invocation did not finish within %s s" % timeout)
+        if self._exception is not None:
+            raise self._exception
+        with self._lock:
+            if self._unpack is not None:
+                # unpack on the consumer thread, overlapping the next execution
+                self._result = self._unpack(self._result)
+                self._unpack = None
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the invocation and return the raised exception or None."""
+        if not self._done.wait(timeout):
+            raise RuntimeError("Accelerator invocation did not finish within %s s" % timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Call fn(future) as soon as the invocation finished."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+def completed_future(result):
+    """Return an AcceleratorFuture already holding result."""
+    future = AcceleratorFuture()
+    future._set_result(result)
+    return future
+
+
+def as_completed(futures, timeout=None):
+    """Yield futures in the order their invocations finish.
+
+    :param futures: iterable of AcceleratorFuture
+    :param timeout: maximum seconds to wait for the next future
+    :raises RuntimeError: raised if no further future finished within timeout
+    """
+    futures = list(futures)
+    finished = Queue.Queue()
+    for future in futures:
+        future.add_done_callback(finished.put)
+    for _ in futures:
+        try:
+            yield finished.get(timeout=timeout)
+        except Queue.Empty:
+            raise RuntimeError("No accelerator invocation finished within %s s" % timeout)
+
+
+class AcceleratorPipeline(object):
+
+    """Overlap host-side packing and unpacking with accelerator execution.
+
+    Frames are packed into DMA buffers on the submitting thread and executed
+    one after another by a single worker thread, which copies each result out
+    of its buffer and returns the buffer to the pool. At most depth frames and
+    therefore depth buffers are in flight; submit blocks until a buffer of the
+    ring is free again.
+    """
+
+    def __init__(self, synth_module, depth=None):
+        """Initialize pipeline and start worker thread.
+
+        :param synth_module: module providing _pack, _execute, _unpack and _recycle
+        :type synth_module: VhdlSynthModule
+        :param depth: number of frames in flight, default from app.config
+        :type depth: int
+        """
+        if depth is None:
+            depth = config.getint("DMA", "pipeline_depth")
+        self.synth_module = synth_module
+        self.depth = depth
+        self._slots = threading.Semaphore(depth)
+        self._jobs = Queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="accelerator-worker")
+        self._worker.daemon = True
+        self._worker.start()
+        logger.info("Started accelerator pipeline with depth %d" % depth)
+
+    def submit(self, *args):
+        """Queue one invocation and return its AcceleratorFuture."""
+        self._slots.acquire()
+        try:
+            packed = self.synth_module._pack(args)
+        except Exception:
+            self._slots.release()
+            raise
+        future = AcceleratorFuture()
+        self._jobs.put((future, packed, args))
+        return future
+
+    def close(self):
+        """Finish queued invocations and stop the worker thread."""
+        self._jobs.put(None)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, packed, args = job
+            try:
+                result = self.synth_module._unpack(self.synth_module._execute(packed), args)
+            except Exception as e:
+                future._set_exception(e)
+            else:
+                future._set_result(result)
+            finally:
+                # the frame is complete, its buffer is free for the next submit
+                self.synth_module._recycle(packed, args)
+                self._slots.release()
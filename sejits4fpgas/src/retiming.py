@@ -0,0 +1,156 @@
+"""Minimum register retiming of the VHDL IR DAG."""
+import logging
+
+from nodes import VhdlComponent
+from nodes import VhdlConstant
+from nodes import VhdlReturn
+from nodes import VhdlSource
+from errors import TransformationError
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+# vertex of the input stream, all VhdlSources start at cycle 0
+STREAM_IN = "stream_in"
+
+
+def _min_delay(d):
+    """Return best case delay of fixed (int) or variable (tuple) delay."""
+    return d[0] if isinstance(d, tuple) else d
+
+
+def schedule(nodes, share_delay_lines=True):
+    """Return the start cycles of the nodes minimizing the register bits of all balancing delays.
+
+    Every edge u -> v of the DAG is delayed by s_v - s_u - d_u cycles, where
+    s is the start cycle of a node and d_u its (minimum) latency. The edge
+    costs its signal width per cycle of delay. The program
+
+        minimize    sum_e width_e * (s_v - s_u - d_u)
+        subject to  s_v - s_u >= d_u  for every edge e = u -> v
+
+    is the dual of a min-cost flow problem (Leiserson and Saxe, minimum area
+    retiming) and is solved by cycle canceling. If a signal consumed by
+    several nodes is delayed by one tapped delay line, it costs only its
+    deepest tap. Like Leiserson and Saxe this is modeled by a mirror vertex
+    that starts after all consumers of the signal.
+
+    :param nodes: nodes of the DAG in topological order
+    :type nodes: list of VhdlNode
+    :param share_delay_lines: cost a signal delayed for several consumers by its deepest tap
+    :type share_delay_lines: bool
+    :returns: dict -- id of VhdlComponent and VhdlReturn node -> start cycle
+    """
+    # vertices are the ids of the nodes
+    edges = []  # (tail vertex, head vertex, latency, cost)
+    consumers = {}  # (id of node, id of signal) -> (driving node, width, consumer vertices)
+    retimed = []
+    for node in nodes:
+        if isinstance(node, VhdlSource):
+            # the stream delivers all inputs in the same cycle
+            edges.append((STREAM_IN, id(node), 0, 0))
+            edges.append((id(node), STREAM_IN, 0, 0))
+        elif isinstance(node, (VhdlComponent, VhdlReturn)):
+            retimed.append(id(node))
+            for prev, sig in zip(node.prev, node.in_port):
+                if isinstance(sig, VhdlConstant):
+                    continue
+                key = (id(prev), id(sig))
+                if key not in consumers:
+                    consumers[key] = (prev, len(sig.vhdl_type), set())
+                consumers[key][2].add(id(node))
+    for key, (prev, width, heads) in consumers.items():
+        latency = _min_delay(prev.d)
+        if share_delay_lines and len(heads) > 1:
+            mirror = ("tap",) + key
+            for head in heads:
+                edges.append((id(prev), head, latency, 0))
+                edges.append((head, mirror, 0, 0))
+            edges.append((id(prev), mirror, latency, width))
+        else:
+            for head in heads:
+                edges.append((id(prev), head, latency, width))
+    if not edges:
+        return {}
+    #
+    starts = _solve(edges)
+    offset = starts.get(STREAM_IN, 0)
+    return dict((node_id, starts[node_id] - offset) for node_id in retimed if node_id in starts)
+
+
+def _solve(edges):
+    """Return vertex potentials s minimizing sum cost * (s_head - s_tail - latency) with s_head - s_tail >= latency.
+
+    The flow f_e = cost_e is feasible for the dual problem of maximizing
+    sum latency * f subject to the flow balance of the costs. Negative cycles
+    of the residual graph are canceled until the flow is optimal. The
+    shortest path distances of the residual graph then are the negated
+    optimal potentials.
+
+    :param edges: list of (tail vertex, head vertex, latency, cost)
+    :returns: dict -- vertex -> potential
+    """
+    flow = [cost for _, _, _, cost in edges]
+    n_canceled = 0
+    while True:
+        dist, cycle = _bellman_ford(edges, flow)
+        if cycle is None:
+            break
+        backward = [flow[e] for e, forward in cycle if not forward]
+        if not backward:
+            raise TransformationError("Retiming constraints are unbounded, the graph has a cycle")
+        amount = min(backward)
+        for e, forward in cycle:
+            flow[e] += amount if forward else -amount
+        n_canceled += 1
+    logger.debug("Retiming flow optimal after canceling %d cycles" % n_canceled)
+    return dict((v, -d) for v, d in dist.items())
+
+
+def _bellman_ford(edges, flow):
+    """Return distances in the residual graph from a virtual root connected to all vertices and a negative cycle.
+
+    :returns: tuple -- (dict vertex -> distance, list of (edge index, forward) of a negative cycle or None)
+    """
+    arcs = []  # (from, to, cost, edge index, forward)
+    dist = {}
+    for e, (tail, head, latency, _) in enumerate(edges):
+        arcs.append((tail, head, -latency, e, True))
+        if flow[e] > 0:
+            arcs.append((head, tail, latency, e, False))
+        dist[tail] = dist[head] = 0
+    pred = {}
+    updated = None
+    for _ in range(len(dist)):
+        updated = None
+        for frm, to, cost, e, forward in arcs:
+            if dist[frm] + cost < dist[to]:
+                dist[to] = dist[frm] + cost
+                pred[to] = (frm, e, forward)
+                updated = to
+        if updated is None:
+            return dist, None
+    # a vertex updated in the last round is reachable from a negative cycle
+    v = updated
+    for _ in range(len(dist)):
+        v = pred[v][0]
+    cycle = []
+    u = v
+    while True:
+        frm, e, forward = pred[u]
+        cycle.append((e, forward))
+        u = frm
+        if u == v:
+            break
+    return dist, cycle
@@ -0,0 +1,431 @@
+"""Concurrent synthesis of VHDL projects in separate project directories."""
+import glob
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import Queue
+from collections import OrderedDict
+
+from errors import TransformationError
+from bitstream_cache import TEMPLATE_IGNORE
+from bitstream_cache import TEMPLATE_PROJECT_PATH
+from utils import copy_file
+from utils import same_content
+from sejits4fpgas.src.config import config
+
+logger = logging.getLogger(__name__)
+logger.disabled = config.getboolean("Logging", "disable_logging")
+logger.setLevel(logging.DEBUG)
+# create console handler and set level to debug
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+# create formatter
+formatter = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+# add formatter to ch
+ch.setFormatter(formatter)
+# add ch to logger
+logger.addHandler(ch)
+
+OOC_TCL = """read_vhdl [list {files}]
+synth_design -mode out_of_context -top {entity} -part {part}{generics}
+write_checkpoint -force {entity}.dcp
+write_vhdl -force -mode synth_stub {entity}_stub.vhd
+"""
+
+
+def checkpoint_script(checkpoints):
+    """Return TCL script reading each checkpoint into the instances of its entity and generics.
+
+    The script is meant to be sourced after synthesis of the top-level design,
+    in which the entities are black boxes.
+
+    :param checkpoints: (entity name, generics) -> path of the design checkpoint
+    :type checkpoints: dict
+    :returns: str -- TCL script
+    """
+    lines = ["# generated: out-of-context checkpoints of the basic blocks"]
+    for (entity, generics), dcp_path in sorted(checkpoints.items()):
+        cell_filter = " && ".join(["REF_NAME == %s" % entity] + ["%s == %s" % g for g in generics])
+        lines.append("foreach cell [get_cells -quiet -hierarchical -filter {%s}] {" % cell_filter)
+        lines.append("    read_checkpoint -cell $cell {%s}" % dcp_path)
+        lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def project_tcl(template, proj_fol, file_names):
+    """Return project TCL script of template with origin_dir proj_fol and file_names added to its sources.
+
+    :param template: content of the TCL script written by Vivado for the template project
+    :type template: str
+    :param proj_fol: Vivado project folder
+    :type proj_fol: str
+    :param file_names: names of the VHDL files in template_project.srcs/sources_1/new/
+    :type file_names: list of str
+    """
+    tcl = re.sub(r"^set origin_dir .*$", lambda m: 'set origin_dir "%s"' % os.path.abspath(proj_fol),
+                 template, count=1, flags=re.MULTILINE)
+    tcl = re.sub(r"^create_project .*$", "create_project -force template_project ./template_project",
+                 tcl, count=1, flags=re.MULTILINE)
+    # end of the first "set files" list
+    files_block = re.search(r"^.*set files.*\n(?:.*\n)*?(?=\]\n)", tcl, flags=re.MULTILINE)
+    if files_block is None:
+        raise TransformationError("No source file list in project TCL script")
+    tcl_set_file = ' "[file normalize "$origin_dir/template_project.srcs/sources_1/new/{file_name}"]"\\\n'
+    new_files = "".join(tcl_set_file.format(file_name=file_name) for file_name in file_names)
+    return tcl[:files_block.end()] + new_files + tcl[files_block.end():]
+
+
+def link_project(proj_fol, vhdl_files):
+    """Copy vhdl_files into the Vivado project proj_fol and add them to its TCL script.
+
+    Linking is incremental: files already in the project with the same
+    content are kept, changed files are replaced by a copy and files of an
+    earlier design are removed. The project never shares a file with the
+    sources, so edits in the project do not change the basic block library. The TCL script is generated
+    from the script saved on the first link and only written if it changes.
+
+    :param proj_fol: Vivado project folder holding template_project.tcl
+    :type proj_fol: str
+    :param vhdl_files: paths of all VHDL files of the design
+    :type vhdl_files: list of str
+    """
+    proj_fol = os.path.join(proj_fol, "")
+    # vivado src folder
+    v_src_fol = proj_fol + "template_project.srcs/sources_1/new/"
+
+    sources = OrderedDict((os.path.basename(path), path) for path in vhdl_files)
+    # remove files of earlier designs
+    for proj_file in glob.glob(v_src_fol + "*"):
+        file_name = os.path.basename(proj_file)
+        if file_name != "top.vhd" and file_name not in sources:
+            os.remove(proj_file)
+    # copy new and changed files
+    n_copied = 0
+    for file_name, path in sources.items():
+        if not same_content(path, v_src_fol + file_name):
+            copy_file(path, v_src_fol + file_name)
+            n_copied += 1
+    logger.info("Copied %d of %d files into %s" % (n_copied, len(sources), proj_fol))
+
+    # Add update source files in TCL script
+    saved_tcl_file_path = proj_fol + "template_project.sav"
+    mod_tcl_file_path = proj_fol + "template_project.tcl"
+    if not os.path.exists(saved_tcl_file_path):
+        shutil.copy(mod_tcl_file_path, saved_tcl_file_path)
+    with open(saved_tcl_file_path, "r") as template_file:
+        tcl = project_tcl(template_file.read(), proj_fol, sources.keys())
+    with open(mod_tcl_file_path, "r") as old_tcl:
+        if old_tcl.read() == tcl:
+            return
+    with open(mod_tcl_file_path, "w") as new_tcl:
+        new_tcl.write(tcl)
+
+
+class SynthesisJob(object):
+
+    """Synthesis of one design in its own copy of the template project.
+
+    A job with a project name synthesizes in the project directory of that
+    name, which is kept and reused by later jobs of the same name, so only
+    the changed sources are copied again. Other jobs get a fresh directory.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, name, vhdl_files, scripts=None, project=None):
+        """Initialize job.
+
+        :param name: name of the design, prefix of the project directory
+        :type name: str
+        :param vhdl_files: paths of all VHDL files of the design
+        :type vhdl_files: list of str
+        :param scripts: further files written to the project directory, file name -> content
+        :type scripts: dict
+        :param project: name of the reused project directory, None for a fresh directory
+        :type project: str
+        """
+        self.name = name
+        self.vhdl_files = list(vhdl_files)
+        self.scripts = dict(scripts or {})
+        self.project = project
+        # synthesis tool and artifact patterns, scheduler defaults if None
+        self.tool_command = None
+        self.artifact_patterns = None
+        self.state = self.QUEUED
+        self.project_dir = None
+        self.returncode = None
+        self.artifacts = []
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+        self._done = threading.Event()
+
+    @property
+    def log_path(self):
+        """Return path of the synthesis tool output."""
+        if self.project_dir is None:
+            return None
+        return os.path.join(self.project_dir, "synthesis.log")
+
+    @property
+    def duration(self):
+        """Return run time of the synthesis in seconds or None if it did not finish."""
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def setup(self, project_dir, template_dir):
+        """Fill project_dir with a copy of the template project and the design files.
+
+        The template is copied into an empty project_dir only, a project set
+        up by an earlier job is updated with the changed design files.
+        """
+        if not os.path.exists(os.path.join(project_dir, "template_project.sav")):
+            # copy sources and scripts, not the results of earlier runs
+            ignore = shutil.ignore_patterns(*TEMPLATE_IGNORE)
+            for entry in os.listdir(template_dir):
+                src = os.path.join(template_dir, entry)
+                if ignore(template_dir, [entry]):
+                    continue
+                if os.path.isdir(src):
+                    shutil.copytree(src, os.path.join(project_dir, entry), ignore=ignore)
+                else:
+                    shutil.copy2(src, project_dir)
+        link_project(project_dir, self.vhdl_files)
+        for file_name, content in self.scripts.items():
+            with open(os.path.join(project_dir, file_name), "w") as script_file:
+                script_file.write(content)
+
+    def done(self):
+        """Return True if the synthesis finished or failed."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the synthesis and return the paths of its artifacts.
+
+        :raises TransformationError: raised if the synthesis failed or did not finish within timeout
+        """
+        if not self._done.wait(timeout):
+            raise TransformationError("Synthesis of %s did not finish within %s s" % (self.name, timeout))
+        if self.state == self.FAILED:
+            raise TransformationError("Synthesis of %s failed: %s" % (self.name, self.error))
+        return self.artifacts
+
+
+class OutOfContextJob(SynthesisJob):
+
+    """Out-of-context synthesis of one entity with fixed generics into a design checkpoint.
+
+    The artifacts are the checkpoint <entity>.dcp and the black box
+    declaration <entity>_stub.vhd used in place of the entity's sources.
+    """
+
+    def __init__(self, entity, generics, vhdl_files, part=None, tool_command=None):
+        """Initialize job.
+
+        :param entity: name of the synthesized entity
+        :type entity: str
+        :param generics: generic map of the entity
+        :type generics: tuple of (name, value) pairs
+        :param vhdl_files: paths of the VHDL files declaring entity and the entities it instantiates
+        :type vhdl_files: list of str
+        :param part: FPGA part, default from app.config
+        :type part: str
+        :param tool_command: command line running ooc.tcl in the project directory, default from app.config
+        :type tool_command: str
+        """
+        super(OutOfContextJob, self).__init__(entity, vhdl_files)
+        self.entity = entity
+        self.generics = tuple(generics)
+        self.part = part if part is not None else config.get("Synthesis", "part")
+        if tool_command is None:
+            tool_command = config.get("Synthesis", "ooc_tool_command")
+        self.tool_command = tool_command
+        self.artifact_patterns = [entity + ".dcp", entity + "_stub.vhd"]
+
+    def setup(self, project_dir, template_dir):
+        """Copy the design files to project_dir and write the synthesis script ooc.tcl."""
+        for path in self.vhdl_files:
+            shutil.copy(path, project_dir)
+        script = OOC_TCL.format(files=" ".join(os.path.basename(path) for path in self.vhdl_files),
+                                entity=self.entity,
+                                part=self.part,
+                                generics="".join(" -generic %s=%s" % g for g in self.generics))
+        with open(os.path.join(project_dir, "ooc.tcl"), "w") as script_file:
+            script_file.write(script)
+
+
+class SynthesisScheduler(object):
+
+    """Run synthesis jobs on a fixed number of worker threads.
+
+    Every job gets its own copy of the template project in the work directory,
+    so several designs are synthesized concurrently without sharing a project.
+    Jobs with a project name reuse the project directory of that name unless
+    it is in use by a running job.
+    Jobs beyond the number of workers wait in a queue. The synthesis tool is an
+    arbitrary command line run in the project directory; "{project_dir}" in it
+    is replaced by the project directory, other braces are passed on. A job
+    fails if the command exits with a non-zero status, the project directory
+    of a failed job is removed unless it is reused.
+    """
+
+    def __init__(self, template_dir=None, work_dir=None, tool_command=None, workers=None, progress=None,
+                 ooc_tool_command=None):
+        """Initialize scheduler, worker threads are started with the first job.
+
+        :param template_dir: Vivado template project copied for each job, default is the packaged project
+        :type template_dir: str
+        :param work_dir: directory holding the project directories of the jobs, default from app.config
+        :type work_dir: str
+        :param tool_command: command line of the synthesis tool, default from app.config
+        :type tool_command: str
+        :param workers: number of concurrent jobs, default from app.config
+        :type workers: int
+        :param progress: function called with the job on every state change
+        :type progress: callable
+        :param ooc_tool_command: command line of out-of-context synthesis jobs, default from app.config
+        :type ooc_tool_command: str
+        """
+        if template_dir is None:
+            template_dir = TEMPLATE_PROJECT_PATH
+        if work_dir is None:
+            work_dir = config.get("Synthesis", "work_dir")
+        if tool_command is None:
+            tool_command = config.get("Synthesis", "tool_command")
+        if workers is None:
+            workers = config.getint("Synthesis", "workers")
+        if ooc_tool_command is None:
+            ooc_tool_command = config.get("Synthesis", "ooc_tool_command")
+        self.template_dir = template_dir
+        self.work_dir = os.path.expanduser(work_dir)
+        self.tool_command = tool_command
+        self.ooc_tool_command = ooc_tool_command
+        self.workers = max(workers, 1)
+        self.progress = progress
+        self.artifact_pattern = config.get("BitstreamCache", "artifacts")
+        self.jobs = []
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        # reused project directories of running jobs
+        self._projects_in_use = set()
+
+    def submit(self, name, vhdl_files, scripts=None, project=None):
+        """Queue synthesis of vhdl_files in a copy of the template project and return its SynthesisJob."""
+        return self.submit_job(SynthesisJob(name, vhdl_files, scripts, project))
+
+    def submit_job(self, job):
+        """Queue job and return it."""
+        with self._lock:
+            self.jobs.append(job)
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="synthesis-worker-%d" % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put(job)
+        self._report(job)
+        return job
+
+    def status(self):
+        """Return number of jobs per state."""
+        counts = dict((state, 0) for state in (SynthesisJob.QUEUED, SynthesisJob.RUNNING,
+                                               SynthesisJob.DONE, SynthesisJob.FAILED))
+        for job in list(self.jobs):
+            counts[job.state] += 1
+        return counts
+
+    def close(self):
+        """Finish queued jobs and stop the worker threads."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            self._synthesize(job)
+
+    def _synthesize(self, job):
+        job.state = SynthesisJob.RUNNING
+        job.start_time = time.time()
+        self._report(job)
+        try:
+            job.project_dir = self._create_project(job)
+            job.setup(job.project_dir, self.template_dir)
+            tool_command = job.tool_command if job.tool_command is not None else self.tool_command
+            cmd = [arg.replace("{project_dir}", job.project_dir) for arg in shlex.split(tool_command)]
+            with open(job.log_path, "w") as log_file:
+                job.returncode = subprocess.call(cmd, cwd=job.project_dir, stdout=log_file, stderr=subprocess.STDOUT)
+            if job.returncode != 0:
+                raise TransformationError("%s exited with status %d:\n%s" % (cmd[0], job.returncode, self._log_tail(job)))
+            patterns = job.artifact_patterns if job.artifact_patterns is not None else [self.artifact_pattern]
+            job.artifacts = [path for pattern in patterns for path in glob.glob(os.path.join(job.project_dir, pattern))]
+            job.state = SynthesisJob.DONE
+        except Exception as e:
+            # keep the worker alive, the error is raised by job.wait
+            job.error = e
+            job.state = SynthesisJob.FAILED
+            if job.project is None and job.project_dir is not None:
+                # nobody collects the artifacts of a failed run
+                shutil.rmtree(job.project_dir, ignore_errors=True)
+        finally:
+            with self._lock:
+                self._projects_in_use.discard(job.project_dir)
+            job.end_time = time.time()
+            job._done.set()
+            self._report(job)
+
+    def _create_project(self, job):
+        """Return project directory of job, a new empty one unless job reuses a project that is not in use."""
+        if not os.path.exists(self.work_dir):
+            try:
+                os.makedirs(self.work_dir)
+            except OSError:
+                # created concurrently
+                pass
+        if job.project is not None:
+            project_dir = os.path.join(self.work_dir, job.project)
+            with self._lock:
+                in_use = project_dir in self._projects_in_use
+                self._projects_in_use.add(project_dir)
+            if not in_use:
+                if not os.path.isdir(project_dir):
+                    os.makedirs(project_dir)
+                return project_dir
+            logger.info("Project %s is in use, synthesize %s in a new project" % (project_dir, job.name))
+            job.project = None
+        return tempfile.mkdtemp(prefix=job.name + "-", dir=self.work_dir)
+
+    @staticmethod
+    def _log_tail(job, n_lines=20):
+        """Return the last n_lines of the synthesis tool output of job."""
+        with open(job.log_path) as log_file:
+            return "".join(log_file.readlines()[-n_lines:])
+
+    def _report(self, job):
+        counts = self.status()
+        finished = counts[SynthesisJob.DONE] + counts[SynthesisJob.FAILED]
+        logger.info("Synthesis of %s %s (%d/%d finished, %d running)" %
+                    (job.name, job.state, finished, len(self.jobs), counts[SynthesisJob.RUNNING]))
+        if self.progress is not None:
+            self.progress(job)
+
+
+# scheduler shared by all hardware modules of the process
+synthesis_scheduler = SynthesisScheduler()
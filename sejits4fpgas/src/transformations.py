@@ -6,6 +6,7 @@ from collections import defaultdict
 from itertools import izip_longest
 
 from nodes import VhdlSyncNode
+from nodes import VhdlComponent
 from nodes import VhdlConstant
 from nodes import VhdlModule
 from nodes import VhdlLibrary
@@ -21,6 +22,7 @@ from nodes import VhdlDReg
 from nodes import VhdlSignalSplit
 from nodes import VhdlConcatenation
 from types import VhdlType
+from retiming import schedule
 from sejits4fpgas.src.config import config
 from errors import TransformationError
 from vhdl_ctree.c.nodes import Op
@@ -41,6 +43,8 @@ logger.addHandler(ch)
 
 
 UNARY_OP = namedtuple("UNARY_OP", ["i_args", "out_arg"])
+# words a SyncNode FIFO holds beyond the skew of the other inputs
+SYNC_FIFO_SLACK = 2
 
 
 class VhdlBaseTransformer(object):
@@ -52,6 +56,7 @@ class VhdlBaseTransformer(object):
         The currently implemented transformers are:
             - VhdlKwdTransformer
             - VhdlIRTransformer
+            - VhdlCSETransformer
             - VhdlGraphTransformer
             - VhdlPortTransformer
     """
@@ -71,6 +76,7 @@ class VhdlBaseTransformer(object):
         """
         tree = VhdlKwdTransformer().visit(tree)
         tree = VhdlIRTransformer(self.ipt_params, self.lifted_functions).visit(tree)
+        tree = VhdlCSETransformer().visit(tree)
         tree = VhdlGraphTransformer().visit(tree)
         tree = VhdlPortTransformer().visit(tree)
         return tree
@@ -121,7 +127,7 @@ class VhdlIRTransformer(ast.NodeTransformer):
         :param ipt_param_types: type info for all kernel parameters
         :type ipt_param_types: list of VhdlType objects
         :param lifted_functions: function call specialized by DSL specializer transformer
-        :type lifted_functions: list of VhdlComponent objects
+        :type lifted_functions: list of VhdlComponent objects or LiftingContext
         :param axi_stream_width: width of hardware accelerator interface in bits
         :type axi_stream_width: int
         """
@@ -130,6 +136,8 @@ class VhdlIRTransformer(ast.NodeTransformer):
         self.n_con_signals = defaultdict(int)
         self.axi_stream_width = axi_stream_width
         # prepare lifte functions from DSL transformer
+        if hasattr(lifted_functions, "lifted_functions"):
+            lifted_functions = lifted_functions.lifted_functions()
         self.lifted_functions = lifted_functions
         self.lifted_function_names = {f.name for f in lifted_functions}
         #
@@ -268,30 +276,184 @@ class VhdlIRTransformer(ast.NodeTransformer):
             return node
 
 
-class VhdlGraphTransformer(ast.NodeTransformer):
+class VhdlCSETransformer(ast.NodeTransformer):
+
+    """Merge basic block instances computing the same value.
+
+        Two VhdlComponents compute the same value if they instantiate the same
+        library entity with the same generics on the same input signals. The
+        DAG is traversed in topological order, so the inputs of a component
+        are already merged when it is compared. All consumers of a duplicate
+        are connected to the first instance.
+    """
+
+    # entities whose data inputs may be swapped
+    COMMUTATIVE = ("work.AddBB", "work.MulBB")
 
     def __init__(self):
-        self.con_edge_id = 0
+        self.n_merged = 0
 
     def visit_VhdlModule(self, node):
-        map(self.visit, node.architecture)
+        instances = {}  # key -> first component
+        replaced = {}  # id of merged component or its output signal -> replacement
+        for dag_node in VhdlGraphTransformer.topological_order(node.architecture):
+            if not isinstance(dag_node, VhdlNode):
+                continue
+            dag_node.prev = [replaced.get(id(prev), prev) for prev in dag_node.prev]
+            dag_node.in_port = [replaced.get(id(sig), sig) for sig in dag_node.in_port]
+            if not isinstance(dag_node, VhdlComponent):
+                continue
+            key = self._key(dag_node)
+            if key in instances:
+                first = instances[key]
+                replaced[id(dag_node)] = first
+                replaced[id(dag_node.out_port[0])] = first.out_port[0]
+                self.n_merged += 1
+            else:
+                instances[key] = dag_node
+        if self.n_merged:
+            logger.info("Merged %d duplicate basic block instances" % self.n_merged)
         return node
 
-    def visit_VhdlReturn(self, node):
-        map(self.visit, node.prev)
-        self.retime(node)
-        return node
+    def _key(self, node):
+        """Return (library, generics, inputs) identifying the value computed by node."""
+        stop = node.generic_slice.stop if node.generic_slice else 0
+        generics = tuple(self._signal_key(sig) for sig in node.in_port[:stop])
+        inputs = [self._signal_key(sig) for sig in node.in_port[stop:]]
+        if node.library in self.COMMUTATIVE:
+            inputs.sort()
+        return node.library, generics, tuple(inputs)
 
-    def visit_VhdlBinaryOp(self, node):
-        map(self.visit, node.prev)
-        self.retime(node)
-        return node
+    @staticmethod
+    def _signal_key(sig):
+        if isinstance(sig, VhdlConstant):
+            return "constant", repr(sig.value)
+        return "signal", id(sig)
 
-    def visit_VhdlComponent(self, node):
-        map(self.visit, node.prev)
-        self.retime(node)
+
+class VhdlGraphTransformer(ast.NodeTransformer):
+
+    """Balance the delays of all paths through the VHDL IR DAG.
+
+        The DAG is retimed in a single pass over its nodes in topological
+        order. Every node is retimed once, after all of its predecessors, so
+        the arrival times d + dprev of the predecessors are final when the
+        incoming edges of the node are balanced.
+    """
+
+    ENGINES = ("greedy", "min_cost_flow")
+
+    def __init__(self, share_delay_lines=None, engine=None):
+        """Initialize transformer.
+
+        :param share_delay_lines: chain the D-registers delaying the same signal, default from app.config
+        :type share_delay_lines: bool
+        :param engine: "greedy" starts every node as soon as all inputs arrived, "min_cost_flow" chooses the start cycles minimizing the register bits, default from app.config
+        :type engine: str
+
+        :raises TransformationError: raised if engine is unknown
+        """
+        if share_delay_lines is None:
+            share_delay_lines = config.getboolean("Retiming", "share_delay_lines")
+        if engine is None:
+            engine = config.get("Retiming", "engine")
+        if engine not in self.ENGINES:
+            raise TransformationError("Unknown retiming engine %s" % engine)
+        self.share_delay_lines = share_delay_lines
+        self.engine = engine
+        self.bram_fifo_depth = config.getint("Retiming", "bram_fifo_depth")
+        self.con_edge_id = 0
+        self.saved_register_bits = 0
+        self.skew = {}  # id of node -> cycles its output may arrive after its minimum delay
+
+    def visit_VhdlModule(self, node):
+        order = self.topological_order(node.architecture)
+        starts = schedule(order, self.share_delay_lines) if self.engine == "min_cost_flow" else {}
+        for dag_node in order:
+            if isinstance(dag_node, (VhdlComponent, VhdlReturn)):
+                self.retime(dag_node, starts.get(id(dag_node)))
+        if self.share_delay_lines:
+            self.tap_delay_lines(self.topological_order(node.architecture))
         return node
 
+    @staticmethod
+    def topological_order(roots):
+        """Return all nodes reachable from roots over prev edges, every node after its predecessors.
+
+        :param roots: sink nodes of the DAG
+        :type roots: list of VhdlNode
+        :returns: list -- nodes in topological order, each node once
+        """
+        order = []
+        visited = set()
+        stack = [(root, False) for root in reversed(roots)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+            elif id(node) not in visited:
+                visited.add(id(node))
+                stack.append((node, True))
+                stack.extend((prev, False) for prev in reversed(getattr(node, "prev", [])))
+        return order
+
+    def tap_delay_lines(self, nodes):
+        """Merge the D-registers delaying the same signal into one tapped delay line.
+
+        Retiming delays every edge by its own VhdlDReg. A signal consumed at
+        several depths is instead delayed by a single chain of D-registers and
+        every consumer is connected to the tap of its depth. Each register of
+        a segment has the width of the signal, so the line costs only as many
+        registers as its deepest tap.
+
+        :param nodes: all nodes of the retimed DAG in topological order
+        :type nodes: list of VhdlNode
+        """
+        lines = defaultdict(list)  # (id of driving node, id of delayed signal) -> D-registers
+        consumers = defaultdict(list)  # id of D-register -> nodes it feeds
+        for node in nodes:
+            if isinstance(node, VhdlDReg):
+                lines[(id(node.prev[0]), id(node.in_port[0]))].append(node)
+            for prev in node.prev:
+                if isinstance(prev, VhdlDReg) and node not in consumers[id(prev)]:
+                    consumers[id(prev)].append(node)
+        #
+        bits_before = 0
+        bits_after = 0
+        for dregs in lines.values():
+            width = len(dregs[0].in_port[0].vhdl_type)
+            bits_before += width * sum(dreg.d for dreg in dregs)
+            taps = []  # (depth, D-register) of the delay line so far
+            for dreg in sorted(dregs, key=lambda dreg: dreg.d):
+                depth = dreg.d
+                if taps and taps[-1][0] == depth:
+                    # same depth as an existing tap, connect consumers to the tap
+                    for consumer in consumers[id(dreg)]:
+                        self._reconnect(consumer, dreg, taps[-1][1])
+                    continue
+                if taps:
+                    # extend the line from its deepest tap so far
+                    feed_depth, feed = taps[-1]
+                    dreg.prev = [feed]
+                    dreg.in_port = [feed.out_port[0]]
+                    dreg.d = depth - feed_depth
+                taps.append((depth, dreg))
+                bits_after += width * dreg.d
+        self.saved_register_bits += bits_before - bits_after
+        if bits_before:
+            logger.info("Tapped delay lines use %d instead of %d register bits" % (bits_after, bits_before))
+
+    @staticmethod
+    def _reconnect(node, old, new):
+        """Replace predecessor old of node and the signals driven by it by new."""
+        old_sig, new_sig = old.out_port[0], new.out_port[0]
+        node.prev = [new if prev is old else prev for prev in node.prev]
+        for idx, sig in enumerate(node.in_port):
+            if sig is old_sig:
+                node.in_port[idx] = new_sig
+            elif isinstance(sig, VhdlConcatenation):
+                sig.list = [new_sig if s is old_sig else s for s in sig.list]
+
     def _retime_unsynced(self, node, max_d, norm_prev_d):
         """ Retime node without adding synchronization.
 
@@ -324,7 +486,7 @@ class VhdlGraphTransformer(ast.NodeTransformer):
         :type max_d: int
         :param norm_prev_d: normalized delay to be added to each edge
         :type norm_prev_d: int
-        :param sync_ds: list of synchronization delays, in essence the minimum buffer width necessary
+        :param sync_ds: worst case skew of each input edge in clock cycles
         :type sync_ds: list of int
 
         .. todo:: Add handling of VhdlSyncNode delay, especially passing a varaiable delay to the orignal next node
@@ -356,12 +518,23 @@ class VhdlGraphTransformer(ast.NodeTransformer):
             else:
                 overall_prev.append(prev)
                 overall_in_ports.append(edge)
-        # append data for generics WIDTH and N_IO
-        generic_data = [len(sync_node_new_in_ports[0].vhdl_type), len(sync_node_new_in_ports), max(sync_ds)]
-        generic_data = [VhdlConstant("", VhdlType.VhdlPositive(), gd) for gd in generic_data]
+        # append data for generics WIDTH, N_IO, DEPTHS and BRAM_DEPTH
+        sync_node.fifo_depths = self.fifo_depths([d for d, edge in zip(sync_ds, node.in_port)
+                                                  if type(edge) is not VhdlConstant])
+        sync_node.fifo_types = ["bram_fifo" if depth > self.bram_fifo_depth else "STD_FIFO"
+                                for depth in sync_node.fifo_depths]
+        depths_type = VhdlType.VhdlArray(len(sync_node.fifo_depths), VhdlType.VhdlPositive,
+                                         min(sync_node.fifo_depths), max(sync_node.fifo_depths),
+                                         type_def="depth_array")
+        generic_data = [VhdlConstant("", VhdlType.VhdlPositive(), len(sync_node_new_in_ports[0].vhdl_type)),
+                        VhdlConstant("", VhdlType.VhdlPositive(), len(sync_node_new_in_ports)),
+                        VhdlConstant("", depths_type, tuple(sync_node.fifo_depths)),
+                        VhdlConstant("", VhdlType.VhdlPositive(), self.bram_fifo_depth)]
         sync_node.in_port.extend(generic_data)
-        # append inports to sync node
-        sync_node.in_port.append(VhdlConcatenation(sync_node_new_in_ports))
+        logger.info("Synchronize %d inputs with FIFOs of depth %s (%s)"
+                    % (len(sync_node.fifo_depths), sync_node.fifo_depths, ", ".join(sync_node.fifo_types)))
+        # append inports to sync node, input i in the bits of FIFO i, i.e. the first input lowest
+        sync_node.in_port.append(VhdlConcatenation(sync_node_new_in_ports[::-1]))
 
         # create sync_node output
         c_id = self.con_edge_id
@@ -388,22 +561,45 @@ class VhdlGraphTransformer(ast.NodeTransformer):
         overall_prev = [prev for prev in overall_prev if prev is not None]
         node.prev = [sync_node] + overall_prev
 
-    def retime(self, node):
-        need_sync = False
+    @staticmethod
+    def fifo_depths(skews):
+        """Return depth of the FIFO of each input of a VhdlSyncNode.
+
+        All inputs start arriving in the same cycle at the earliest, input j
+        up to skews[j] cycles later. A FIFO holds the samples of its input
+        until the latest other input delivers the same sample, plus
+        SYNC_FIFO_SLACK words for its output register and full flag.
+
+        :param skews: worst case skew of each input in clock cycles
+        :type skews: list of int
+        :returns: list of int -- FIFO depth of each input
+        """
+        return [max(skews[:i] + skews[i + 1:] + [0]) + SYNC_FIFO_SLACK for i in range(len(skews))]
+
+    def retime(self, node, start=None):
+        """Balance the delays of all incoming edges of node.
+
+        :param node: node whose predecessors are retimed
+        :type node: VhdlNode subclass
+        :param start: cycle node starts at, not before all inputs arrived, by default when the last input arrives
+        :type start: int
+        """
         sync_ds = []
         prev_d = []
         for prev in node.prev:
-            try:
-                prev_d.append(prev.d + prev.dprev)
-            except TypeError:
-                """ Detected node with variable delay"""
+            skew = self.skew.get(id(prev), 0)
+            if isinstance(prev.d, tuple):
+                # node with variable delay
                 prev_d.append(prev.d[0] + prev.dprev)
-                if len(node.prev) > 1:
-                    need_sync = True
-                else:
-                    need_sync = False
-                sync_ds.append(prev.d[1] - prev.d[0])
-        max_d = max(prev_d)
+                skew += prev.d[1] - prev.d[0]
+            else:
+                prev_d.append(prev.d + prev.dprev)
+            sync_ds.append(skew)
+        streamed = [d for d, edge in zip(sync_ds, node.in_port) if type(edge) is not VhdlConstant]
+        self.skew[id(node)] = max(streamed) if streamed else 0
+        # inputs arriving with varying delay are aligned by FIFOs
+        need_sync = len(streamed) > 1 and max(streamed) > 0
+        max_d = max(prev_d) if start is None else start
         # normalize delay by calculating difference to maximum edge delay
         norm_prev_d = [max_d - d for d in prev_d]
         #
@@ -449,6 +645,13 @@ class VhdlPortTransformer(ast.NodeVisitor):
 
         #
         self.visited_nodes = set()
+        self.finalized_nodes = set()
+
+    def visit(self, node):
+        # nodes shared by several successors are finalized only once
+        if id(node) in self.finalized_nodes:
+            return node
+        return super(VhdlPortTransformer, self).visit(node)
 
     def visit_VhdlModule(self, node):
         map(self.visit, node.architecture)
@@ -486,7 +689,8 @@ class VhdlPortTransformer(ast.NodeVisitor):
             else:
                 pass
 
-        valid_con_sig = VhdlConcatenation(valid_in.value.list)
+        # valid of input i in bit i, like the data of SYNC_IN
+        valid_con_sig = VhdlConcatenation(valid_in.value.list[::-1])
         # Port = namedtuple("Port", ["name", "direction", "vhdl_type", "value"])
         valid_con_port = Port(name="VALID_IN_PORT", direction="in",
                               vhdl_type=VhdlType.VhdlStdLogicVector(size=len(valid_con_sig)),
@@ -498,6 +702,7 @@ class VhdlPortTransformer(ast.NodeVisitor):
     def finalize_ports(self, node):
         # Finalize Generic, In- and Out-Ports
         node.finalize_ports()
+        self.finalized_nodes.add(id(node))
         #
         iccps = []
         idxs = range(len(self.iccps_info))
@@ -514,8 +719,8 @@ class VhdlPortTransformer(ast.NodeVisitor):
                     if hasattr(pnode, "out_port"):  # VhdlNode Class
                         # pnode already finalized
                         if hash(pnode) in self.visited_nodes:
-                            # get cascading connection edge
-                            cc_edge = pnode.out_port[idx].value
+                            # get cascading connection edge, command ports were prepended in reverse order
+                            cc_edge = [p for p in pnode.out_port if p.name == occp.name][0].value
                             cc_edges.append(cc_edge)
                         else:
                             if hasattr(pnode, "name"):
@@ -16,6 +16,10 @@ class VhdlType(object):
         def __repr__(self):
             return self.vhdl_type
 
+        def __reduce__(self):
+            # nested classes are not found by name, pickle them by their name in VhdlType
+            return _load_type, (type(self).__name__, self.__dict__)
+
     class VhdlSigned(_VhdlType):
         vhdl_type = "signed"
 
@@ -144,3 +148,11 @@ class VhdlType(object):
     class DummyType(_VhdlType):
         def __init__(self):
             pass
+
+
+def _load_type(name, state):
+    """Return VHDL type of class VhdlType.<name> with attributes state, counterpart of _VhdlType.__reduce__."""
+    cls = getattr(VhdlType, name)
+    vhdl_type = cls.__new__(cls)
+    vhdl_type.__dict__.update(state)
+    return vhdl_type
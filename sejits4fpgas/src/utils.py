@@ -1,16 +1,73 @@
 import glob
+import hashlib
 import os
+import shutil
 
-from sejits4fpgas.src.nodes import VhdlFile
+from sejits4fpgas.src.nodes import VhdlModule
+from sejits4fpgas.src.nodes import VhdlPrebuiltFile
+from sejits4fpgas.src.bb_library import BASIC_BLOCK_PATH
+from sejits4fpgas.src.bb_library import block_instances
+from sejits4fpgas.src.bb_library import get_library
+from sejits4fpgas.src.bb_library import used_units
 
 # ---------------------------------------------------------------------------
 STDLIBS = ["ieee", "ieee.std_logic_1164.all"]
 # ---------------------------------------------------------------------------
 
 
-def get_basic_blocks(path):
+def get_basic_blocks(path=BASIC_BLOCK_PATH, files=None):
+    """Return prebuilt VhdlFiles of the basic block library in path.
+
+    :param path: directory of the basic block library
+    :type path: str
+    :param files: generated VhdlFiles, if given only the basic blocks and packages they use and their dependencies are returned
+    :type files: list of VhdlFile
+    """
+    library = get_library(path)
+    if files is None:
+        fns = library.files
+    else:
+        modules = [f.body[0] for f in files if f.body and isinstance(f.body[0], VhdlModule)]
+        roots = set(entity for entity, _ in block_instances(modules)) | used_units(modules)
+        fns = library.closure(roots)
     prebuilt_files = []
-    for fn in glob.glob(path + "*"):
+    for fn in fns:
         fname = os.path.basename(os.path.splitext(fn)[0])
-        prebuilt_files.append(VhdlFile.from_prebuilt(name=fname, path=fn))
+        prebuilt_files.append(VhdlPrebuiltFile(name=fname, file_path=fn, digest=library.digests[fn]))
     return prebuilt_files
+
+
+def get_basic_block_digest(path=BASIC_BLOCK_PATH):
+    """Return SHA-256 hex digest of names and contents of all basic block files in path."""
+    library = get_library(path)
+    digest = hashlib.sha256()
+    for fn in library.files:
+        digest.update(os.path.basename(fn) + "\0" + library.digests[fn] + "\0")
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """Return SHA-256 hex digest of the content of path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_content(path_a, path_b):
+    """Return True if both files exist with equal content."""
+    try:
+        stat_a, stat_b = os.stat(path_a), os.stat(path_b)
+    except OSError:
+        return False
+    if (stat_a.st_dev, stat_a.st_ino) == (stat_b.st_dev, stat_b.st_ino):
+        return True
+    return stat_a.st_size == stat_b.st_size and file_digest(path_a) == file_digest(path_b)
+
+
+def copy_file(src, dst):
+    """Copy src to dst, replacing dst by a new file instead of writing through an existing link."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    shutil.copy2(src, dst)
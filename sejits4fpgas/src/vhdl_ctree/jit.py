@@ -3,7 +3,6 @@ Just-in-time compilation support.
 """
 
 import abc
-import copy
 import os
 import re
 import ast
@@ -12,6 +11,7 @@ import inspect
 import hashlib
 import json
 from collections import namedtuple
+from collections import OrderedDict
 import tempfile
 
 from ..nodes import VhdlFile
@@ -45,6 +45,22 @@ def getFile(filepath):
     return filetype(name=name, path=path)
 
 
+def clone_ast(node):
+    """
+    Returns a structural copy of an AST. AST nodes and lists are copied, so
+    transformers may mutate the clone in place, while leaf values like names,
+    numbers and types are shared with the original.
+    """
+    if isinstance(node, ast.AST):
+        clone = node.__class__.__new__(node.__class__)
+        for key, value in node.__dict__.items():
+            clone.__dict__[key] = clone_ast(value)
+        return clone
+    elif isinstance(node, list):
+        return [clone_ast(item) for item in node]
+    return node
+
+
 class JitModule(object):
     """
     Manages compilation of multiple ASTs.
@@ -100,6 +116,23 @@ class ConcreteSpecializedFunction(object):
     """
     __metaclass__ = abc.ABCMeta
 
+    def nbytes(self):
+        """
+        Returns the number of bytes accounted to this function by the
+        concrete function cache.
+        """
+        module = getattr(self, '_module', None)
+        return module.nbytes() if hasattr(module, 'nbytes') else 0
+
+    def release(self):
+        """
+        Frees resources held by the generated code, called when the
+        function is evicted from the concrete function cache.
+        """
+        module = getattr(self, '_module', None)
+        if hasattr(module, 'release'):
+            module.release()
+
     def _compile(self, entry_point_name, project_node, entry_point_typesig,
                  **kwargs):
         """
@@ -123,6 +156,88 @@ class ConcreteSpecializedFunction(object):
         pass
 
 
+class ConcreteFunctionCache(object):
+    """
+    Least recently used cache of ConcreteSpecializedFunctions limited in
+    count and size. Evicted functions are released.
+    """
+
+    def __init__(self, max_count=None, max_bytes=None):
+        if max_count is None:
+            max_count = CONFIG.getint('jit', 'CONCRETE_FUNCTIONS_MAX_COUNT')
+        if max_bytes is None:
+            max_bytes = CONFIG.getint('jit', 'CONCRETE_FUNCTIONS_MAX_BYTES')
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._functions = OrderedDict()  # key -> (csf, nbytes)
+
+    def __contains__(self, key):
+        return key in self._functions
+
+    def __len__(self):
+        return len(self._functions)
+
+    def get(self, key, default=None):
+        """Returns the function cached for key and marks it recently used."""
+        try:
+            csf, nbytes = self._functions.pop(key)
+        except KeyError:
+            self.misses += 1
+            STATS.log("concrete function cache miss")
+            return default
+        self._functions[key] = (csf, nbytes)
+        self.hits += 1
+        STATS.log("concrete function cache hit")
+        return csf
+
+    def __getitem__(self, key):
+        csf = self.get(key)
+        if csf is None:
+            raise KeyError(key)
+        return csf
+
+    def __setitem__(self, key, csf):
+        replaced = self.pop(key)
+        if replaced is not None and replaced is not csf and \
+                hasattr(replaced, 'release'):
+            replaced.release()
+        nbytes = csf.nbytes() if hasattr(csf, 'nbytes') else 0
+        self._functions[key] = (csf, nbytes)
+        self.nbytes += nbytes
+        # never evict the function just added
+        while len(self._functions) > 1 and \
+                (0 < self.max_count < len(self._functions) or
+                 0 < self.max_bytes < self.nbytes):
+            old_key = next(iter(self._functions))
+            self._evict(old_key)
+
+    def pop(self, key, default=None):
+        """Removes key without releasing its function and returns the function."""
+        try:
+            csf, nbytes = self._functions.pop(key)
+        except KeyError:
+            return default
+        self.nbytes -= nbytes
+        return csf
+
+    def _evict(self, key):
+        csf = self.pop(key)
+        self.evictions += 1
+        STATS.log("concrete function cache eviction")
+        log.info("evicting concrete function %s", key)
+        if hasattr(csf, 'release'):
+            csf.release()
+
+    def clear(self):
+        """Evicts and releases all functions."""
+        for key in list(self._functions):
+            self._evict(key)
+
+
 class LazySpecializedFunction(object):
     """
     A callable object that will produce executable
@@ -161,17 +276,33 @@ class LazySpecializedFunction(object):
         self.original_tree = py_ast or \
             (get_ast(self.apply)
              if self.apply is not LazySpecializedFunction.apply else None)
-        self.concrete_functions = {}  # config -> callable map
+        self.concrete_functions = ConcreteFunctionCache()  # config -> callable map
         self._tuner = self.get_tuning_driver()
         self.sub_dir = sub_dir or \
-            self.NameExtractor().visit(self.original_tree) or \
-            hex(hash(self))[2:]
+            self.NameExtractor().visit(self._original_tree) or \
+            self.fingerprint()[:16]
         self.backend_name = backend_name
 
 
+    def __getstate__(self):
+        """
+        Returns the picklable state, used to transform in worker processes.
+        Tuning driver and concrete functions stay in this process.
+        """
+        state = self.__dict__.copy()
+        del state['_tuner']
+        del state['concrete_functions']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.concrete_functions = ConcreteFunctionCache()
+        self._tuner = self.get_tuning_driver()
+
     @property
     def original_tree(self):
-        return copy.deepcopy(self._original_tree)
+        """Returns a private copy of the kernel AST for transformations."""
+        return clone_ast(self._original_tree)
 
     @property
     def tree(self):
@@ -181,7 +312,7 @@ class LazySpecializedFunction(object):
     def original_tree(self, value):
         if not hasattr(self, '_original_tree'):
             self._original_tree = value
-        elif ast.dump(self.__original_tree, True, True) != \
+        elif ast.dump(self._original_tree, True, True) != \
                 ast.dump(value, True, True):
             raise AttributeError('Cannot redefine the ast')
 
@@ -202,46 +333,74 @@ class LazySpecializedFunction(object):
             return json.dump(dictionary, info_file)
 
     @staticmethod
-    def _hash(o):
-        if isinstance(o, dict) and type(o).__hash__ is dict.__hash__:
-            return hash(frozenset(
-                LazySpecializedFunction._hash(item) for item in o.items()
-            ))
+    def _canonical(o):
+        """
+        Returns a string representation of o that is equal for equal
+        configurations in every process, interpreter and architecture.
+        """
+        canonical = LazySpecializedFunction._canonical
+        if isinstance(o, dict):
+            return '{' + ','.join(sorted(
+                canonical(k) + ':' + canonical(v) for k, v in o.items()
+            )) + '}'
+        elif isinstance(o, (list, tuple)):
+            return type(o).__name__ + '(' + ','.join(canonical(i) for i in o) + ')'
+        elif isinstance(o, (set, frozenset)):
+            return type(o).__name__ + '(' + ','.join(sorted(canonical(i) for i in o)) + ')'
+        elif o is None or isinstance(o, (bool, int, long, float, str, unicode)):
+            return repr(o)
+        elif type(o).__repr__ is not object.__repr__:
+            return type(o).__name__ + ':' + repr(o)
+        elif hasattr(o, '__dict__'):
+            # default repr contains the memory address
+            return type(o).__name__ + canonical(vars(o))
         else:
-            try:
-                return hash(o)
-            except TypeError:
-                return hash(str(o))
+            return type(o).__name__
 
-    def __hash__(self):
-        # mro = type(self).mro()
-        # result = hashlib.sha512(''.encode())
-        # for klass in mro:
-        #     if issubclass(klass, LazySpecializedFunction):
-        #         try:
-        #             result.update(inspect.getsource(klass).encode())
-        #         except IOError:
-        #             # means source can't be found. Well, can't do anything
-        #             # about that I don't think
-        #             pass
-        #     else:
-        #         pass
-        # if self.original_tree is not None:
-        #     tree_str = ast.dump(self.original_tree,
-        #                         annotate_fields=True, include_attributes=True)
-        #     result.update(tree_str.encode())
-        # return int(result.hexdigest(), 16)
+    @staticmethod
+    def _hash(o):
+        """Returns SHA-256 hex digest of the canonical representation of o."""
+        return hashlib.sha256(
+            LazySpecializedFunction._canonical(o).encode('utf-8')
+        ).hexdigest()
+
+    def fingerprint_sources(self):
+        """
+        Returns the strings identifying the code generator, by default the
+        sources of all LazySpecializedFunction classes in the MRO. Subclasses
+        add further sources their generated code depends on.
+        """
+        sources = []
+        for klass in type(self).mro():
+            if issubclass(klass, LazySpecializedFunction):
+                try:
+                    sources.append(inspect.getsource(klass))
+                except (IOError, TypeError):
+                    # means source can't be found. Well, can't do anything
+                    # about that I don't think
+                    sources.append(klass.__name__)
+        return sources
+
+    def fingerprint(self):
+        """
+        Returns SHA-256 hex digest of the kernel AST and the code generator,
+        stable across runs, interpreters and architectures.
+        """
         if self._hash_cache is not None:
             return self._hash_cache
-        try:
-            self_hash = hash(inspect.getsource(type(self)).encode())
-        except TypeError:
-            self_hash = 1
-        #self_hash = 1
-        tree_hash = hash(dump(self._original_tree, annotate_fields=True, include_attributes=True))
-        self._hash_cache = self_hash * tree_hash
+        result = hashlib.sha256()
+        for source in self.fingerprint_sources():
+            result.update(hashlib.sha256(source.encode('utf-8')).digest())
+        if self._original_tree is not None:
+            tree_str = dump(self._original_tree,
+                            annotate_fields=True, include_attributes=True)
+            result.update(tree_str.encode('utf-8'))
+        self._hash_cache = result.hexdigest()
         return self._hash_cache
 
+    def __hash__(self):
+        return int(self.fingerprint()[:15], 16)
+
     def config_to_dirname(self, program_config):
         """Returns the subdirectory name under .compiled/funcname"""
         # fixes the directory names and squishes invalid chars
@@ -288,7 +447,7 @@ class LazySpecializedFunction(object):
     def get_transform_result(self, program_config, dir_name, cache=True):
         info = self.get_info(dir_name)
         # check to see if the necessary code is in the persistent cache
-        if hash(self) != info['hash'] and self.original_tree is not None \
+        if self.fingerprint() != info['hash'] and self._original_tree is not None \
                 or not cache:
             # need to run transform() for code generation
             log.info('Hash miss. Running Transform')
@@ -301,7 +460,7 @@ class LazySpecializedFunction(object):
                     "Transform must return an iterable of Files"
                 source_file.path = dir_name
 
-            new_info = {'hash': hash(self),
+            new_info = {'hash': self.fingerprint(),
                         'files': [os.path.join(f.path, f.get_filename())
                                   for f in transform_result]}
             self.set_info(dir_name, new_info)
@@ -320,6 +479,14 @@ class LazySpecializedFunction(object):
         program_configuration for this function has already been code
         generated for, this method draws from the cache.
         """
+        csf = self.get_concrete_function(*args, **kwargs)
+        return csf(*args, **kwargs)
+
+    def get_concrete_function(self, *args, **kwargs):
+        """
+        Returns the ConcreteSpecializedFunction for the program_configuration
+        selected by the given arguments, building it if necessary.
+        """
         STATS.log("specialized function call")
 
         log.info("detected specialized function call with arg types: %s",
@@ -335,11 +502,10 @@ class LazySpecializedFunction(object):
         config_hash = dir_name
 
         # checks to see if the necessary code is in the run-time cache
-        if CONFIG.getboolean('jit', 'CACHE') and \
-                config_hash in self.concrete_functions:
+        csf = self.concrete_functions.get(config_hash)
+        if csf is not None:
             STATS.log("specialized function cache hit")
             log.info("specialized function cache hit!")
-            csf = self.concrete_functions[config_hash]
 
         else:
             STATS.log("specialized function cache miss")
@@ -353,7 +519,7 @@ class LazySpecializedFunction(object):
                  but got a %s." % type(csf)
             self.concrete_functions[config_hash] = csf
 
-        return csf(*args, **kwargs)
+        return csf
 
     def run_transform(self, program_config):
         transform_result = self.transform(
@@ -0,0 +1,14 @@
+import context
+
+import pytest
+
+from sejits4fpgas.src import bb_library
+from sejits4fpgas.src.bb_library import LibraryIndex
+
+
+@pytest.fixture(autouse=True)
+def library_index(monkeypatch, tmpdir):
+    # keep the persisted basic block index out of the home directory
+    index = LibraryIndex(str(tmpdir.join("bb_index.json")))
+    monkeypatch.setattr(bb_library, "_library_index", index)
+    return index
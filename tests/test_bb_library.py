@@ -0,0 +1,85 @@
+import context
+
+import ast
+import os
+
+from sejits4fpgas.src import bb_library
+from sejits4fpgas.src import dsl
+from sejits4fpgas.src import utils
+from sejits4fpgas.src.bb_library import LibraryIndex
+from sejits4fpgas.src.bb_library import evaluate
+from sejits4fpgas.src.bb_library import parse_entities
+from sejits4fpgas.src.dsl import ConvolveTransformer
+from sejits4fpgas.src.dsl import MulTransformer
+from sejits4fpgas.src.nodes import VhdlPrebuiltFile
+from sejits4fpgas.src.utils import file_digest
+from sejits4fpgas.src.utils import BASIC_BLOCK_PATH
+
+
+def test_parse_entity_interface():
+    with open(os.path.join(BASIC_BLOCK_PATH, "DReg.vhd")) as vhdl_file:
+        entities = parse_entities(vhdl_file.read())
+
+    assert entities["DReg"]["generics"] == [["WIDTH", "positive", "32"], ["LENGTH", "positive", "4"]]
+    assert ["DREG_IN", "in", "STD_LOGIC_VECTOR (WIDTH-1 downto 0)"] in entities["DReg"]["ports"]
+
+
+def test_persisted_index(monkeypatch, tmpdir):
+    index_path = str(tmpdir.join("index.json"))
+    path = os.path.join(BASIC_BLOCK_PATH, "AddBB.vhd")
+    index = LibraryIndex(index_path)
+    entry = index.entry(path)
+    index.save()
+
+    # a second process reuses the entry without reading the file
+    monkeypatch.setattr(bb_library, "scan_file", None)
+    assert LibraryIndex(index_path).entry(path) == entry
+    assert entry["declared"] == ["AddBB"] and "logic_dff_block" in entry["referenced"]
+
+
+def test_latency_annotation():
+    with open(os.path.join(BASIC_BLOCK_PATH, "Convolve.vhd")) as vhdl_file:
+        latency = parse_entities(vhdl_file.read())["Convolve"]["latency"]
+
+    assert [evaluate(expression, {"IMG_WIDTH": 64}) for expression in latency] == [140, 143]
+
+
+def test_func_def_from_library():
+    call = ast.parse("bb_convolve((0, 0, 0, 0, 1, 0, 0, 0, 0), 1, 64, 48, a)").body[0].value
+    convolve = ConvolveTransformer(backend="VHDL").get_func_def_vhdl(call_args=call.args)
+    mul = MulTransformer(backend="VHDL").get_func_def_vhdl()
+
+    assert convolve.d == (140, 143) and convolve.generic_slice == slice(0, 4)
+    assert [info.name for info in convolve.inport_info] == ["FILTERMATRIX", "FILTER_SCALE", "IMG_WIDTH",
+                                                            "IMG_HEIGHT", "DATA_IN"]
+    # valid chain of MulBB.vhd: DELAY_MUL + 1 registers
+    assert mul.d == 8 and [info.name for info in mul.outport_info] == ["MUL_OUT"]
+
+
+def test_prebuilt_copy(monkeypatch, tmpdir):
+    src = tmpdir.join("Block.vhd")
+    src.write("entity Block is end Block;\n")
+    prebuilt = VhdlPrebuiltFile("Block", str(src), file_digest(str(src)))
+    prebuilt.path = str(tmpdir.mkdir("cache"))
+    copy = prebuilt._compile("")
+
+    assert not os.path.samefile(copy, str(src))
+    with open(copy, "a") as vhdl_file:
+        vhdl_file.write("-- edited in the cache\n")
+    assert src.read() == "entity Block is end Block;\n"
+    # an edited copy is replaced, an unchanged one is kept without reading it
+    prebuilt._compile("")
+    assert open(copy).read() == src.read()
+    monkeypatch.setattr(utils, "file_digest", None)
+    assert prebuilt._compile("") == copy
+
+
+def test_func_def_reads_library_once(monkeypatch):
+    calls = []
+    get_library = dsl.get_library
+    monkeypatch.setattr(dsl, "get_library", lambda: calls.append(1) or get_library())
+    call = ast.parse("bb_convolve((0, 0, 0, 0, 1, 0, 0, 0, 0), 1, 64, 48, a)").body[0].value
+    ConvolveTransformer(backend="VHDL").get_func_def_vhdl(call_args=call.args)
+
+    # FILTERMATRIX has an array type of the_filter_package
+    assert len(calls) == 1
@@ -0,0 +1,62 @@
+import context
+
+from sejits4fpgas.src.bitstream_cache import BitstreamCache
+from sejits4fpgas.src.bitstream_cache import tool_version_of
+
+
+def test_bitstream_cache_roundtrip(tmpdir):
+    src = tmpdir.mkdir("src")
+    vhdl_a = src.join("a.vhd")
+    vhdl_a.write("entity a is end a;")
+    vhdl_b = src.join("b.vhd")
+    vhdl_b.write("entity b is end b;")
+    bitstream = src.join("top.bit")
+    bitstream.write("bits")
+    cache = BitstreamCache(str(tmpdir.join("cache")), "2016.4")
+
+    key = cache.key([str(vhdl_a), str(vhdl_b)])
+    assert key == cache.key([str(vhdl_b), str(vhdl_a)])
+    assert cache.lookup(key) is None
+
+    artifacts = cache.store(key, [str(bitstream)])
+    assert open(artifacts["top.bit"]).read() == "bits"
+    assert cache.lookup(key) == artifacts
+
+    vhdl_b.write("entity b is port(x : in std_logic); end b;")
+    assert cache.key([str(vhdl_a), str(vhdl_b)]) != key
+    assert BitstreamCache(str(tmpdir.join("cache")), "2017.1").key([str(vhdl_a)]) != cache.key([str(vhdl_a)])
+
+
+def test_key_covers_template_and_part(tmpdir):
+    vhdl_a = tmpdir.join("a.vhd")
+    vhdl_a.write("entity a is end a;")
+    template = tmpdir.mkdir("template")
+    constraints = template.join("top.xdc")
+    constraints.write("set_property PACKAGE_PIN Y9 [get_ports clk]")
+    template.mkdir("template_project.runs").join("top.bit").write("bits")
+    cache = BitstreamCache(str(tmpdir.join("cache")), "2016.4", str(template), "xc7z020clg484-1")
+    key = cache.key([str(vhdl_a)])
+
+    # results of earlier runs are not part of the template
+    template.join("template_project.runs", "top.bit").write("other bits")
+    assert cache.key([str(vhdl_a)]) == key
+    constraints.write("set_property PACKAGE_PIN Y10 [get_ports clk]")
+    assert cache.key([str(vhdl_a)]) != key
+    other_part = BitstreamCache(str(tmpdir.join("cache")), "2016.4", str(template), "xc7z010clg400-1")
+    assert other_part.key([str(vhdl_a)]) != cache.key([str(vhdl_a)])
+
+
+def test_unknown_tool_version(tmpdir):
+    vhdl_a = tmpdir.join("a.vhd")
+    vhdl_a.write("entity a is end a;")
+    bitstream = tmpdir.join("top.bit")
+    bitstream.write("bits")
+    cache = BitstreamCache(str(tmpdir.join("cache")), "unknown")
+    key = cache.key([str(vhdl_a)])
+
+    # the artifacts are stored but never served
+    artifacts = cache.store(key, [str(bitstream)])
+    assert open(artifacts["top.bit"]).read() == "bits"
+    assert cache.lookup(key) is None
+    assert tool_version_of("no-such-synthesis-tool -version") == "unknown"
+    assert BitstreamCache(str(tmpdir.join("cache")), "auto").tool_version != "auto"
@@ -0,0 +1,28 @@
+import context
+
+import ast
+
+from tests.utils.basic_blocks import *
+
+from sejits4fpgas.src.dsl import DSLTransformer
+from sejits4fpgas.src.jit_synth import VhdlLazySpecializedFunction
+from sejits4fpgas.src.vhdl_ctree.jit import clone_ast
+from sejits4fpgas.src.vhdl_ctree.transformations import PyBasicConversions
+
+
+def kernel(a, b):
+    c = bb_add(a, b)
+    return bb_limitTo(8, bb_mul(c, 2))
+
+
+def test_transform_clone():
+    tree = VhdlLazySpecializedFunction.from_function(kernel)._original_tree
+    original = ast.dump(tree)
+    clones = [clone_ast(tree) for _ in range(2)]
+    PyBasicConversions().visit(DSLTransformer(backend="VHDL").visit(clones[0]))
+
+    # transformers mutate the clone in place, the original and other clones keep their nodes
+    assert ast.dump(clones[0]) != original
+    assert ast.dump(tree) == original
+    assert ast.dump(clones[1]) == original
+    assert clones[1].body[0] is not tree.body[0]
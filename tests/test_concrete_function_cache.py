@@ -0,0 +1,53 @@
+import context
+
+from sejits4fpgas.src.vhdl_ctree.jit import ConcreteFunctionCache
+
+
+class DummyFunction(object):
+    def __init__(self, size):
+        self.size = size
+        self.released = False
+
+    def nbytes(self):
+        return self.size
+
+    def release(self):
+        self.released = True
+
+
+def test_lru_eviction():
+    cache = ConcreteFunctionCache(max_count=2, max_bytes=0)
+    a, b, c = DummyFunction(1), DummyFunction(1), DummyFunction(1)
+    cache["a"] = a
+    cache["b"] = b
+    assert cache.get("a") is a
+    cache["c"] = c
+
+    assert "b" not in cache
+    assert b.released and not a.released
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+
+def test_size_limit():
+    cache = ConcreteFunctionCache(max_count=0, max_bytes=10)
+    big, small = DummyFunction(8), DummyFunction(4)
+    cache["big"] = big
+    cache["small"] = small
+
+    assert list(cache._functions) == ["small"]
+    assert big.released
+    assert cache.nbytes == 4
+
+
+def test_replace_releases():
+    cache = ConcreteFunctionCache(max_count=2, max_bytes=0)
+    old, new = DummyFunction(8), DummyFunction(4)
+    cache["a"] = old
+    cache["a"] = old
+    assert not old.released
+    cache["a"] = new
+
+    assert old.released and not new.released
+    assert cache.get("a") is new
+    assert cache.nbytes == 4
@@ -0,0 +1,84 @@
+import context
+
+import os
+
+import numpy as np
+
+from sejits4fpgas.src.dma import DmaBufferPool
+from sejits4fpgas.src.jit_synth import VhdlSynthModule
+
+
+def on_target(monkeypatch):
+    uname = os.uname()
+    monkeypatch.setattr(os, "uname", lambda: uname[:-1] + ("armv7l",))
+
+
+def test_buffer_reuse():
+    pool = DmaBufferPool(max_free_buffers=2)
+    buf = pool.acquire((4, 4))
+    address = buf.ctypes.data
+    pool.release(buf)
+    pool.release(buf)
+
+    # a second release does not hand out the buffer twice
+    assert len(pool._free[pool._slab_size(16)]) == 1
+    assert pool.acquire((2, 8)).ctypes.data == address
+    assert pool.acquire((4, 4)).ctypes.data != address
+
+
+def test_pool_size_bound():
+    pool = DmaBufferPool(max_free_buffers=2)
+    bufs = [pool.acquire(16) for _ in range(5)]
+    for buf in bufs:
+        pool.release(buf)
+
+    assert len(pool._slabs) == 2
+    assert not pool.owns(bufs[-1])
+
+
+def test_call_recycles_buffers(monkeypatch):
+    on_target(monkeypatch)
+    module = VhdlSynthModule()
+    module.dma_pool = DmaBufferPool(max_free_buffers=2)
+
+    def hw_interface(buf, length):
+        buf *= 2
+
+    module.hw_interface = hw_interface
+    frame = np.arange(64, dtype=np.uint8).reshape(8, 8)
+    results = [module(frame + i) for i in range(5)]
+
+    # every call packs into the same buffer and returns a copy of the result
+    assert len(module.dma_pool._slabs) == 1
+    assert not any(module.dma_pool.owns(result) for result in results)
+    for i, result in enumerate(results):
+        assert np.array_equal(result, 2 * (frame + i).astype(np.uint32))
+
+
+def test_caller_buffer_stays_in_use(monkeypatch):
+    on_target(monkeypatch)
+    module = VhdlSynthModule()
+    module.dma_pool = DmaBufferPool(max_free_buffers=2)
+    module.hw_interface = lambda buf, length: None
+    buf = module.get_buffer((8, 8))
+    module(buf)
+
+    assert module.dma_pool.owns(buf)
+    assert not module.dma_pool._free[module.dma_pool._slab_size(64)]
+
+
+def test_nbytes(monkeypatch, tmpdir):
+    on_target(monkeypatch)
+    module = VhdlSynthModule()
+    module.dma_pool = DmaBufferPool(max_free_buffers=2)
+    bitstream = tmpdir.join("top.bit")
+    bitstream.write("0" * 100)
+    module.artifacts = {"top.bit": str(bitstream), "synthesis.log": __file__}
+    module._link_in(__file__)
+    assert module.nbytes() == 100
+
+    # buffers count while the module holds them
+    buf = module.get_buffer((8, 8))
+    assert module.nbytes() == 100 + module.dma_pool.mapped_size(buf)
+    module.release_buffer(buf)
+    assert module.nbytes() == 100
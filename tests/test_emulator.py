@@ -0,0 +1,229 @@
+import context
+
+import re
+
+import numpy as np
+from skimage import data
+
+from tests.utils.basic_blocks import *
+
+from sejits4fpgas.src.dsl import DSLTransformer
+from sejits4fpgas.src.dsl import get_dsl_type
+from sejits4fpgas.src.emulator import PY_KERNELS
+from sejits4fpgas.src.emulator import Stream
+from sejits4fpgas.src.emulator import _shift
+from sejits4fpgas.src.emulator import VhdlEmulator
+from sejits4fpgas.src.nodes import VhdlDReg
+from sejits4fpgas.src.nodes import VhdlSyncNode
+from sejits4fpgas.src.transformations import VhdlBaseTransformer
+from sejits4fpgas.src.transformations import VhdlGraphTransformer
+from sejits4fpgas.src.transformations import VhdlIRTransformer
+from sejits4fpgas.src.transformations import VhdlKwdTransformer
+from sejits4fpgas.src.transformations import VhdlPortTransformer
+from sejits4fpgas.src.jit_synth import VhdlLazySpecializedFunction
+from sejits4fpgas.src.vhdl_ctree.transformations import PyBasicConversions
+
+
+def build_module(func, *args):
+    tree = VhdlLazySpecializedFunction.from_function(func).original_tree
+    dsl_transformer = DSLTransformer(backend="VHDL")
+    tree = dsl_transformer.visit(tree)
+    tree = PyBasicConversions().visit(tree)
+    l_funcs = dsl_transformer.lifted_functions()
+    return VhdlBaseTransformer(get_dsl_type(args, 32), l_funcs).visit(tree)
+
+
+def retime_module(func, graph_transformer, *args):
+    tree = VhdlLazySpecializedFunction.from_function(func).original_tree
+    dsl_transformer = DSLTransformer(backend="VHDL")
+    tree = PyBasicConversions().visit(dsl_transformer.visit(tree))
+    tree = VhdlKwdTransformer().visit(tree)
+    module = VhdlIRTransformer(get_dsl_type(args, 32), dsl_transformer.lifted_functions()).visit(tree)
+    return VhdlPortTransformer().visit(graph_transformer.visit(module))
+
+
+def test_emulate_bb_add():
+    def test_func(a):
+        return bb_add(a, 10)
+
+    img = data.camera()
+    module = build_module(test_func, img)
+    result = VhdlEmulator(module).run(img)
+
+    assert result.data.shape == img.shape
+    assert np.array_equal(result.data, img.astype(np.uint32) + 10)
+    assert result.cycles == result.latency + img.size
+
+
+def test_emulate_retimed_dag():
+    def test_func(a):
+        b = bb_mul(a, 3)
+        return bb_sub(b, a)
+
+    img = data.camera()
+    module = build_module(test_func, img)
+    result = VhdlEmulator(module).run(img)
+
+    assert np.array_equal(result.data, img.astype(np.uint32) * 2)
+    assert result.latency == module.architecture[0].dprev
+
+
+def test_single_cycle_delay():
+    def test_func(a):
+        b = bb_add(a, a)
+        c = bb_add(b, a)
+        d = bb_add(c, a)
+        return bb_add(d, bb_mul(a, a))
+
+    img = data.camera()
+    module = build_module(test_func, img)
+    nodes = VhdlGraphTransformer.topological_order(module.architecture)
+    result = VhdlEmulator(module).run(img)
+
+    # bb_mul finishes one cycle before the third bb_add
+    assert 1 in [node.d for node in nodes if isinstance(node, VhdlDReg)]
+    assert "LENGTH => 1" in module.codegen()
+    assert np.array_equal(result.data, 4 * img.astype(np.uint32) + img.astype(np.uint32) ** 2)
+
+
+def test_emulate_multi_input():
+    def test_func(a, b):
+        return bb_add(a, b)
+
+    img = data.camera()
+    module = build_module(test_func, img, img)
+    result = VhdlEmulator(module).run(img, img)
+
+    assert np.array_equal(result.data, img.astype(np.uint32) * 2)
+
+
+def test_retime_shared_nodes_once():
+    def test_func(a):
+        b = bb_mul(a, a)
+        c = bb_add(b, a)
+        d = bb_add(b, c)
+        return bb_add(d, d)
+
+    img = data.camera()
+    module = build_module(test_func, img)
+    nodes = VhdlGraphTransformer.topological_order(module.architecture)
+    result = VhdlEmulator(module).run(img)
+
+    # a to c and b to d need one D-register each, the shared nodes are retimed only once
+    assert sorted(node.d for node in nodes if isinstance(node, VhdlDReg)) == [3, 8]
+    assert np.array_equal(result.data, (2 * img.astype(np.uint32) ** 2 + img) * 2)
+    assert result.latency == module.architecture[0].dprev == 8 + 3 * 3
+
+
+def test_tapped_delay_line():
+    def test_func(a):
+        b = bb_mul(a, a)
+        c = bb_add(b, a)
+        d = bb_mul(c, a)
+        return bb_add(d, a)
+
+    img = data.camera()
+    graph_transformer = VhdlGraphTransformer(share_delay_lines=True, engine="greedy")
+    module = retime_module(test_func, graph_transformer, img)
+    nodes = VhdlGraphTransformer.topological_order(module.architecture)
+    result = VhdlEmulator(module).run(img)
+
+    # a is delayed by 8, 11 and 19 cycles through one line of 19 registers
+    assert sorted(node.d for node in nodes if isinstance(node, VhdlDReg)) == [3, 8, 8]
+    assert graph_transformer.saved_register_bits == (8 + 11) * 32
+    assert module.codegen().count("entity work.DReg") == 3
+    assert np.array_equal(result.data, (img.astype(np.uint32) ** 2 + img) * img + img)
+
+
+def test_tap_one_cycle_apart():
+    def test_func(a):
+        b = bb_add(bb_mul(a, a), a)
+        c = bb_add(bb_add(bb_add(a, 1), 2), 3)
+        return bb_add(b, bb_add(c, a))
+
+    img = data.camera()
+    graph_transformer = VhdlGraphTransformer(share_delay_lines=True, engine="greedy")
+    module = retime_module(test_func, graph_transformer, img)
+    nodes = VhdlGraphTransformer.topological_order(module.architecture)
+    result = VhdlEmulator(module).run(img)
+
+    # the tap of a at 9 cycles extends the tap at 8 cycles by one register
+    assert graph_transformer.saved_register_bits == 8 * 32
+    assert sorted(node.d for node in nodes if isinstance(node, VhdlDReg)) == [1, 1, 8]
+    a = img.astype(np.uint32)
+    assert np.array_equal(result.data, a ** 2 + 3 * a + 6)
+
+
+def test_min_cost_flow_retiming():
+    def test_func(a):
+        b = bb_mul(a, a)
+        c = bb_limitTo(12, a)
+        d = bb_add(b, c)
+        e = bb_sub(b, c)
+        return bb_add(d, e)
+
+    img = data.camera()
+    register_cycles = {}
+    for engine in VhdlGraphTransformer.ENGINES:
+        module = retime_module(test_func, VhdlGraphTransformer(share_delay_lines=False, engine=engine), img)
+        nodes = VhdlGraphTransformer.topological_order(module.architecture)
+        register_cycles[engine] = sum(node.d for node in nodes if isinstance(node, VhdlDReg))
+        result = VhdlEmulator(module).run(img)
+        assert np.array_equal(result.data, 2 * img.astype(np.uint32) ** 2)
+        assert result.latency == 8 + 3 + 3
+
+    # delaying the input of bb_limitTo instead of both of its outputs halves the registers
+    assert register_cycles == {"greedy": 16, "min_cost_flow": 8}
+
+
+def test_sync_fifo_depths():
+    def test_func(a):
+        b = bb_convolve((0, 0, 0, 0, 1, 0, 0, 0, 0), 1, 64, 48, a)
+        c = bb_convolve((0, 0, 0, 0, 1, 0, 0, 0, 0), 1, 64, 48, b)
+        return bb_add(c, a)
+
+    img = data.camera()[:48, :64]
+    graph_transformer = VhdlGraphTransformer(share_delay_lines=True, engine="greedy")
+    graph_transformer.bram_fifo_depth = 4
+    module = retime_module(test_func, graph_transformer, img)
+    nodes = VhdlGraphTransformer.topological_order(module.architecture)
+    sync_node, = [node for node in nodes if isinstance(node, VhdlSyncNode)]
+    result = VhdlEmulator(module).run(img)
+
+    # c arrives up to 2 * 3 cycles late, a is buffered until then
+    assert sync_node.fifo_depths == [2, 8]
+    assert sync_node.fifo_types == ["STD_FIFO", "bram_fifo"]
+    # FIFO i buffers the input in bits i of SYNC_IN, the first input in the lowest bits
+    code = module.codegen()
+    depths = re.search(r"DEPTHS => \(([^)]*)\)", code).group(1).split(", ")
+    lanes = re.search(r"SYNC_IN => \(([^)]*)\)", code).group(1).split(" & ")[::-1]
+    assert dict((lane.split("_")[0], int(depth)) for lane, depth in zip(lanes, depths)) == {"c": 2, "a": 8}
+    # the emulator assumes the worst case delay of bb_convolve
+    assert result.latency == module.architecture[0].dprev + 6 == 2 * (2 * 64 + 15) + 3
+    identity = (0, 0, 0, 0, 1, 0, 0, 0, 0)
+    expected = PY_KERNELS["bb_convolve"](identity, 1, 64, 48, PY_KERNELS["bb_convolve"](identity, 1, 64, 48, img))
+    assert np.array_equal(result.data, expected + img)
+
+
+def test_common_subexpressions():
+    def test_func(a):
+        return bb_add(bb_mul(a, 2), bb_mul(2, a))
+
+    img = data.camera()
+    module = build_module(test_func, img)
+    nodes = VhdlGraphTransformer.topological_order(module.architecture)
+    result = VhdlEmulator(module).run(img)
+
+    assert len([node for node in nodes if getattr(node, "library", "") == "work.MulBB"]) == 1
+    assert module.codegen().count("entity work.MulBB") == 1
+    assert not [node for node in nodes if isinstance(node, VhdlDReg)]
+    assert np.array_equal(result.data, img.astype(np.uint32) * 4)
+
+
+def test_shift_misaligned_stream():
+    stream = Stream(np.arange(1, 5, dtype=np.uint32), 2)
+
+    assert list(_shift(stream, 3)) == [2, 3, 4, 0]
+    assert list(_shift(stream, 1)) == [0, 1, 2, 3]
+    assert list(_shift(stream, 10)) == [0, 0, 0, 0]
+    assert list(_shift(stream, -10)) == [0, 0, 0, 0]
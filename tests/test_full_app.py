@@ -1,19 +1,30 @@
 import context
+import cPickle as pickle
+import glob
+import os
+import subprocess
+import sys
 
 from skimage import data
 
 from tests.utils.basic_blocks import *
+from tests.utils.kernels import add_ten
 
+from sejits4fpgas.src.errors import TransformationError
 from sejits4fpgas.src.dsl import DSLTransformer
 from sejits4fpgas.src.dsl import get_dsl_type
 from sejits4fpgas.src.dsl import gen_dsl_wrapper
+from sejits4fpgas.src.dsl import get_pixel_width
 from sejits4fpgas.src.nodes import VhdlFile
 from sejits4fpgas.src.nodes import VhdlProject
 from sejits4fpgas.src.utils import get_basic_blocks
 from sejits4fpgas.src.transformations import VhdlBaseTransformer
 from sejits4fpgas.src.jit_synth import VhdlLazySpecializedFunction
+from sejits4fpgas.src.jit_synth import specialize_all
 from sejits4fpgas.src.vhdl_ctree.jit import ConcreteSpecializedFunction
+from sejits4fpgas.src.vhdl_ctree.jit import getFile
 from sejits4fpgas.src.vhdl_ctree.transformations import PyBasicConversions
+from test_dma import on_target
 
 
 
@@ -25,20 +36,22 @@ def specialize(func):
 class TestLazyTranslator(VhdlLazySpecializedFunction):
 
     def args_to_subconfig(selfself, args):
-        return {'arg_type': get_dsl_type(args, 32)}
+        return {'arg_type': get_dsl_type(args, 32), 'pixel_width': get_pixel_width(args, 32)}
 
     def transform(self, tree, program_config):
-        tree = DSLTransformer(backend="VHDL").visit(tree)
+        dsl_transformer = DSLTransformer(backend="VHDL")
+        tree = dsl_transformer.visit(tree)
         tree = PyBasicConversions().visit(tree)
-        l_funcs = DSLTransformer.lifted_functions()
+        l_funcs = dsl_transformer.lifted_functions()
         tree = VhdlBaseTransformer(program_config.args_subconfig['arg_type'], l_funcs).visit(tree)
         accel_file = VhdlFile("generated", body=[tree])
         # Generate wrapper file
         wrapper_file = gen_dsl_wrapper(program_config.args_subconfig['arg_type'],
                                        axi_stream_width=32,
-                                       file2wrap=accel_file)
+                                       file2wrap=accel_file,
+                                       pixel_width=program_config.args_subconfig['pixel_width'])
         # Add pregenerated vhdl files
-        prebuilt_files = get_basic_blocks()
+        prebuilt_files = get_basic_blocks(files=[wrapper_file, accel_file])
         #
         return [wrapper_file, accel_file] + prebuilt_files
 
@@ -55,6 +68,25 @@ class TestFunction(ConcreteSpecializedFunction):
         return self._ll_function(*args, **kwargs)
 
 
+class FailingTranslator(TestLazyTranslator):
+
+    def finalize(self, transform_result, program_config):
+        return FailingFunction()
+
+
+class FailingFunction(ConcreteSpecializedFunction):
+    def __call__(self, *args, **kwargs):
+        raise TransformationError("Accelerator not available")
+
+
+class UnsupportedTranslator(TestLazyTranslator):
+    transforms = 0
+
+    def transform(self, tree, program_config):
+        UnsupportedTranslator.transforms += 1
+        raise TransformationError("Kernel not supported")
+
+
 def bb_convolve(mask, divisor, width, height, img):
     k = np.array([[mask[0],mask[1],mask[2]],[mask[3],mask[4],mask[5]],[mask[6],mask[7],mask[8]]])
     k = k.astype(np.float)
@@ -64,6 +96,19 @@ def bb_convolve(mask, divisor, width, height, img):
 test_img = []
 
 
+def add_kernel(a):
+    return bb_add(a, 10)
+
+
+CACHE_KEY_SCRIPT = """
+import numpy as np
+from tests import test_full_app
+lsf = test_full_app.specialize(test_full_app.add_kernel)
+print lsf.config_to_dirname(lsf.get_program_config((np.zeros((4, 4), dtype=np.uint8),), {}))
+print lsf.fingerprint()
+"""
+
+
 def test_bb_add():
     @specialize
     def test_func(a):
@@ -98,3 +143,158 @@ def test_bb_limitTo():
     img = data.camera()
     test_func(img)
 
+
+def test_specialize_all():
+    @specialize
+    def add_func(a):
+        return bb_add(a, 10)
+
+    @specialize
+    def mul_func(a):
+        return bb_mul(a, 2)
+
+    img = data.camera()
+    add_files, mul_files, add_files_2 = specialize_all([(add_func, (img,)),
+                                                        (mul_func, (img,)),
+                                                        (add_func, (img,))], processes=2)
+
+    assert add_files == add_files_2
+    assert all(os.path.exists(path) for path in add_files + mul_files)
+    # later preparation is served by the filesystem cache
+    assert add_func.prepare(img) == add_files
+
+
+def test_used_basic_blocks_only():
+    @specialize
+    def test_func(a):
+        return bb_add(a, 10)
+
+    img = data.camera()
+    files = test_func.run_transform(test_func.get_program_config((img,), {}))
+    names = set(f.name for f in files)
+
+    # the generated modules use the_filter_package
+    assert names == {"accel_wrapper", "generated", "AddBB", "logic_dff", "the_filter_package"}
+    assert not {"MulBB", "Convolve", "filter"} & names
+
+
+def test_dispatch_repeated_calls():
+    @specialize
+    def test_func(a):
+        return bb_add(a, 10)
+
+    img = data.camera()
+    results = [test_func(img), test_func(img)]
+
+    assert len(test_func._dispatch) == 1
+    assert np.array_equal(results[0], img.astype(np.uint32) + 10)
+    assert np.array_equal(results[1], results[0])
+
+
+def test_failing_call_falls_back():
+    def test_func(a):
+        return bb_add(a, 10)
+
+    test_func = FailingTranslator.from_function(test_func)
+    img = data.camera()
+    results = [test_func(img), test_func(img)]
+
+    # the signature of a failing call is not dispatched, every call uses the Python function
+    assert not test_func._dispatch
+    assert all(np.array_equal(result, img + 10) for result in results)
+
+
+def test_scalar_signature():
+    signature = VhdlLazySpecializedFunction._arg_signature
+
+    assert signature((2,), {}) != signature((3,), {})
+    assert signature((2,), {}) != signature((2.0,), {})
+
+
+def test_cache_key_across_processes(tmpdir):
+    lsf = specialize(add_kernel)
+    keys = [lsf.config_to_dirname(lsf.get_program_config((np.zeros((4, 4), dtype=np.uint8),), {})),
+            lsf.fingerprint()]
+    # the process keeps its basic block index in the temporary home directory
+    env = dict(os.environ, PYTHONHASHSEED="1234", HOME=str(tmpdir))
+    output = subprocess.check_output([sys.executable, "-c", CACHE_KEY_SCRIPT],
+                                     cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env)
+
+    assert output.split() == keys
+
+
+def test_cache_hit_restores_ir(monkeypatch):
+    img = data.camera()
+    specialize(add_kernel).prepare(img)
+    lsf = specialize(add_kernel)
+    monkeypatch.setattr(lsf, "run_transform", None)
+
+    # the emulator runs the VHDL IR saved with the cached files
+    assert np.array_equal(lsf(img), img.astype(np.uint32) + 10)
+    # the target runs the cached files without their VHDL IR
+    program_config = lsf.get_program_config((img,), {})
+    on_target(monkeypatch)
+    assert not any(f.body for f in lsf.get_transform_result(program_config, lsf.config_to_dirname(program_config)))
+
+
+def test_recorded_failure_skips_specialization():
+    img = data.camera()
+    lsf = UnsupportedTranslator.from_function(add_kernel)
+    lsf(img)
+    dir_name = lsf.config_to_dirname(lsf.get_program_config((img,), {}))
+    transforms = UnsupportedTranslator.transforms
+
+    # a new process reads the negative cache entry instead of transforming again
+    lsf = UnsupportedTranslator.from_function(add_kernel)
+    assert lsf._known_failure(dir_name)
+    assert np.array_equal(lsf(img), img + 10)
+    assert UnsupportedTranslator.transforms == transforms
+
+
+def test_changed_kernel_invalidates_failure():
+    img = data.camera()
+    lsf = UnsupportedTranslator.from_function(add_kernel)
+    dir_name = lsf.config_to_dirname(lsf.get_program_config((img,), {}))
+    lsf._invalidate(dir_name, TransformationError("Kernel not supported"))
+    transforms = UnsupportedTranslator.transforms
+
+    # the source digest of the kernel or the back-end changed
+    lsf = UnsupportedTranslator.from_function(add_kernel)
+    lsf._hash_cache = "0" * 64
+    assert not lsf._known_failure(dir_name)
+    assert not os.path.exists(os.path.join(dir_name, lsf.negative_cache_filename))
+    lsf(img)
+    assert UnsupportedTranslator.transforms == transforms + 1
+
+
+def test_fallback_binds_missing_basic_blocks():
+    test_func = FailingTranslator.from_function(add_ten)
+    img = data.camera()
+
+    # the module of add_ten does not define bb_add, the fallback uses the NumPy kernel
+    assert "bb_add" not in add_ten.func_globals
+    assert np.array_equal(test_func(img), img.astype(np.uint32) + 10)
+    assert test_func.python_function.func_name == "add_ten"
+
+
+def test_invalid_ir_not_restored():
+    img = data.camera()
+    lsf = specialize(add_kernel)
+    lsf.prepare(img)
+    dir_name = lsf.config_to_dirname(lsf.get_program_config((img,), {}))
+    ir_paths = sorted(glob.glob(os.path.join(dir_name, "*.ir")))
+
+    def restored():
+        return [getFile(path) for path in lsf.get_info(dir_name)["files"]]
+
+    # pickles are renamed into place, no temporary file is left
+    assert ir_paths and not glob.glob(os.path.join(dir_name, "*.ir.*"))
+    assert lsf._load_ir(restored())
+    with open(ir_paths[0], "wb") as ir_file:
+        pickle.dump({"format": lsf.IR_FORMAT - 1, "hash": lsf.fingerprint(), "module": None}, ir_file)
+    assert not lsf._load_ir(restored())
+    with open(ir_paths[0], "wb") as ir_file:
+        ir_file.write(pickle.dumps({"format": lsf.IR_FORMAT}, 2)[:10])
+    assert not lsf._load_ir(restored())
+    # the kernel is transformed again
+    assert np.array_equal(lsf(img), img.astype(np.uint32) + 10)
@@ -0,0 +1,120 @@
+import context
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from test_dma import on_target
+
+from sejits4fpgas.src.dma import DmaBufferPool
+from sejits4fpgas.src.jit_synth import VhdlSynthModule
+from sejits4fpgas.src.pipeline import AcceleratorFuture
+from sejits4fpgas.src.pipeline import AcceleratorPipeline
+from sejits4fpgas.src.pipeline import as_completed
+from sejits4fpgas.src.pipeline import completed_future
+
+
+class FakeAccelerator(object):
+    """Doubles the frame in place and records overlapping invocations."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.active = 0
+        self.overlaps = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, buf, length):
+        with self._lock:
+            self.active += 1
+            self.overlaps += self.active > 1
+        time.sleep(0.005)
+        with self._lock:
+            self.active -= 1
+            self.calls += 1
+        if self.fail:
+            raise IOError("DMA transfer failed")
+        buf *= 2
+
+
+def target_module(monkeypatch, accelerator):
+    on_target(monkeypatch)
+    module = VhdlSynthModule()
+    module.dma_pool = DmaBufferPool(max_free_buffers=4)
+    module.hw_interface = accelerator
+    return module
+
+
+def test_future():
+    future = AcceleratorFuture()
+    called = []
+    future.add_done_callback(called.append)
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=0.01)
+    future._set_result(42)
+    assert future.done() and called == [future]
+    assert future.result() == 42
+    assert completed_future(7).result(timeout=0) == 7
+
+
+def test_future_exception():
+    future = AcceleratorFuture()
+    future._set_exception(ValueError("failed"))
+
+    assert isinstance(future.exception(), ValueError)
+    with pytest.raises(ValueError):
+        future.result()
+
+
+def test_as_completed():
+    futures = [AcceleratorFuture() for _ in range(3)]
+
+    def finish():
+        for future in reversed(futures):
+            time.sleep(0.005)
+            future._set_result(None)
+
+    threading.Thread(target=finish).start()
+    assert list(as_completed(futures, timeout=1)) == futures[::-1]
+    with pytest.raises(RuntimeError):
+        list(as_completed([AcceleratorFuture()], timeout=0.01))
+
+
+def test_pipeline_ring(monkeypatch):
+    module = target_module(monkeypatch, FakeAccelerator())
+    pipeline = AcceleratorPipeline(module, depth=2)
+    frame = np.arange(64, dtype=np.uint8).reshape(8, 8)
+    futures = [pipeline.submit(frame + i) for i in range(8)]
+    results = [future.result(timeout=1) for future in futures]
+    pipeline.close()
+
+    for i, result in enumerate(results):
+        assert np.array_equal(result, 2 * (frame + i).astype(np.uint32))
+    # no more buffers than frames in flight, all returned to the pool
+    assert len(module.dma_pool._slabs) <= 2
+    assert len(module.dma_pool._free[module.dma_pool._slab_size(64)]) == len(module.dma_pool._slabs)
+
+
+def test_pipeline_failure_recycles_buffer(monkeypatch):
+    module = target_module(monkeypatch, FakeAccelerator(fail=True))
+    pipeline = AcceleratorPipeline(module, depth=1)
+    future = pipeline.submit(np.zeros((8, 8), dtype=np.uint8))
+
+    assert isinstance(future.exception(timeout=1), IOError)
+    pipeline.close()
+    assert len(module.dma_pool._free[module.dma_pool._slab_size(64)]) == 1
+
+
+def test_synchronous_call_during_pipeline(monkeypatch):
+    accelerator = FakeAccelerator()
+    module = target_module(monkeypatch, accelerator)
+    frame = np.ones((8, 8), dtype=np.uint8)
+    futures = [module.submit(frame) for _ in range(4)]
+    results = [module(frame) for _ in range(4)] + [future.result(timeout=1) for future in futures]
+    module.release()
+
+    assert accelerator.calls == 8 and accelerator.overlaps == 0
+    assert all(np.array_equal(result, 2 * frame.astype(np.uint32)) for result in results)
@@ -0,0 +1,232 @@
+import context
+
+import os
+import sys
+
+import pytest
+from skimage import data
+
+from tests.utils.basic_blocks import *
+from tests.test_emulator import build_module
+
+from sejits4fpgas.src.bitstream_cache import BitstreamCache
+from sejits4fpgas.src.errors import TransformationError
+from sejits4fpgas.src.jit_synth import VhdlSynthModule
+from sejits4fpgas.src.synthesis import SynthesisJob
+from sejits4fpgas.src.synthesis import SynthesisScheduler
+from sejits4fpgas.src.bb_library import block_instances
+from sejits4fpgas.src.synthesis import link_project
+from sejits4fpgas.src.utils import BASIC_BLOCK_PATH
+
+FAKE_SYNTHESIS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils", "fake_synthesis.py")
+
+TEMPLATE_TCL = """set origin_dir "."
+create_project template_project ./template_project
+set files [list \\
+]
+add_files -norecurse -fileset $obj $files
+"""
+
+
+def make_template(root):
+    template_dir = os.path.join(root, "template")
+    os.makedirs(os.path.join(template_dir, "template_project.srcs", "sources_1", "new"))
+    with open(os.path.join(template_dir, "template_project.tcl"), "w") as tcl_file:
+        tcl_file.write(TEMPLATE_TCL)
+    with open(os.path.join(template_dir, "template_project.srcs", "sources_1", "new", "top.vhd"), "w") as top:
+        top.write("-- top\n")
+    return template_dir
+
+
+def make_design(root, name):
+    path = os.path.join(root, name + ".vhd")
+    with open(path, "w") as vhdl_file:
+        vhdl_file.write("-- %s\n" % name)
+    return path
+
+
+def test_incremental_link(tmpdir):
+    root = str(tmpdir)
+    project_dir = make_template(root)
+    src_dir = os.path.join(project_dir, "template_project.srcs", "sources_1", "new")
+    a, b, c = [make_design(root, name) for name in ("a", "b", "c")]
+    link_project(project_dir, [a, b])
+    inodes = dict((name, os.stat(os.path.join(src_dir, name)).st_ino) for name in ("a.vhd", "b.vhd"))
+
+    with open(b, "a") as vhdl_file:
+        vhdl_file.write("-- changed\n")
+    link_project(project_dir, [a, b, c])
+
+    assert os.stat(os.path.join(src_dir, "a.vhd")).st_ino == inodes["a.vhd"]
+    assert open(os.path.join(src_dir, "b.vhd")).read() == open(b).read()
+    link_project(project_dir, [c])
+    assert sorted(os.listdir(src_dir)) == ["c.vhd", "top.vhd"]
+    with open(os.path.join(project_dir, "template_project.tcl")) as tcl_file:
+        tcl = tcl_file.read()
+    assert "new/c.vhd" in tcl and "new/a.vhd" not in tcl
+    assert 'set origin_dir "%s"\n' % os.path.abspath(project_dir) in tcl
+
+
+def test_project_sources_are_copies(tmpdir):
+    root = str(tmpdir)
+    project_dir = make_template(root)
+    a = make_design(root, "a")
+    link_project(project_dir, [a])
+    proj_file = os.path.join(project_dir, "template_project.srcs", "sources_1", "new", "a.vhd")
+
+    assert not os.path.samefile(a, proj_file)
+    with open(proj_file, "a") as vhdl_file:
+        vhdl_file.write("-- edited in the project\n")
+    assert open(a).read() == "-- a\n"
+
+
+def test_project_reuse(tmpdir):
+    root = str(tmpdir)
+    scheduler = SynthesisScheduler(template_dir=make_template(root),
+                                   work_dir=os.path.join(root, "work"),
+                                   tool_command="%s %s {project_dir}" % (sys.executable, FAKE_SYNTHESIS),
+                                   workers=2)
+    a, b = make_design(root, "a"), make_design(root, "b")
+    first = scheduler.submit("design", [a, b], project="kernel")
+    first.wait(timeout=60)
+    src_dir = os.path.join(first.project_dir, "template_project.srcs", "sources_1", "new")
+    inode = os.stat(os.path.join(src_dir, "a.vhd")).st_ino
+    bitstream = open(first.artifacts[0]).read()
+
+    with open(b, "a") as vhdl_file:
+        vhdl_file.write("-- changed\n")
+    second = scheduler.submit("design", [a, b], project="kernel")
+    second.wait(timeout=60)
+    scheduler.close()
+
+    # the second version of the kernel only copies its changed file
+    assert second.project_dir == first.project_dir == os.path.join(root, "work", "kernel")
+    assert os.stat(os.path.join(src_dir, "a.vhd")).st_ino == inode
+    assert open(second.artifacts[0]).read() != bitstream
+
+
+def test_project_in_use(tmpdir):
+    root = str(tmpdir)
+    scheduler = SynthesisScheduler(template_dir=make_template(root),
+                                   work_dir=os.path.join(root, "work"),
+                                   tool_command="%s %s {project_dir}" % (sys.executable, FAKE_SYNTHESIS),
+                                   workers=2)
+    scheduler._projects_in_use.add(os.path.join(root, "work", "kernel"))
+    job = scheduler.submit("design", [make_design(root, "design")], project="kernel")
+    job.wait(timeout=60)
+    scheduler.close()
+
+    # a running job keeps its project, the second job synthesizes in a new one
+    assert job.project is None
+    assert os.path.dirname(job.project_dir) == os.path.join(root, "work")
+    assert os.path.basename(job.project_dir).startswith("design-")
+
+
+def test_concurrent_jobs(tmpdir):
+    root = str(tmpdir)
+    states = []
+    scheduler = SynthesisScheduler(template_dir=make_template(root),
+                                   work_dir=os.path.join(root, "work"),
+                                   tool_command="%s %s {project_dir}" % (sys.executable, FAKE_SYNTHESIS),
+                                   workers=2,
+                                   progress=lambda job: states.append((job.name, job.state)))
+    jobs = [scheduler.submit("design%d" % i, [make_design(root, "design%d" % i)]) for i in range(3)]
+    artifacts = [job.wait(timeout=60) for job in jobs]
+    scheduler.close()
+
+    # every job synthesized its own project
+    assert len(set(job.project_dir for job in jobs)) == 3
+    assert len(set(open(paths[0]).read() for paths in artifacts)) == 3
+    with open(os.path.join(jobs[0].project_dir, "template_project.tcl")) as tcl_file:
+        assert "design0.vhd" in tcl_file.read()
+    assert scheduler.status()[SynthesisJob.DONE] == 3
+    assert ("design2", SynthesisJob.QUEUED) in states and ("design2", SynthesisJob.DONE) in states
+
+
+def test_failing_tool(tmpdir):
+    root = str(tmpdir)
+    scheduler = SynthesisScheduler(template_dir=make_template(root),
+                                   work_dir=os.path.join(root, "work"),
+                                   tool_command="%s -c 'import sys; sys.exit(3)'" % sys.executable,
+                                   workers=1)
+    job = scheduler.submit("design", [make_design(root, "design")])
+    with pytest.raises(TransformationError):
+        job.wait(timeout=60)
+    scheduler.close()
+    assert job.state == SynthesisJob.FAILED and job.returncode == 3
+    # the failed project is removed, its log is part of the error
+    assert not os.path.exists(job.project_dir)
+    assert "status 3" in str(job.error)
+
+
+def test_braces_in_tool_command(tmpdir):
+    root = str(tmpdir)
+    scheduler = SynthesisScheduler(template_dir=make_template(root),
+                                   work_dir=os.path.join(root, "work"),
+                                   tool_command="%s %s {project_dir} {unused}" % (sys.executable, FAKE_SYNTHESIS),
+                                   workers=1)
+    job = scheduler.submit("design", [make_design(root, "design")])
+    job.wait(timeout=60)
+    scheduler.close()
+
+    assert job.state == SynthesisJob.DONE
+
+
+def test_concurrent_activation(tmpdir):
+    root = str(tmpdir)
+    scheduler = SynthesisScheduler(template_dir=make_template(root),
+                                   work_dir=os.path.join(root, "work"),
+                                   tool_command="%s -c 'import time; time.sleep(0.2)'" % sys.executable,
+                                   workers=2)
+    modules = []
+    for i in range(2):
+        synth_module = VhdlSynthModule()
+        synth_module.synthesis_scheduler = scheduler
+        synth_module.bitstream_cache = BitstreamCache(os.path.join(root, "bitstreams"), "test")
+        synth_module._synthesis = ("key%d" % i, synth_module._activate("design%d" % i, [make_design(root, "d%d" % i)]))
+        modules.append(synth_module)
+    jobs = [synth_module._synthesis[1] for synth_module in modules]
+    for synth_module in modules:
+        synth_module.wait_synthesis(timeout=60)
+    scheduler.close()
+
+    # the second synthesis started before the first one finished
+    assert jobs[1].start_time < jobs[0].end_time
+    assert all(synth_module._synthesis is None for synth_module in modules)
+
+
+def test_out_of_context_checkpoints(tmpdir):
+    def test_func(a):
+        b = bb_mul(a, 3)
+        return bb_sub(b, a)
+
+    root = str(tmpdir)
+    module = build_module(test_func, data.camera())
+    instances = block_instances([module])
+    assert "MulBB" in set(entity for entity, _ in instances)
+
+    synth_module = VhdlSynthModule()
+    synth_module._link_in_module(module)
+    for name in sorted(os.listdir(BASIC_BLOCK_PATH)):
+        synth_module._link_in(os.path.join(BASIC_BLOCK_PATH, name))
+    synth_module._link_in(make_design(root, "generated"))
+    synth_module.checkpoint_cache = BitstreamCache(os.path.join(root, "checkpoints"), "test")
+    synth_module.synthesis_scheduler = SynthesisScheduler(
+        template_dir=make_template(root),
+        work_dir=os.path.join(root, "work"),
+        tool_command="%s %s {project_dir}" % (sys.executable, FAKE_SYNTHESIS),
+        ooc_tool_command="%s %s {project_dir}" % (sys.executable, FAKE_SYNTHESIS),
+        workers=2)
+
+    vhdl_files, scripts = synth_module._synthesize_blocks()
+    n_jobs = len(synth_module.synthesis_scheduler.jobs)
+    # a second design with the same instances reuses all checkpoints
+    assert synth_module._synthesize_blocks() == (vhdl_files, scripts)
+    synth_module.synthesis_scheduler.close()
+
+    assert n_jobs == len(synth_module.synthesis_scheduler.jobs) > 0
+    names = [os.path.basename(path) for path in vhdl_files]
+    assert "MulBB_stub.vhd" in names and "MulBB.vhd" not in names
+    assert "generated.vhd" in names
+    assert "read_checkpoint -cell $cell" in scripts["checkpoints.tcl"]
+
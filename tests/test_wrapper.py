@@ -0,0 +1,152 @@
+import context
+
+import os
+
+import numpy as np
+from skimage import data
+
+from tests.utils.basic_blocks import *
+from test_dma import on_target
+from test_emulator import build_module
+
+from sejits4fpgas.src.dma import DmaBufferPool
+from sejits4fpgas.src.dsl import gen_dsl_wrapper
+from sejits4fpgas.src.dsl import get_dsl_type
+from sejits4fpgas.src.dsl import get_pixel_width
+from sejits4fpgas.src.emulator import VhdlEmulator
+from sejits4fpgas.src.emulator import _bb_split
+from sejits4fpgas.src.jit_synth import VhdlSynthModule
+from sejits4fpgas.src.nodes import VhdlFile
+from sejits4fpgas.src.nodes import VhdlSignalSplit
+from sejits4fpgas.src.utils import BASIC_BLOCK_PATH
+
+
+def wrap(func, *args, **kwargs):
+    module = build_module(func, *args)
+    wrapper = gen_dsl_wrapper(get_dsl_type(args, 32), 32, VhdlFile("generated", body=[module]), **kwargs)
+    return wrapper.body[0], module
+
+
+def component(module, library):
+    stack = list(module.architecture)
+    while stack:
+        node = stack.pop()
+        if getattr(node, "library", None) == library:
+            return node
+        stack.extend(getattr(node, "prev", []))
+
+
+def deinterleave(words, n_io, width):
+    """Model of Deinterleave.vhd: word k of the stream is stored in lane k mod n_io."""
+    groups = np.asarray(words, dtype=np.uint64).reshape(-1, n_io)
+    return sum(groups[:, i] << (i * width) for i in range(n_io))
+
+
+def port(node, name):
+    return [p.value for p in node.in_port + node.out_port if p.name == name][0]
+
+
+def run_wrapper(wrapper, kernel, frames):
+    """Model of the lane packed wrapper: split the lanes of each word, run the kernel per lane and pack the results."""
+    words = DmaBufferPool(1).interleave(frames, wrapper.pixel_width).ravel()
+    lanes = deinterleave(words, len(frames), 32) if len(frames) > 1 else words.astype(np.uint64)
+    lane_results = {}
+    ret = wrapper.architecture[0]
+    for apply_component in ret.prev:
+        operands = []
+        for split in apply_component.prev:
+            generics = dict((g.name, g.value.value) for g in split.generic)
+            data_in = port(split, "DATA_IN")
+            shift = data_in.sig_slice.start if isinstance(data_in, VhdlSignalSplit) else 0
+            operands.append(_bb_split(generics, ((lanes >> shift) & 0xFFFFFFFF).astype(np.uint32)))
+        lane_results[id(port(apply_component, "MODULE_OUT"))] = VhdlEmulator(kernel).run(*operands).data
+    # the first signal of the concatenation holds the highest bits
+    packed = np.zeros(len(lanes), dtype=np.uint64)
+    for sig in port(ret, "RETURN_IN"):
+        width = sig.sig_slice.stop - sig.sig_slice.start
+        packed = (packed << width) | (lane_results[id(sig.sig)] & ((1 << width) - 1))
+    return packed.astype(np.uint32)
+
+
+def test_multi_input_wrapper():
+    def test_func(a, b):
+        return bb_sub(a, b)
+
+    img = data.camera()[:16, :16]
+    frames = [img, img[::-1]]
+    module, _ = wrap(test_func, *frames)
+    deinterleaver = component(module, "work.Deinterleave")
+    apply_component = component(module, "work.apply")
+
+    generics = dict((g.name, g.value.value) for g in deinterleaver.generic)
+    assert generics == {"WIDTH": 32, "N_IO": 2}
+    # each operand of the kernel reads the lane its frame is stored in
+    lanes = deinterleave(DmaBufferPool(1).interleave(frames).ravel(), 2, 32)
+    operands = [p.value.sig_slice for p in apply_component.in_port if p.name in ("a", "b")]
+    for frame, lane in zip(frames, operands):
+        received = (lanes >> lane.start) & ((1 << (lane.stop - lane.start)) - 1)
+        assert np.array_equal(received, frame.ravel())
+
+
+def test_deinterleave_reset_active_high():
+    # all blocks share the RST net of the wrapper
+    with open(os.path.join(BASIC_BLOCK_PATH, "Deinterleave.vhd")) as vhdl_file:
+        source = vhdl_file.read()
+
+    assert "RST = '1'" in source and "RST = '0'" not in source
+
+
+def test_pixel_width_from_dtype():
+    img = np.zeros(4, dtype=np.uint8)
+
+    assert get_pixel_width([img, img]) == 8
+    assert get_pixel_width([img.astype(np.uint16)]) == 16
+    assert get_pixel_width([img, img.astype(np.uint16)]) == 32
+    assert get_pixel_width([img.astype(np.int8)]) == 32
+    assert get_pixel_width([img.astype(np.float32)]) == 32
+
+
+def test_lane_packing(monkeypatch):
+    def test_func(a, b):
+        return bb_limitTo(8, bb_add(a, b))
+
+    frames = [data.camera()[:16, :15], data.camera()[16:32, :15]]
+    wrapper, kernel = wrap(test_func, *frames, pixel_width=get_pixel_width(frames))
+    ret = wrapper.architecture[0]
+
+    assert wrapper.pixel_width == 8 and len(ret.prev) == 4
+    for lane, apply_component in enumerate(ret.prev):
+        for split in apply_component.prev:
+            generics = dict((g.name, g.value.value) for g in split.generic)
+            assert generics == {"INDEX": lane, "LANE_WIDTH": 8}
+    # the host unpacks the result words written to the front of the DMA buffer
+    on_target(monkeypatch)
+    module = VhdlSynthModule()
+    module.pixel_width = wrapper.pixel_width
+    result = module._unpack(run_wrapper(wrapper, kernel, frames), frames)
+    assert result.dtype == np.uint8
+    assert np.array_equal(result, frames[0] + frames[1])
+
+
+def test_lane_packing_single_input():
+    def test_func(a):
+        return bb_limitTo(16, bb_mul(a, 3))
+
+    frame = data.camera()[:16, :16].astype(np.uint16)
+    wrapper, kernel = wrap(test_func, frame, pixel_width=16)
+    words = run_wrapper(wrapper, kernel, [frame])
+
+    assert len(wrapper.architecture[0].prev) == 2
+    assert np.array_equal(words.view(np.uint16), frame.ravel() * 3)
+
+
+def test_widen_on_overflow():
+    def test_func(a):
+        return bb_add(a, 10)
+
+    img = data.camera()[:16, :16]
+    wrapper, _ = wrap(test_func, img, pixel_width=8)
+
+    # 255 + 10 does not fit into 8 bit pixels
+    assert wrapper.pixel_width == 32
+    assert not component(wrapper, "work.split")
@@ -0,0 +1,5 @@
+"""Kernels of a module that does not define the basic blocks."""
+
+
+def add_ten(a):
+    return bb_add(a, 10)